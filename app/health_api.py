@@ -0,0 +1,23 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from core.warmup import warmup
+
+router = APIRouter()
+
+
+@router.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests (does not touch models or DB)."""
+    return JSONResponse({"status": "ok"}, status_code=status.HTTP_200_OK)
+
+
+@router.get("/readyz")
+def readyz():
+    """
+    Readiness: models warmed with a dummy inference, FAISS index loaded and the DB
+    answering. 503 while warming up or shutting down.
+    """
+    ready, detail = warmup.readiness()
+    return JSONResponse({"status": "ready" if ready else "not_ready", **detail},
+                        status_code=status.HTTP_200_OK if ready
+                        else status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from core.database import get_db
 from core.fastapi_util import api_response_data
 from core.constants import Result
 from db import models
+from core.manager.session_aggregates import get_session_aggregates
 from typing import List, Dict, Any
 
 router = APIRouter()
@@ -54,24 +54,18 @@ def get_class_summary_report(
     if not sessions:
         return api_response_data(Result.SUCCESS, reply=None)
 
-    session_ids = [s.id for s in sessions]
     total_sessions_count = len(sessions)
+    # Số liệu tổng hợp lưu sẵn trên từng buổi học (không quét bảng log)
+    aggregates = {s.id: get_session_aggregates(db, s) for s in sessions}
 
     # B. Tính toán Trend (Diễn biến qua từng buổi)
     # Mục tiêu: Vẽ biểu đồ đường thể hiện "Độ sôi nổi" của lớp qua các ngày
     session_trend = []
 
     for s in sessions:
-        # Đếm số lượng từng loại hành vi trong buổi này
-        # Kết quả ví dụ: [('hand-raising', 5), ('writing', 20), ...]
-        b_counts = db.query(
-            models.SessionBehaviorLog.behavior_type,
-            func.count(models.SessionBehaviorLog.id)
-        ).filter(
-            models.SessionBehaviorLog.session_id == s.id
-        ).group_by(models.SessionBehaviorLog.behavior_type).all()
-
-        b_dict = dict(b_counts)
+        # Số lượng từng loại hành vi trong buổi này
+        # Ví dụ: {'hand-raising': 5, 'writing': 20, ...}
+        b_dict = aggregates[s.id].behavior_counts
 
         # Công thức tính điểm Engagement (có thể tùy chỉnh trọng số)
         # Ví dụ: Giơ tay (x2 điểm), Viết/Đọc (x1 điểm)
@@ -90,19 +84,7 @@ def get_class_summary_report(
     # C. Thống kê chi tiết từng Sinh viên (Aggregate Student Stats)
     # Cần biết: Sinh viên đi học bao nhiêu buổi? Cảm xúc chủ đạo là gì? Hành vi thường làm là gì?
 
-    # Lấy toàn bộ log sinh viên trong danh sách session_ids này
-    # Join bảng StudentLog -> BehaviorLog để lấy thông tin session_id và behavior_type
-    raw_logs = db.query(
-        models.SessionStudentLog.student_name,
-        models.SessionStudentLog.emotion,
-        models.SessionBehaviorLog.behavior_type,
-        models.SessionBehaviorLog.session_id
-    ).join(models.SessionBehaviorLog)\
-     .filter(models.SessionBehaviorLog.session_id.in_(session_ids))\
-     .filter(models.SessionStudentLog.student_name != "Unknown")\
-     .all()
-
-    # Xử lý dữ liệu thô bằng Python (Aggregation)
+    # Gộp per_student_details của từng buổi theo tên sinh viên
     # Cấu trúc stu_stats:
     # {
     #   "Nguyen Van A": {
@@ -113,26 +95,28 @@ def get_class_summary_report(
     # }
     stu_stats: Dict[str, Dict[str, Any]] = {}
 
-    for row in raw_logs:
-        name, emo, beh, sid = row
-
-        if name not in stu_stats:
-            stu_stats[name] = {
-                "sessions_attended": set(),
-                "emotions": {},
-                "behaviors": {}
-            }
-
-        # Ghi nhận sự xuất hiện
-        stu_stats[name]["sessions_attended"].add(sid)
-
-        # Cộng dồn cảm xúc
-        stu_stats[name]["emotions"][emo] = stu_stats[name]["emotions"].get(
-            emo, 0) + 1
-
-        # Cộng dồn hành vi
-        stu_stats[name]["behaviors"][beh] = stu_stats[name]["behaviors"].get(
-            beh, 0) + 1
+    for sid, agg in aggregates.items():
+        for details in agg.per_student.values():
+            name = details["name"]
+            if name not in stu_stats:
+                stu_stats[name] = {
+                    "sessions_attended": set(),
+                    "emotions": {},
+                    "behaviors": {}
+                }
+
+            # Ghi nhận sự xuất hiện
+            stu_stats[name]["sessions_attended"].add(sid)
+
+            # Cộng dồn cảm xúc
+            for emo, n in details["emotions"].items():
+                stu_stats[name]["emotions"][emo] = stu_stats[name]["emotions"].get(
+                    emo, 0) + n
+
+            # Cộng dồn hành vi
+            for beh, n in details["behaviors"].items():
+                stu_stats[name]["behaviors"][beh] = stu_stats[name]["behaviors"].get(
+                    beh, 0) + n
 
     # Format danh sách kết quả trả về
     student_list = []
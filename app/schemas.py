@@ -77,6 +77,8 @@ class SessionBase(BaseModel):
     end_time: str
     student_count: Optional[int] = 0
     notes: Optional[str] = None
+    # fast / balanced / accurate (None = mặc định của hệ thống)
+    inference_profile: Optional[str] = None
 
 
 class SessionCreate(SessionBase):
@@ -93,6 +95,7 @@ class SessionUpdate(BaseModel):
     room: Optional[str] = None
     student_count: Optional[int] = None
     notes: Optional[str] = None
+    inference_profile: Optional[str] = None
 
 
 class SessionOut(SessionBase):
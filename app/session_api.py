@@ -1,4 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
 from core.database import get_db
@@ -6,10 +9,14 @@ from core.fastapi_util import api_response_data
 from core.constants import Result
 from app import schemas
 from db import models
-from core.manager import session_manager
+from core.manager import session_manager, job_manager
+from core.manager.session_aggregates import get_session_aggregates
 import shutil
 import os
+import json
+import asyncio
 from core.config import settings
+from core.inference_profiles import PROFILES, get_profile
 
 router = APIRouter()
 
@@ -22,11 +29,26 @@ def list_sessions(skip: int = 0, limit: int = 20, db: Session = Depends(get_db))
     sessions = session_manager.get_sessions(db, skip=skip, limit=limit)
     return api_response_data(Result.SUCCESS, sessions)
 
+
+@router.get("/profiles")
+def list_inference_profiles():
+    """Các inference profile có thể chọn cho một buổi học"""
+    return api_response_data(Result.SUCCESS, reply={
+        "default": get_profile().name,
+        "profiles": [p.to_dict() for p in PROFILES.values()]
+    })
+
+
+def _check_profile(name):
+    if name is not None and name not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown inference profile: {name}")
+
 # 2. Create Session
 
 
 @router.post("/")
 def create_session(session_in: schemas.SessionCreate, db: Session = Depends(get_db)):
+    _check_profile(session_in.inference_profile)
     new_session = session_manager.create_session(db, session_in)
     return api_response_data(Result.SUCCESS, new_session)
 
@@ -43,6 +65,9 @@ async def upload_video(
     session = session_manager.get_session(db, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    active_job = job_manager.get_active_job(db, session_id)
+    if active_job and active_job.status == "running":
+        raise HTTPException(status_code=409, detail="Session is being processed")
 
     # Tạo thư mục lưu trữ nếu chưa có
     video_dir = os.path.join(settings.UPLOAD_DIR, "videos")
@@ -59,23 +84,80 @@ async def upload_video(
     rel_path = f"uploads/videos/{safe_filename}"
     session.video_path = rel_path
     session.status = "queued"
-    db.commit()
+    # Video mới -> checkpoint của lần xử lý trước không còn giá trị
+    session_manager.clear_checkpoint(db, session_id)
+
+    if settings.JOB_QUEUE_ENABLED:
+        # Worker riêng (worker.py) xử lý -> không chiếm CPU của web worker
+        job_manager.enqueue_video_job(db, session_id, file_path)
+        db.commit()
+    else:
+        db.commit()
+        # Chạy background task xử lý AI
+        # Lưu ý: background task cần import đúng process_video_ai từ session_manager
+        background_tasks.add_task(
+            session_manager.process_video_ai,
+            session_id=session_id,
+            video_path=file_path
+        )
 
-    # Chạy background task xử lý AI
-    # Lưu ý: background task cần import đúng process_video_ai từ session_manager
+    return api_response_data(Result.SUCCESS, reply={
+        "message": "Upload successful. AI processing queued.",
+        "video_path": rel_path,
+        "status": "queued"
+    })
+
+# 3b. Resume / Retry processing
 
-    background_tasks.add_task(
-        session_manager.process_video_ai,
-        session_id=session_id,
-        video_path=file_path
-    )
 
+@router.post("/{session_id}/resume")
+def resume_processing(session_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """Chạy tiếp xử lý AI từ checkpoint cuối (sau khi lỗi hoặc server restart)"""
+    session = session_manager.get_session(db, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    file_path = session_manager.get_video_file_path(session)
+    if not file_path or not os.path.exists(file_path):
+        raise HTTPException(status_code=400, detail="Session has no uploaded video")
+    if session.status == "completed":
+        raise HTTPException(status_code=409, detail="Session already completed")
+
+    if settings.JOB_QUEUE_ENABLED:
+        # Job "running" có worker chết sẽ tự được worker khác nhận lại khi lease hết hạn
+        if job_manager.get_active_job(db, session_id):
+            raise HTTPException(status_code=409, detail="Session is already queued or being processed")
+        session.status = "queued"
+        job_manager.enqueue_video_job(db, session_id, file_path)
+        db.commit()
+    else:
+        if not session_manager.is_job_stale(db, session):
+            raise HTTPException(status_code=409, detail="Session is still being processed")
+        session.status = "queued"
+        db.commit()
+        background_tasks.add_task(
+            session_manager.process_video_ai,
+            session_id=session_id,
+            video_path=file_path
+        )
     return api_response_data(Result.SUCCESS, reply={
-        "message": "Upload successful. AI processing started in background.",
-        "video_path": rel_path,
+        "message": "AI processing resumed in background.",
         "status": "queued"
     })
 
+
+@router.post("/{session_id}/live/stop")
+def stop_live_session(session_id: int, db: Session = Depends(get_db)):
+    """Dừng phiên phân tích live (live.py) sau lô log hiện tại"""
+    session = session_manager.get_session(db, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not session_manager.request_live_stop(db, session):
+        raise HTTPException(status_code=409, detail="Session is not live")
+    return api_response_data(Result.SUCCESS, reply={
+        "message": "Live analysis is stopping.",
+        "status": "stopping"
+    })
+
 # 4. Get Timeline (For Replay)
 
 
@@ -90,33 +172,63 @@ def get_session_timeline(session_id: int, db: Session = Depends(get_db)):
              .all()
     return api_response_data(Result.SUCCESS, logs)
 
+# 4b. Live progress (Server-Sent Events)
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@router.get("/{session_id}/events")
+async def stream_session_events(session_id: int, request: Request, after_id: int = 0):
+    """
+    Luồng SSE cho trang chi tiết khi đang xử lý:
+    - progress: frames đã xử lý, % hoàn thành, ETA
+    - logs: CHỈ các log hành vi mới commit (id > after_id / lần gửi trước)
+    - done: khi job completed, hoặc failed và không còn lượt retry (đóng luồng)
+    """
+    async def event_stream():
+        last_id = after_id
+        last_progress = None
+        while not await request.is_disconnected():
+            progress, logs = await run_in_threadpool(
+                session_manager.poll_session_events, session_id, last_id)
+            if progress is None:
+                yield _sse("error", {"message": "Session not found"})
+                return
+            if logs:
+                last_id = logs[-1].id
+                yield _sse("logs", logs)
+            if progress != last_progress:
+                last_progress = progress
+                yield _sse("progress", progress)
+            else:
+                # Giữ kết nối qua proxy
+                yield ": keep-alive\n\n"
+            if progress["terminal"] and \
+                    (progress.get("last_log_id") or 0) <= last_id:
+                yield _sse("done", {"status": progress["status"]})
+                return
+            await asyncio.sleep(settings.SSE_POLL_SECONDS)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # 5. Get Statistics
 
 
 @router.get("/{session_id}/stats")
 def get_session_stats(session_id: int, db: Session = Depends(get_db)):
-    # Thống kê hành vi
-    behaviors = db.query(models.SessionBehaviorLog.behavior_type)\
-                  .filter(models.SessionBehaviorLog.session_id == session_id).all()
-
-    behavior_counts = {}
-    for b in behaviors:
-        bt = b[0]
-        behavior_counts[bt] = behavior_counts.get(bt, 0) + 1
-
-    # Thống kê cảm xúc (Join bảng)
-    emotions = db.query(models.SessionStudentLog.emotion)\
-                 .join(models.SessionBehaviorLog)\
-                 .filter(models.SessionBehaviorLog.session_id == session_id).all()
-
-    emotion_counts = {}
-    for e in emotions:
-        et = e[0]
-        emotion_counts[et] = emotion_counts.get(et, 0) + 1
+    session = session_manager.get_session(db, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    # Đọc số liệu tổng hợp đã lưu sẵn trên session (writer cộng dồn khi ghi log)
+    aggregates = get_session_aggregates(db, session)
 
     return api_response_data(Result.SUCCESS, reply={
-        "behavior_stats": behavior_counts,
-        "emotion_stats": emotion_counts
+        "behavior_stats": aggregates.behavior_counts,
+        "emotion_stats": aggregates.emotion_counts,
+        "unknown_stats": aggregates.unknown
     })
 
 # 6. Update Session
@@ -124,6 +236,7 @@ def get_session_stats(session_id: int, db: Session = Depends(get_db)):
 
 @router.put("/{session_id}")
 def update_session(session_id: int, session_in: schemas.SessionUpdate, db: Session = Depends(get_db)):
+    _check_profile(session_in.inference_profile)
     session = session_manager.get_session(db, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -152,7 +265,10 @@ def delete_session(session_id: int, db: Session = Depends(get_db)):
         db.query(models.SessionBehaviorLog)\
             .filter(models.SessionBehaviorLog.id.in_(log_ids))\
             .delete(synchronize_session=False)
-    # 4. Delete the session
+    # 4. Delete jobs, the resume checkpoint and the session
+    job_manager.delete_jobs_for_session(db, session_id)
+    session_manager.clear_checkpoint(db, session_id)
+    session_manager.delete_progress(db, session_id)
     db.delete(session)
     db.commit()
     return api_response_data(Result.SUCCESS, reply={"id": session_id, "deleted_behavior_logs": len(log_ids)})
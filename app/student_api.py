@@ -6,6 +6,12 @@ from sqlalchemy.orm import Session
 from typing import List
 from core.database import get_db
 from core.manager import student_manager
+from core.inference_profiles import get_profile
+from core.ai_loader import ai_engine
+from core import micro_batcher
+from core.result_cache import result_cache
+from db.vector_db import vector_db_instance
+from starlette.concurrency import run_in_threadpool
 from app import schemas
 router = AppRouter()
 
@@ -136,8 +142,44 @@ def delete_all_student_embeddings(student_id: int, db: Session = Depends(get_db)
     return api_response_data(Result.SUCCESS, reply={"cleared": result, "rebuild": rebuild})
 
 
+def _lookup_recognition(contents: bytes, inference):
+    """
+    (cache key, cached matches or None, decoded image on a miss). Runs in the thread pool:
+    reading the gallery generation may take the FAISS lock file and replay or reload the
+    index shared with the other workers.
+    """
+    # Matches depend on the gallery too: any VectorDB change bumps its generation
+    cache_key = ("recognize", result_cache.content_hash(contents),
+                 ai_engine.model_versions.get('identity'), inference.det_size,
+                 vector_db_instance.generation)
+    matches = result_cache.get(cache_key)
+    if matches is not None:
+        return cache_key, matches, None
+    return cache_key, None, student_manager.decode_image(contents)
+
+
 @router.post("/face/recognize")
-async def recognize_face(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Upload an image and attempt to identify student faces."""
-    result = student_manager.identify_student_from_image(db, file)
+async def recognize_face(file: UploadFile = File(...), profile: str | None = None,
+                         db: Session = Depends(get_db)):
+    """Upload an image and attempt to identify student faces (profile: fast, balanced, accurate)."""
+    try:
+        inference = get_profile(profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if ai_engine.identity_model is None:
+        return api_response_data(Result.SUCCESS, reply={"faces": [], "message": "Identity model not loaded"})
+    try:
+        contents = await file.read()
+        cache_key, matches, img = await run_in_threadpool(_lookup_recognition, contents, inference)
+        if matches is None:
+            if img is None:
+                return api_response_data(Result.SUCCESS, reply={"faces": [], "message": "Invalid image"})
+            # Detection + embedding batched with concurrent requests, search off the event loop
+            raw_faces = await micro_batcher.analyze_faces(img, inference)
+            matches = await run_in_threadpool(student_manager.search_faces, raw_faces)
+            result_cache.put(cache_key, matches)
+        # Student info is always read fresh (renames do not touch the gallery)
+        result = await run_in_threadpool(student_manager.attach_students, db, matches)
+    except Exception as e:
+        result = {"faces": [], "message": str(e)}
     return api_response_data(Result.SUCCESS, reply=result)
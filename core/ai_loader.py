@@ -1,42 +1,98 @@
 import os
-import torch
-from ultralytics import YOLO
-from torchvision import models
+import numpy as np
 from pathlib import Path
+from core.config import settings
+from core.lazy import LazyInstance
+from core.inference_profiles import get_profile
+from core.emotion_model import EMOTION_CLASSES, load_emotion_checkpoint, preprocess_emotion_batch
+from core.model_export import is_verified
+
+
+def onnx_artifact(models_dir: Path, stem: str):
+    """
+    Exported ONNX model for `stem` (see export_models.py) that passed the parity check
+    against PyTorch, or None. With ONNX_PREFER_INT8 the int8-quantized file wins when
+    both exist.
+    """
+    candidates = [models_dir / f"{stem}.onnx"]
+    if settings.ONNX_PREFER_INT8:
+        candidates.insert(0, models_dir / f"{stem}.int8.onnx")
+    for path in candidates:
+        if not path.exists():
+            continue
+        if is_verified(str(path)):
+            return str(path)
+        print(f"[WARN] Ignoring {path.name}: no passing parity check (run export_models.py).")
+    return None
+
+
+def model_file_version(path: str) -> str:
+    """Identifies a weights file (name, size, mtime) for result caches."""
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
 
 
 class AIEngine:
     def __init__(self):
+        # Heavy imports stay here so processes using the model server never load torch
+        import torch
+        from ultralytics import YOLO
+
         print("Loading AI Engine...")
         self.device = torch.device(
             "cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
 
+        # ONNX Runtime (CPU provider) beats eager PyTorch on CPU; on GPU keep torch
+        use_onnx = settings.ONNX_RUNTIME_ENABLED and self.device.type == "cpu"
+
         # 1. Load YOLOv8 (Behavior)
         base_dir = Path(__file__).resolve().parents[1]
         models_dir = base_dir / "models"
         yolo_path = str(models_dir / "yolov8_best.pt")
+        # Loaded weights per model (None = not loaded), part of result cache keys
+        self.model_versions = {'behavior': None, 'identity': None, 'emotion': None}
         self.behavior_model = None
-        try:
-            if os.path.exists(yolo_path):
-                self.behavior_model = YOLO(yolo_path)
-                print("YOLOv8 model loaded.")
-            else:
+        self.behavior_backend = None
+        yolo_onnx = onnx_artifact(models_dir, "yolov8_best") if use_onnx else None
+        if yolo_onnx:
+            try:
+                # Ultralytics runs .onnx through ONNX Runtime with the same pre/post-processing
+                self.behavior_model = YOLO(yolo_onnx, task="detect")
+                self.behavior_backend = "onnx"
+                self.model_versions['behavior'] = model_file_version(yolo_onnx)
+                print(f"YOLOv8 model loaded (ONNX Runtime: {os.path.basename(yolo_onnx)}).")
+            except Exception as e:
+                print(f"[WARN] Failed to load {yolo_onnx}: {e}. Falling back to PyTorch.")
+        if self.behavior_model is None:
+            try:
+                if os.path.exists(yolo_path):
+                    self.behavior_model = YOLO(yolo_path)
+                    self.behavior_backend = "torch"
+                    self.model_versions['behavior'] = model_file_version(yolo_path)
+                    print("YOLOv8 model loaded.")
+                else:
+                    print(
+                        f"[WARN] YOLO weights not found at {yolo_path}. Behavior detection disabled.")
+            except Exception as e:
                 print(
-                    f"[WARN] YOLO weights not found at {yolo_path}. Behavior detection disabled.")
-        except Exception as e:
-            print(
-                f"[WARN] Failed to load YOLOv8: {e}. Behavior detection disabled.")
+                    f"[WARN] Failed to load YOLOv8: {e}. Behavior detection disabled.")
 
         # 2. Load InsightFace (Identity) - optional
         self.identity_model = None
         try:
             import insightface  # lazy optional import
             provider = 'CUDAExecutionProvider' if self.device.type == 'cuda' else 'CPUExecutionProvider'
-            self.identity_model = insightface.app.FaceAnalysis(providers=[
-                                                               provider])
+            # Only detection + recognition are used: skip the landmark and
+            # gender/age models bundled with the pack
+            self.identity_model = insightface.app.FaceAnalysis(
+                allowed_modules=['detection', 'recognition'], providers=[provider])
+            det_size = get_profile().det_size
             self.identity_model.prepare(
-                ctx_id=0 if self.device.type == 'cuda' else -1, det_size=(640, 640))
+                ctx_id=0 if self.device.type == 'cuda' else -1, det_size=(det_size, det_size))
+            rec_model = self.identity_model.models.get('recognition')
+            self.model_versions['identity'] = (model_file_version(rec_model.model_file)
+                                               if rec_model is not None else "insightface")
             print("InsightFace model loaded.")
         except Exception as e:
             print(
@@ -45,27 +101,149 @@ class AIEngine:
         # 3. Load Emotion Model (ResNet18)
         emotion_path = str(models_dir / "best_resnet18_sgd.ckpt")
         self.emotion_model = None
-        try:
-            if os.path.exists(emotion_path):
-                self.emotion_model = models.resnet18(weights=None)
-                self.emotion_model.fc = torch.nn.Linear(
-                    self.emotion_model.fc.in_features, 7)
-                ckpt = torch.load(emotion_path, map_location=self.device)
-                state = ckpt.get("model", ckpt)
-                self.emotion_model.load_state_dict(state)
-                self.emotion_model.to(self.device)
-                self.emotion_model.eval()
-                print("Emotion model loaded.")
-            else:
+        self.emotion_backend = None
+        emotion_onnx = onnx_artifact(models_dir, "best_resnet18_sgd") if use_onnx else None
+        if emotion_onnx:
+            try:
+                import onnxruntime as ort
+                self.emotion_model = ort.InferenceSession(
+                    emotion_onnx, providers=["CPUExecutionProvider"])
+                self.emotion_backend = "onnx"
+                self.model_versions['emotion'] = model_file_version(emotion_onnx)
+                print(f"Emotion model loaded (ONNX Runtime: {os.path.basename(emotion_onnx)}).")
+            except Exception as e:
+                print(f"[WARN] Failed to load {emotion_onnx}: {e}. Falling back to PyTorch.")
+        if self.emotion_model is None:
+            try:
+                if os.path.exists(emotion_path):
+                    self.emotion_model = load_emotion_checkpoint(emotion_path, self.device)
+                    self.emotion_backend = "torch"
+                    self.model_versions['emotion'] = model_file_version(emotion_path)
+                    print("Emotion model loaded.")
+                else:
+                    print(
+                        f"[WARN] Emotion model checkpoint not found at {emotion_path}. Emotion classification disabled.")
+            except Exception as e:
                 print(
-                    f"[WARN] Emotion model checkpoint not found at {emotion_path}. Emotion classification disabled.")
-        except Exception as e:
-            print(
-                f"[WARN] Failed to load Emotion model: {e}. Emotion classification disabled.")
+                    f"[WARN] Failed to load Emotion model: {e}. Emotion classification disabled.")
+
+        self.emotion_classes = EMOTION_CLASSES
+
+    def detect_behaviors(self, frames, **yolo_kwargs):
+        """
+        Run YOLO once on a list of frames. Returns, per frame, a list of
+        {label, box, conf} dicts (results are in input order).
+        """
+        if self.behavior_model is None or not frames:
+            return [[] for _ in frames]
+        results = self.behavior_model(list(frames), verbose=False, **yolo_kwargs)
+        names = self.behavior_model.names
+        detections = []
+        for result in results:
+            boxes = result.boxes
+            xyxy = boxes.xyxy.cpu().numpy().astype(int)
+            confs = boxes.conf.cpu().numpy()
+            classes = boxes.cls.cpu().numpy().astype(int)
+            detections.append([
+                {'label': names[int(c)], 'box': list(b), 'conf': float(cf)}
+                for b, cf, c in zip(xyxy, confs, classes)
+            ])
+        return detections
+
+    def detect_faces(self, img, det_size: int | None = None):
+        """
+        Run face detection only (no embedding). Returns insightface Face objects.
+        det_size overrides the detector input size prepared at load time.
+        """
+        if self.identity_model is None:
+            return []
+        from insightface.app.common import Face
+        input_size = (det_size, det_size) if det_size else None
+        bboxes, kpss = self.identity_model.det_model.detect(
+            img, input_size=input_size, max_num=0, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            kps = kpss[i] if kpss is not None else None
+            faces.append(
+                Face(bbox=bboxes[i, 0:4], kps=kps, det_score=bboxes[i, 4]))
+        return faces
+
+    def _embed_pairs(self, pairs, max_batch: int = 64):
+        """
+        Fill face.embedding for (img, face) pairs, possibly from different images, with one
+        recognition forward pass per max_batch faces (ArcFaceONNX.get does one per face).
+        """
+        if self.identity_model is None:
+            return
+        rec_model = self.identity_model.models.get('recognition')
+        if rec_model is None:
+            return
+        from insightface.utils import face_align
+        pairs = [(img, face) for img, face in pairs if face.kps is not None]
+        size = rec_model.input_size[0]
+        for start in range(0, len(pairs), max_batch):
+            chunk = pairs[start:start + max_batch]
+            aligned = [face_align.norm_crop(img, landmark=face.kps, image_size=size)
+                       for img, face in chunk]
+            feats = rec_model.get_feat(aligned)
+            for (_, face), feat in zip(chunk, feats):
+                face.embedding = feat.flatten()
+
+    def embed_faces(self, img, faces):
+        """Fill face.embedding for faces returned by detect_faces (recognition model only)."""
+        self._embed_pairs([(img, face) for face in faces])
+        return faces
+
+    def analyze_faces(self, img, det_size: int | None = None):
+        """Detection + embedding at the given detector size (FaceAnalysis.get equivalent)."""
+        return self.embed_faces(img, self.detect_faces(img, det_size))
+
+    def analyze_faces_batch(self, images, det_size: int | None = None):
+        """
+        analyze_faces for several images: detection runs per image (the detector takes
+        one input at a time), the embeddings of all faces share batched forward passes.
+        Returns one face list per image.
+        """
+        faces_per_image = [self.detect_faces(img, det_size) for img in images]
+        self._embed_pairs([(img, face) for img, faces in zip(images, faces_per_image)
+                           for face in faces])
+        return faces_per_image
+
+    def _emotion_logits(self, inputs: np.ndarray) -> np.ndarray:
+        if self.emotion_backend == "onnx":
+            session = self.emotion_model
+            return session.run(None, {session.get_inputs()[0].name: inputs})[0]
+        import torch
+        with torch.no_grad():
+            return self.emotion_model(torch.from_numpy(inputs).to(self.device)).cpu().numpy()
+
+    def classify_emotions(self, crops, max_batch: int = 64):
+        """
+        Classify many BGR face crops with as few forward passes as possible
+        (one per max_batch crops). Returns one label per crop, or None for every
+        crop when the emotion model is not loaded.
+        """
+        if self.emotion_model is None:
+            return [None] * len(crops)
+        max_batch = max(1, int(max_batch))
+        labels = []
+        for start in range(0, len(crops), max_batch):
+            inputs = preprocess_emotion_batch(crops[start:start + max_batch])
+            predicted = self._emotion_logits(inputs).argmax(axis=1).tolist()
+            labels.extend(self.emotion_classes[i] for i in predicted)
+        return labels
+
 
-        self.emotion_transform = models.ResNet18_Weights.IMAGENET1K_V1.transforms()
-        self.emotion_classes = ["angry", "disgust",
-                                "fear", "happy", "neutral", "sad", "surprise"]
+def _create_engine():
+    """
+    Local models, or a thin client of the shared model server (model_server.py) when
+    MODEL_SERVER_SOCKET is set - then this process never loads the models itself.
+    """
+    if settings.MODEL_SERVER_SOCKET:
+        from core.model_client import RemoteAIEngine
+        return RemoteAIEngine(settings.MODEL_SERVER_SOCKET)
+    return AIEngine()
 
 
-ai_engine = AIEngine()
+# Built on first use (or by the startup warm-up, core/warmup.py), not at import
+ai_engine = LazyInstance(_create_engine, "AI engine")
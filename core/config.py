@@ -22,6 +22,31 @@ class Settings(BaseSettings):
     METADATA_FILE: str = str(_BASE_DIR / "assets" / "metadata.json")
     UPLOAD_DIR: str = str(_BASE_DIR / "assets" / "uploads")
     FAISS_THRESHOLD_COSINE: float = 0.6
+    # Append-only change log next to the index snapshot; folded into a new snapshot
+    # after this many records (and on web server shutdown)
+    FAISS_WAL_FILE: str = str(_BASE_DIR / "assets" / "faiss_index.wal")
+    FAISS_WAL_COMPACT_RECORDS: int = 1000
+    FAISS_WAL_FSYNC: bool = True
+    # Index kind: "flat" (exact), "hnsw", "ivf" or "auto" = flat until the gallery holds
+    # FAISS_APPROX_THRESHOLD vectors, then FAISS_APPROX_KIND (rebuilt in the background)
+    FAISS_INDEX_TYPE: str = "auto"
+    FAISS_APPROX_THRESHOLD: int = 50000
+    FAISS_APPROX_KIND: str = "hnsw"
+    # HNSW: graph degree, build-time and search-time candidate lists (higher = better recall)
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    FAISS_HNSW_EF_SEARCH: int = 128
+    # IVF-Flat: number of clusters (0 = 4 * sqrt(vectors)) and clusters probed per search
+    FAISS_IVF_NLIST: int = 0
+    FAISS_IVF_NPROBE: int = 16
+    # HNSW cannot delete: rebuild once this fraction of stored vectors is tombstoned
+    FAISS_TOMBSTONE_REBUILD_RATIO: float = 0.2
+    # Serve the snapshot index memory-mapped (read-only): every worker shares the same
+    # pages instead of holding its own copy
+    FAISS_MMAP_ENABLED: bool = True
+    # How often a search checks the snapshot/log files for other workers' changes
+    # (0 = before every search; the check is two stat calls)
+    FAISS_SYNC_CHECK_SECONDS: float = 0.0
     LOGGER_CONFIG: ClassVar[Dict[str, Any]] = {
         'log_dir': 'log'
     }
@@ -39,6 +64,128 @@ class Settings(BaseSettings):
     DB_POOL_SIZE: int = 5
     DB_MAX_OVERFLOW: int = 10
 
+    # Video processing pipeline (decode -> detect -> identify -> DB writer)
+    PIPELINE_ENABLED: bool = True
+    # Max items waiting between two stages (backpressure, keeps memory flat)
+    PIPELINE_QUEUE_SIZE: int = 8
+    # "thread" or "process". Ultralytics predictors are not thread-safe, so
+    # PIPELINE_DETECT_WORKERS > 1 requires "process" mode.
+    PIPELINE_STAGE_MODE: str = "thread"
+    PIPELINE_DETECT_WORKERS: int = 1
+    PIPELINE_IDENTITY_WORKERS: int = 1
+    # Split one video into time segments processed by this many worker processes
+    # (each loads its own models). 1 = process the whole video in-process.
+    VIDEO_SEGMENT_WORKERS: int = 1
+    # Do not create segments shorter than this (seconds of video)
+    VIDEO_SEGMENT_MIN_SECONDS: float = 120
+    # Buffered log writer: commit once this many behavior + student rows are pending
+    LOG_WRITE_BATCH_ROWS: int = 500
+    # ...or at least every N seconds of processed video; each commit also
+    # persists the resumable checkpoint
+    CHECKPOINT_INTERVAL_SECONDS: float = 30
+    # ...or every N wall-clock seconds, so live progress (SSE) stays fresh
+    PROGRESS_INTERVAL_SECONDS: float = 3.0
+    # SSE stream: how often the server checks the progress row
+    SSE_POLL_SECONDS: float = 1.0
+    # A "processing" job with no checkpoint update for this long is considered dead
+    CHECKPOINT_STALE_SECONDS: float = 600
+    # How skipped frames are consumed: "grab", "seek" or "auto"
+    VIDEO_SAMPLING_STRATEGY: str = "auto"
+    # "auto" switches to seeking once the sampling interval reaches this many frames
+    VIDEO_SEEK_MIN_INTERVAL: int = 90
+    # Motion-driven sampling between ADAPTIVE_MIN_RATE and ADAPTIVE_MAX_RATE frames/second
+    ADAPTIVE_SAMPLING_ENABLED: bool = False
+    ADAPTIVE_MIN_RATE: float = 0.2
+    ADAPTIVE_MAX_RATE: float = 2.0
+    # Mean absolute thumbnail difference (0-1) that counts as activity
+    ADAPTIVE_MOTION_THRESHOLD: float = 0.02
+    # Keep sampling at max rate for this long after an activity burst
+    ADAPTIVE_HOLD_SECONDS: float = 3.0
+    # Default inference profile ("fast", "balanced", "accurate"); sessions and
+    # test/recognition endpoints can override it per request
+    INFERENCE_PROFILE: str = "balanced"
+    # Number of sampled frames sent to YOLO in a single call (1 = no batching)
+    YOLO_BATCH_SIZE: int = 8
+    # "crop": run InsightFace on every behavior crop (legacy)
+    # "frame": one InsightFace pass per sampled frame, faces joined to behavior boxes
+    FACE_PASS_MODE: str = "crop"
+    # Minimum fraction of a face box that must lie inside a behavior box to belong to it
+    FACE_BOX_MIN_CONTAINMENT: float = 0.5
+    # Classify the emotion of every identified face (ResNet18), batched across frames
+    EMOTION_ENABLED: bool = True
+    # Maximum face crops per emotion forward pass
+    EMOTION_MAX_BATCH: int = 64
+    # Track faces/behavior boxes across sampled frames and resolve identity once per track
+    # (uses a full-frame face pass, regardless of FACE_PASS_MODE)
+    FACE_TRACKING_ENABLED: bool = False
+    TRACK_IOU_THRESHOLD: float = 0.3
+    # Sampled frames a track may go unseen before it is dropped
+    TRACK_MAX_AGE: int = 5
+    # Embeddings majority-voted before a track's identity is trusted
+    TRACK_IDENTITY_VOTES: int = 3
+    # Re-embed a resolved track every N sampled frames
+    TRACK_REVERIFY_INTERVAL: int = 30
+    # Behavior label of a tracked box = majority over its last N sampled frames (1 = raw label)
+    TRACK_LABEL_WINDOW: int = 5
+
+    # Video job queue (worker.py). When disabled, uploads run in FastAPI BackgroundTasks.
+    JOB_QUEUE_ENABLED: bool = True
+    # Number of jobs processed in parallel by one worker.py (one process each)
+    WORKER_CONCURRENCY: int = 1
+    JOB_POLL_SECONDS: float = 2.0
+    # A job whose lease is not renewed within this time is taken over by another worker
+    JOB_LEASE_SECONDS: int = 120
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BACKOFF_SECONDS: float = 30
+
+    # Live camera analysis (live.py)
+    # Frames analysed per second; newer frames replace older ones while analysis is busy
+    LIVE_SAMPLE_RATE: float = 1.0
+    # Frames older than this when they reach detection are skipped (bounded latency)
+    LIVE_MAX_LAG_SECONDS: float = 3.0
+    # Commit detections at least this often so the UI sees them right away
+    LIVE_FLUSH_SECONDS: float = 1.0
+    # Pipeline queue size between stages in live mode
+    LIVE_QUEUE_SIZE: int = 1
+    # How often the live loop checks whether the session was asked to stop
+    LIVE_STOP_CHECK_SECONDS: float = 2.0
+
+    # Prefer ONNX Runtime (CPU) for YOLO and the emotion model when the artifacts from
+    # export_models.py exist in models/ (ignored on GPU)
+    ONNX_RUNTIME_ENABLED: bool = True
+    # Prefer the int8 dynamically quantized artifacts (*.int8.onnx) when present
+    ONNX_PREFER_INT8: bool = False
+
+    # Shared model server (model_server.py). When set, this process sends inference
+    # requests to the server over this Unix socket instead of loading the models itself.
+    MODEL_SERVER_SOCKET: str = ""
+    # Shared secret of the socket handshake (requests are pickles: anyone holding the key
+    # can run code in the server). Empty = the server generates a random key at start-up
+    # into MODEL_SERVER_AUTHKEY_FILE (default "<socket>.key", mode 0600) and clients read it.
+    MODEL_SERVER_AUTHKEY: str = ""
+    MODEL_SERVER_AUTHKEY_FILE: str = ""
+    MODEL_SERVER_TIMEOUT_SECONDS: float = 60
+
+    # Start-up warm-up of the web app (core/warmup.py): tables, FAISS index and, when
+    # enabled, the models with a dummy inference. /readyz stays 503 until it is done.
+    # Disabled -> models load lazily on the first request that needs them.
+    WARMUP_MODELS_ON_STARTUP: bool = True
+    WARMUP_RETRY_SECONDS: float = 10
+    # Side of the blank image used for the dummy inference
+    WARMUP_IMAGE_SIZE: int = 320
+
+    # Micro-batching of /api/test/* and /api/students/face/recognize (core/micro_batcher.py):
+    # requests arriving within MICRO_BATCH_MAX_WAIT_MS share one inference call
+    MICRO_BATCH_MAX_SIZE: int = 8
+    MICRO_BATCH_MAX_WAIT_MS: float = 5
+
+    # Result cache of the same endpoints, keyed by image hash + model versions + parameters
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_MAX_ENTRIES: int = 256
+    # Optional directory for a disk-backed cache shared by all workers ("" = memory only)
+    RESULT_CACHE_DIR: str = ""
+    RESULT_CACHE_DISK_MAX_ENTRIES: int = 5000
+
     # CORS and Request ID
     CORS_ALLOW_ORIGINS: list[str] = ["*"]
     CORS_ALLOW_CREDENTIALS: bool = True
@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+
+
+EMOTION_CLASSES = ["angry", "disgust", "fear", "happy", "neutral", "sad", "surprise"]
+INPUT_SIZE = 224
+# ImageNet normalisation, applied to the whole (N, H, W, 3) batch at once
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def _resize(crop) -> np.ndarray:
+    # INTER_AREA when shrinking: antialiased like PIL's bilinear resize used in training
+    shrink = crop.shape[0] > INPUT_SIZE or crop.shape[1] > INPUT_SIZE
+    return cv2.resize(crop, (INPUT_SIZE, INPUT_SIZE),
+                      interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+
+
+def preprocess_emotion_batch(crops) -> np.ndarray:
+    """BGR face crops -> normalised float32 array (N, 3, 224, 224), without PIL."""
+    batch = np.stack([_resize(crop) for crop in crops])
+    # BGR -> RGB, scale to [0, 1] and normalise in one vectorised pass
+    batch = (batch[..., ::-1].astype(np.float32) / 255.0 - MEAN) / STD
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+
+def load_emotion_checkpoint(path: str, device):
+    """ResNet18 with a 7-class head, loaded from the training checkpoint (eval mode)."""
+    import torch
+    from torchvision import models
+    model = models.resnet18(weights=None)
+    model.fc = torch.nn.Linear(model.fc.in_features, len(EMOTION_CLASSES))
+    ckpt = torch.load(path, map_location=device)
+    state = ckpt.get("model", ckpt)
+    model.load_state_dict(state)
+    model.to(device)
+    model.eval()
+    return model
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def as_boxes(boxes) -> np.ndarray:
+    """Coerce a list/array of x1,y1,x2,y2 boxes into a float32 (N, 4) array."""
+    return np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+
+
+def box_area(boxes: np.ndarray) -> np.ndarray:
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def intersection_area(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise intersection areas, shape (len(a), len(b))."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    return np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+
+def box_iou(a, b) -> np.ndarray:
+    """Pairwise IoU matrix, shape (len(a), len(b))."""
+    a, b = as_boxes(a), as_boxes(b)
+    inter = intersection_area(a, b)
+    union = box_area(a)[:, None] + box_area(b)[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+def box_containment(inner, outer) -> np.ndarray:
+    """
+    Pairwise fraction of each inner box covered by each outer box, shape (len(inner), len(outer)).
+    1.0 means the inner box lies entirely inside the outer box.
+    """
+    inner, outer = as_boxes(inner), as_boxes(outer)
+    inter = intersection_area(inner, outer)
+    area = box_area(inner)[:, None]
+    return np.where(area > 0, inter / np.maximum(area, 1e-6), 0.0)
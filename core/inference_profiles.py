@@ -0,0 +1,55 @@
+from core.config import settings
+
+
+class InferenceProfile:
+    """
+    Named speed/accuracy trade-off applied to one video job or API request.
+
+    - det_size: InsightFace detector input (square), smaller = faster, misses small faces
+    - yolo_imgsz / yolo_conf / yolo_iou: YOLO letterbox size and NMS thresholds
+    - sample_rate: analysed frames per second of video (fixed-rate sampling)
+    """
+
+    def __init__(self, name: str, det_size: int, yolo_imgsz: int, yolo_conf: float,
+                 yolo_iou: float, sample_rate: float):
+        self.name = name
+        self.det_size = det_size
+        self.yolo_imgsz = yolo_imgsz
+        self.yolo_conf = yolo_conf
+        self.yolo_iou = yolo_iou
+        self.sample_rate = sample_rate
+
+    def yolo_kwargs(self) -> dict:
+        return {'imgsz': self.yolo_imgsz, 'conf': self.yolo_conf, 'iou': self.yolo_iou}
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'det_size': self.det_size,
+            'yolo_imgsz': self.yolo_imgsz,
+            'yolo_conf': self.yolo_conf,
+            'yolo_iou': self.yolo_iou,
+            'sample_rate': self.sample_rate
+        }
+
+
+PROFILES = {
+    # Routine sessions on CPU: ~4x fewer detector pixels, half the sampled frames
+    "fast": InferenceProfile("fast", det_size=320, yolo_imgsz=416, yolo_conf=0.35,
+                             yolo_iou=0.6, sample_rate=0.5),
+    # Previous fixed behaviour (InsightFace 640, Ultralytics defaults, 1 frame/s)
+    "balanced": InferenceProfile("balanced", det_size=640, yolo_imgsz=640, yolo_conf=0.25,
+                                 yolo_iou=0.7, sample_rate=1.0),
+    # Large rooms / small faces in the back rows
+    "accurate": InferenceProfile("accurate", det_size=960, yolo_imgsz=960, yolo_conf=0.2,
+                                 yolo_iou=0.7, sample_rate=2.0),
+}
+
+
+def get_profile(name: str | None = None) -> InferenceProfile:
+    """Profile by name; None -> settings.INFERENCE_PROFILE. Raises ValueError if unknown."""
+    name = name or settings.INFERENCE_PROFILE
+    if name not in PROFILES:
+        raise ValueError(
+            f"Unknown inference profile '{name}' (expected one of: {', '.join(PROFILES)})")
+    return PROFILES[name]
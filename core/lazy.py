@@ -0,0 +1,42 @@
+import threading
+
+
+class LazyInstance:
+    """
+    Module-level singleton that is only built on first use.
+
+    Attribute access is forwarded to the instance created by `factory()`, so
+    `from core.ai_loader import ai_engine` keeps working while importing the module
+    stays cheap. Construction happens once even under concurrent first access; if the
+    factory raises, the next access tries again.
+    """
+
+    def __init__(self, factory, name: str):
+        self._factory = factory
+        self._name = name
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    print(f"Loading {self._name}...")
+                    self._instance = self._factory()
+                instance = self._instance
+        return instance
+
+    def __getattr__(self, item):
+        # Only called for names not set in __init__ -> everything of the wrapped object
+        if item.startswith('__'):
+            raise AttributeError(item)
+        return getattr(self.get(), item)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyInstance {self._name} ({state})>"
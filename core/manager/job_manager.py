@@ -0,0 +1,220 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import Session
+from db import models
+from core.config import settings
+from core.database import SessionLocal
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def get_active_job(db: Session, session_id: int):
+    """Job đang chờ hoặc đang chạy của một buổi học (tối đa một job)"""
+    return db.query(models.VideoJob).filter(
+        models.VideoJob.active_session_id == session_id).first()
+
+
+def enqueue_video_job(db: Session, session_id: int, video_path: str):
+    """
+    Đưa video vào hàng đợi xử lý. Nếu session đã có job đang chờ thì cập nhật job đó
+    (video mới nhất thắng). Không commit - để caller commit cùng thay đổi của session.
+    """
+    job = get_active_job(db, session_id)
+    if job is None:
+        job = models.VideoJob(session_id=session_id,
+                              active_session_id=session_id)
+        db.add(job)
+    elif job.status == "running":
+        raise ValueError(f"Session {session_id} is being processed")
+    job.video_path = video_path
+    job.status = "queued"
+    job.attempts = 0
+    job.max_attempts = settings.JOB_MAX_ATTEMPTS
+    job.available_at = datetime.utcnow()
+    job.lease_owner = None
+    job.lease_expires_at = None
+    job.last_error = None
+    return job
+
+
+def delete_jobs_for_session(db: Session, session_id: int):
+    db.query(models.VideoJob).filter(
+        models.VideoJob.session_id == session_id).delete(synchronize_session=False)
+
+
+def _claimable(now: datetime):
+    """Job đang chờ tới lượt, hoặc đang 'running' nhưng lease đã hết hạn (worker chết)"""
+    return or_(
+        and_(models.VideoJob.status == "queued",
+             models.VideoJob.available_at <= now),
+        and_(models.VideoJob.status == "running",
+             models.VideoJob.lease_expires_at < now),
+    )
+
+
+def claim_next_job(db: Session, worker_id: str):
+    """
+    Lấy một job bằng compare-and-set (UPDATE ... WHERE còn claimable): nếu hai worker
+    cùng nhắm một job thì chỉ một UPDATE thành công (rowcount == 1).
+    """
+    now = datetime.utcnow()
+    candidates = db.query(models.VideoJob.id)\
+        .filter(_claimable(now))\
+        .order_by(models.VideoJob.created_at)\
+        .limit(10).all()
+    for (job_id,) in candidates:
+        updated = db.query(models.VideoJob)\
+            .filter(models.VideoJob.id == job_id, _claimable(now))\
+            .update({
+                models.VideoJob.status: "running",
+                models.VideoJob.lease_owner: worker_id,
+                models.VideoJob.lease_expires_at: now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+                models.VideoJob.attempts: models.VideoJob.attempts + 1,
+            }, synchronize_session=False)
+        db.commit()
+        if updated != 1:
+            continue
+        job = db.get(models.VideoJob, job_id)
+        if job.attempts > job.max_attempts:
+            # Lease hết hạn quá nhiều lần (worker bị kill giữa chừng liên tục)
+            finish_job(db, job, worker_id, False, "Lease expired too many times")
+            continue
+        return job
+    return None
+
+
+def renew_lease(db: Session, job_id: int, worker_id: str) -> bool:
+    """Gia hạn lease; False nếu job đã bị worker khác lấy mất"""
+    updated = db.query(models.VideoJob)\
+        .filter(models.VideoJob.id == job_id,
+                models.VideoJob.lease_owner == worker_id,
+                models.VideoJob.status == "running")\
+        .update({models.VideoJob.lease_expires_at: datetime.utcnow() + timedelta(seconds=settings.JOB_LEASE_SECONDS)},
+                synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+
+def finish_job(db: Session, job: models.VideoJob, worker_id: str, success: bool,
+               error: str | None = None) -> bool:
+    """
+    Kết thúc job: done, hoặc xếp hàng lại với backoff, hoặc failed khi hết số lần thử.
+    Compare-and-set trên lease_owner: worker đã mất lease (job bị worker khác lấy lại)
+    không ghi đè trạng thái của chủ mới. Trả về False trong trường hợp đó.
+    """
+    values = {
+        models.VideoJob.lease_owner: None,
+        models.VideoJob.lease_expires_at: None,
+    }
+    session_status = None
+    if success:
+        values[models.VideoJob.status] = "done"
+        values[models.VideoJob.active_session_id] = None
+    elif job.attempts < job.max_attempts:
+        backoff = settings.JOB_RETRY_BACKOFF_SECONDS * (2 ** (job.attempts - 1))
+        values[models.VideoJob.status] = "queued"
+        values[models.VideoJob.last_error] = error
+        values[models.VideoJob.available_at] = datetime.utcnow() + timedelta(seconds=backoff)
+        session_status = "queued"
+    else:
+        values[models.VideoJob.status] = "failed"
+        values[models.VideoJob.last_error] = error
+        values[models.VideoJob.active_session_id] = None
+        session_status = "failed"
+    updated = db.query(models.VideoJob)\
+        .filter(models.VideoJob.id == job.id,
+                models.VideoJob.lease_owner == worker_id)\
+        .update(values, synchronize_session=False)
+    if updated != 1:
+        db.rollback()
+        print(f"[WARN] Worker {worker_id} no longer owns job {job.id}, result discarded")
+        return False
+    if session_status is not None:
+        session = db.get(models.ClassSession, job.session_id)
+        if session:
+            session.status = session_status
+    db.commit()
+    db.refresh(job)
+    return True
+
+
+def _heartbeat(job_id: int, worker_id: str, stop: threading.Event, lost: threading.Event):
+    """
+    Thread gia hạn lease định kỳ trong lúc job chạy (DB session riêng).
+    Khi mất lease (worker khác đã lấy lại job, hoặc không gia hạn được trước khi lease
+    hết hạn) thì set `lost` để job đang chạy dừng lại mà không commit thêm gì.
+    """
+    interval = max(1.0, settings.JOB_LEASE_SECONDS / 3)
+    renewed_at = time.monotonic()
+    while not stop.wait(interval):
+        db = SessionLocal()
+        try:
+            if not renew_lease(db, job_id, worker_id):
+                print(f"[WARN] Worker {worker_id} lost lease on job {job_id}, aborting it")
+                lost.set()
+                return
+            renewed_at = time.monotonic()
+        except Exception as e:
+            print(f"[WARN] Failed to renew lease on job {job_id}: {e}")
+            if time.monotonic() - renewed_at >= settings.JOB_LEASE_SECONDS:
+                print(f"[WARN] Lease on job {job_id} expired, aborting it")
+                lost.set()
+                return
+        finally:
+            db.close()
+
+
+def run_job(db: Session, job: models.VideoJob, worker_id: str):
+    # Import muộn: chỉ process worker mới cần load model
+    from core.manager import session_manager
+
+    print(f"Worker {worker_id} picked job {job.id} (session {job.session_id}, attempt {job.attempts})")
+    stop = threading.Event()
+    lost = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(
+        job.id, worker_id, stop, lost), daemon=True)
+    heartbeat.start()
+    try:
+        ok = session_manager.process_video_ai(
+            session_id=job.session_id, video_path=job.video_path, cancel=lost)
+        error = None if ok else "process_video_ai failed (see worker log)"
+    except Exception as e:
+        ok, error = False, str(e)
+    finally:
+        stop.set()
+        heartbeat.join(timeout=5)
+    if lost.is_set():
+        # Worker khác đang chạy job này: không đụng tới job/session nữa
+        print(f"Worker {worker_id} abandoned job {job.id} after losing its lease")
+        return
+    db.refresh(job)
+    finish_job(db, job, worker_id, ok, error)
+
+
+def default_worker_id(slot: int = 0) -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{slot}"
+
+
+def run_worker(worker_id: str, stop: threading.Event | None = None):
+    """Vòng lặp của một slot worker: lấy job -> xử lý -> lặp lại"""
+    stop = stop or threading.Event()
+    print(f"Video worker {worker_id} started.")
+    while not stop.is_set():
+        db = SessionLocal()
+        try:
+            job = claim_next_job(db, worker_id)
+            if job is None:
+                db.close()
+                stop.wait(settings.JOB_POLL_SECONDS)
+                continue
+            run_job(db, job, worker_id)
+        except Exception as e:
+            print(f"[WARN] Worker {worker_id} error: {e}")
+            db.rollback()
+            time.sleep(settings.JOB_POLL_SECONDS)
+        finally:
+            db.close()
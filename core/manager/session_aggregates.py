@@ -0,0 +1,116 @@
+import json
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db import models
+
+
+def _load(text, default):
+    if not text:
+        return default
+    try:
+        return json.loads(text)
+    except ValueError:
+        return default
+
+
+def _inc(counts: dict, key, n: int = 1):
+    counts[key] = counts.get(key, 0) + n
+
+
+class SessionAggregates:
+    """
+    Số liệu tổng hợp của một buổi học, lưu dạng JSON trên ClassSession:
+    - behavior_counts: {hành vi: số log}
+    - emotion_counts: {cảm xúc: số khuôn mặt}
+    - per_student_details: {student_id: {name, total, behaviors: {...}, emotions: {...}}}
+    - unknown_counts: {total, behaviors: {...}, emotions: {...}} cho khuôn mặt không nhận ra
+    Writer cộng dồn khi ghi log nên API thống kê/báo cáo chỉ cần đọc lại (không quét log).
+    """
+
+    def __init__(self, behavior_counts=None, emotion_counts=None,
+                 per_student=None, unknown=None):
+        self.behavior_counts = behavior_counts or {}
+        self.emotion_counts = emotion_counts or {}
+        self.per_student = per_student or {}
+        self.unknown = unknown or {"total": 0, "behaviors": {}, "emotions": {}}
+
+    @classmethod
+    def from_session(cls, session: models.ClassSession):
+        return cls(_load(session.behavior_counts, {}),
+                   _load(session.emotion_counts, {}),
+                   _load(session.per_student_details, {}),
+                   _load(session.unknown_counts, None))
+
+    @staticmethod
+    def is_stored(session: models.ClassSession) -> bool:
+        return session.behavior_counts is not None
+
+    @property
+    def total_detections(self) -> int:
+        return sum(self.behavior_counts.values())
+
+    def add_behavior(self, behavior: str, n: int = 1):
+        _inc(self.behavior_counts, behavior, n)
+
+    def add_face(self, student_id, student_name, behavior: str, emotion: str, n: int = 1):
+        _inc(self.emotion_counts, emotion, n)
+        if student_id:
+            # Khoá JSON luôn là chuỗi
+            stu = self.per_student.setdefault(str(student_id), {
+                "name": student_name, "total": 0, "behaviors": {}, "emotions": {}})
+            stu["name"] = student_name
+        else:
+            stu = self.unknown
+        stu["total"] += n
+        _inc(stu["behaviors"], behavior, n)
+        _inc(stu["emotions"], emotion, n)
+
+    def store(self, session: models.ClassSession):
+        session.behavior_counts = json.dumps(self.behavior_counts)
+        session.emotion_counts = json.dumps(self.emotion_counts)
+        session.per_student_details = json.dumps(self.per_student, ensure_ascii=False)
+        session.unknown_counts = json.dumps(self.unknown)
+
+
+def rebuild_session_aggregates(db: Session, session: models.ClassSession) -> SessionAggregates:
+    """
+    Tính lại toàn bộ từ bảng log bằng GROUP BY trong DB (dùng khi chạy tiếp từ checkpoint
+    hoặc cho buổi học xử lý trước khi có aggregates). Không commit.
+    """
+    aggregates = SessionAggregates()
+    for behavior, n in db.query(
+            models.SessionBehaviorLog.behavior_type,
+            func.count(models.SessionBehaviorLog.id))\
+            .filter(models.SessionBehaviorLog.session_id == session.id)\
+            .group_by(models.SessionBehaviorLog.behavior_type).all():
+        aggregates.add_behavior(behavior, n)
+
+    for student_id, student_name, behavior, emotion, n in db.query(
+            models.SessionStudentLog.student_id,
+            models.SessionStudentLog.student_name,
+            models.SessionBehaviorLog.behavior_type,
+            models.SessionStudentLog.emotion,
+            func.count(models.SessionStudentLog.id))\
+            .join(models.SessionBehaviorLog)\
+            .filter(models.SessionBehaviorLog.session_id == session.id)\
+            .group_by(models.SessionStudentLog.student_id,
+                      models.SessionStudentLog.student_name,
+                      models.SessionBehaviorLog.behavior_type,
+                      models.SessionStudentLog.emotion).all():
+        aggregates.add_face(student_id, student_name, behavior, emotion, n)
+
+    aggregates.store(session)
+    return aggregates
+
+
+def get_session_aggregates(db: Session, session: models.ClassSession) -> SessionAggregates:
+    """Đọc aggregates đã lưu; buổi học cũ (chưa có) được tính lại một lần rồi lưu luôn"""
+    if SessionAggregates.is_stored(session):
+        return SessionAggregates.from_session(session)
+    aggregates = rebuild_session_aggregates(db, session)
+    db.commit()
+    return aggregates
+
+
+def reset_session_aggregates(session: models.ClassSession):
+    SessionAggregates().store(session)
@@ -0,0 +1,135 @@
+import time
+from sqlalchemy import insert, func
+from sqlalchemy.orm import Session
+from db import models
+from core.manager.session_aggregates import get_session_aggregates
+
+
+class SessionLogWriter:
+    """
+    Ghi log hành vi (cha) + sinh viên (con) theo lô thay vì add/flush từng dòng.
+
+    - Các dòng được dựng sẵn trong bộ nhớ, rồi ghi bằng INSERT nhiều dòng (executemany).
+    - ID của log cha được đọc lại bằng một SELECT: chỉ một job ghi cho mỗi session nên các
+      dòng có id > id lớn nhất đã biết chính là lô vừa chèn, theo đúng thứ tự chèn.
+      (Không dựa vào RETURNING - MySQL không hỗ trợ.)
+    - Commit mỗi batch_rows dòng, mỗi flush_seconds giây video hoặc mỗi flush_wall_seconds
+      giây thực; on_flush(last_item) chạy trong cùng transaction (checkpoint + tiến độ).
+    - Tra cứu sinh viên theo vec_id được cache trong suốt job.
+    - Aggregates của session (đếm hành vi/cảm xúc/sinh viên) được cộng dồn trong bộ nhớ và
+      lưu lên ClassSession ở mỗi lần flush, cùng transaction với log.
+    """
+
+    def __init__(self, db: Session, session_id: int, resolve_student,
+                 batch_rows: int = 500, flush_seconds: float = 30.0,
+                 flush_wall_seconds: float | None = None, on_flush=None):
+        self.db = db
+        self.session_id = session_id
+        self.resolve_student = resolve_student
+        self.batch_rows = max(1, int(batch_rows))
+        self.flush_seconds = flush_seconds
+        self.flush_wall_seconds = flush_wall_seconds
+        self.on_flush = on_flush
+        # Số frame đã commit trong lần chạy này
+        self.frames_written = 0
+
+        self._parents = []
+        # (index của log cha trong self._parents, row log con)
+        self._children = []
+        self._last_item = None
+        self._last_flush_ts = None
+        self._last_flush_wall = time.monotonic()
+        self._pending_frames = 0
+        self._students = {}
+        self._session = db.get(models.ClassSession, session_id)
+        self.aggregates = get_session_aggregates(db, self._session)
+        self._last_id = db.query(func.max(models.SessionBehaviorLog.id)).filter(
+            models.SessionBehaviorLog.session_id == session_id).scalar() or 0
+
+    @property
+    def last_id(self) -> int:
+        """Id SessionBehaviorLog lớn nhất đã ghi cho session"""
+        return self._last_id
+
+    def _student(self, vec_id):
+        """(student_id, student_name) cho một kết quả FAISS, có cache"""
+        if not vec_id:
+            return 0, "Unknown"
+        if vec_id not in self._students:
+            stu = self.resolve_student(vec_id)
+            self._students[vec_id] = (stu.id, stu.name) if stu else (0, "Unknown")
+        return self._students[vec_id]
+
+    def add(self, item):
+        """Đưa kết quả của một frame vào buffer; tự flush khi đủ lô"""
+        for entry in item['entries']:
+            bx1, by1, bx2, by2 = entry['box']
+            parent_idx = len(self._parents)
+            self._parents.append({
+                'session_id': self.session_id,
+                'timestamp': item['timestamp'],
+                'behavior_type': entry['label'],
+                'bbox': f"{bx1},{by1},{bx2},{by2}"
+            })
+            self.aggregates.add_behavior(entry['label'])
+            for face in entry['faces']:
+                student_id, student_name = self._student(face['vec_id'])
+                g_fx1, g_fy1, g_fx2, g_fy2 = face['face_bbox']
+                # "neutral" khi tắt phân loại cảm xúc (giữ hành vi cũ)
+                emotion = face.get('emotion') or "neutral"
+                self._children.append((parent_idx, {
+                    'student_id': student_id,
+                    'student_name': student_name,
+                    'emotion': emotion,
+                    'face_bbox': f"{g_fx1},{g_fy1},{g_fx2},{g_fy2}"
+                }))
+                self.aggregates.add_face(
+                    student_id, student_name, entry['label'], emotion)
+        self._last_item = item
+        self._pending_frames += 1
+
+        if self._last_flush_ts is None:
+            self._last_flush_ts = item['timestamp']
+        pending_rows = len(self._parents) + len(self._children)
+        if pending_rows >= self.batch_rows or \
+                item['timestamp'] - self._last_flush_ts >= self.flush_seconds or \
+                (self.flush_wall_seconds is not None and
+                 time.monotonic() - self._last_flush_wall >= self.flush_wall_seconds):
+            self.flush()
+
+    def flush(self):
+        """Ghi toàn bộ buffer bằng INSERT nhiều dòng và commit"""
+        if self._last_item is None:
+            return
+        db = self.db
+        if self._parents:
+            db.execute(insert(models.SessionBehaviorLog), self._parents)
+            ids = [bid for (bid,) in db.query(models.SessionBehaviorLog.id)
+                   .filter(models.SessionBehaviorLog.session_id == self.session_id,
+                           models.SessionBehaviorLog.id > self._last_id)
+                   .order_by(models.SessionBehaviorLog.id).all()]
+            if len(ids) != len(self._parents):
+                raise RuntimeError(
+                    f"Expected {len(self._parents)} new behavior logs for session "
+                    f"{self.session_id}, found {len(ids)} (concurrent writer?)")
+            self._last_id = ids[-1]
+            if self._children:
+                rows = []
+                for parent_idx, row in self._children:
+                    row['behavior_log_id'] = ids[parent_idx]
+                    rows.append(row)
+                db.execute(insert(models.SessionStudentLog), rows)
+
+        self.frames_written += self._pending_frames
+        self.aggregates.store(self._session)
+        self._session.total_detections = self.aggregates.total_detections
+        if self.on_flush:
+            self.on_flush(self._last_item)
+        db.commit()
+
+        self._last_flush_ts = self._last_item['timestamp']
+        self._last_flush_wall = time.monotonic()
+        self._pending_frames = 0
+        self._parents = []
+        self._children = []
+        self._last_item = None
@@ -1,12 +1,29 @@
 import cv2
 import numpy as np
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
 from db import models
 from app import schemas
 from core.ai_loader import ai_engine
 from db.vector_db import vector_db_instance
 import json
+from datetime import datetime
+import os
+import time
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import partial
 from core.database import SessionLocal
+from core.config import settings
+from core.pipeline import Pipeline, Stage
+from core.video_reader import SampledFrameReader, AdaptiveFrameReader, LiveFrameSource
+from core.geometry import box_containment
+from core.tracker import IoUTracker
+from core.inference_profiles import get_profile
+from core.manager.session_log_writer import SessionLogWriter
+from core.manager.session_aggregates import rebuild_session_aggregates, reset_session_aggregates
 # --- CRUD OPERATIONS ---
 
 
@@ -43,7 +60,13 @@ def update_session(db: Session, session: models.ClassSession, session_in: schema
 
 
 def _get_student_from_vector_id(db: Session, vector_id: int):
-    """Tìm sinh viên dựa trên ID vector từ FAISS"""
+    """
+    Tìm sinh viên từ kết quả FAISS. search_embedding đã tra ngược faiss_id -> student_id
+    (VectorDB reverse map), nên vector_id thường chính là student_id; id ảnh cũ vẫn được hỗ trợ.
+    """
+    student = db.query(models.Student).filter(models.Student.id == vector_id).first()
+    if student:
+        return student
     photo = db.query(models.StudentPhoto).filter(
         models.StudentPhoto.faiss_vector_id == vector_id).first()
     if photo:
@@ -51,25 +74,620 @@ def _get_student_from_vector_id(db: Session, vector_id: int):
     return None
 
 
-def _predict_emotion(face_img):
-    """Dự đoán cảm xúc từ ảnh crop khuôn mặt (Giả lập hoặc gọi model thật)"""
-    # Nếu chưa load model, trả về unknown
-    if ai_engine.emotion_model is None:
-        return "neutral"
+def _emotion_enabled() -> bool:
+    return settings.EMOTION_ENABLED and ai_engine.emotion_model is not None
+
+
+def _collect_face_crops(frame, entries):
+    """
+    Cắt ảnh từng khuôn mặt (một lần, kể cả khi khuôn mặt thuộc nhiều box hành vi) để stage
+    cảm xúc phân loại theo lô. Trả về list (face entry, crop).
+    """
+    h, w = frame.shape[:2]
+    crops, seen = [], set()
+    for entry in entries:
+        for face in entry['faces']:
+            if id(face) in seen:
+                continue
+            seen.add(id(face))
+            fx1, fy1, fx2, fy2 = face['face_bbox']
+            fx1, fy1 = max(0, int(fx1)), max(0, int(fy1))
+            fx2, fy2 = min(w, int(fx2)), min(h, int(fy2))
+            if fx2 > fx1 and fy2 > fy1:
+                crops.append((face, frame[fy1:fy2, fx1:fx2].copy()))
+            else:
+                face['emotion'] = "unknown"
+    return crops
+
+
+def _detect_behaviors_batch(frames: list, profile=None):
+    """
+    Chạy YOLO một lần cho cả batch frame (giảm overhead mỗi lần gọi + letterbox theo lô).
+    Ultralytics trả về Results theo đúng thứ tự ảnh đầu vào -> kết quả[i] ứng với frames[i].
+    imgsz/conf/iou lấy từ inference profile (mặc định: INFERENCE_PROFILE).
+    """
+    if not ai_engine.behavior_model or not frames:
+        return [[] for _ in frames]
+    profile = profile or get_profile()
+    return ai_engine.detect_behaviors(list(frames), **profile.yolo_kwargs())
+
+
+def _detect_behaviors(frame, profile=None):
+    """Chạy YOLO trên một frame, trả về danh sách hành vi {label, box, conf}"""
+    return _detect_behaviors_batch([frame], profile)[0]
+
+
+def _clip_behavior_boxes(frame, detected_behaviors):
+    """Chuẩn hoá bbox hành vi về trong khung hình, bỏ các box rỗng"""
+    entries = []
+    h_img, w_img = frame.shape[:2]
+    for b_item in detected_behaviors:
+        bx1, by1, bx2, by2 = b_item['box']
+
+        # Validate box coordinates
+        bx1, by1 = max(0, bx1), max(0, by1)
+        bx2, by2 = min(w_img, bx2), min(h_img, by2)
 
+        if bx2 <= bx1 or by2 <= by1:
+            continue
+
+        entries.append({
+            'label': b_item['label'],
+            'box': [bx1, by1, bx2, by2],
+            'faces': []
+        })
+    return entries
+
+
+def _match_faces(faces, offsets=None):
+    """
+    Tra FAISS cho nhiều khuôn mặt InsightFace bằng MỘT lần search_many.
+    offsets: (ox, oy) của từng khuôn mặt (crop -> toạ độ toàn frame), mặc định (0, 0).
+    Trả về [{vec_id, face_bbox}] theo đúng thứ tự đầu vào.
+    """
+    offsets = offsets or [(0, 0)] * len(faces)
+    with_embedding = [i for i, face in enumerate(faces) if face.embedding is not None]
+    vec_ids = [None] * len(faces)
+    if with_embedding:
+        matrix = np.stack([np.asarray(faces[i].embedding, dtype='float32').reshape(-1)
+                           for i in with_embedding])
+        student_ids, _ = vector_db_instance.search_many(matrix)
+        for i, vec_id in zip(with_embedding, student_ids):
+            vec_ids[i] = vec_id
+
+    matches = []
+    for face, (ox, oy), vec_id in zip(faces, offsets, vec_ids):
+        fx1, fy1, fx2, fy2 = face.bbox.astype(int)
+        matches.append({
+            'vec_id': vec_id,
+            'face_bbox': [ox + fx1, oy + fy1, ox + fx2, oy + fy2]
+        })
+    return matches
+
+
+def _identify_behaviors_per_crop(frame, entries, det_size=None):
+    """Chế độ "crop": detect + embed khuôn mặt lại trên từng crop hành vi"""
+    faces, offsets, owners = [], [], []
+    for j, entry in enumerate(entries):
+        bx1, by1, bx2, by2 = entry['box']
+
+        # Crop & Detect Face
+        behavior_crop = frame[by1:by2, bx1:bx2]
+
+        if ai_engine.identity_model and behavior_crop.size > 0:
+            for face in ai_engine.analyze_faces(behavior_crop, det_size):
+                faces.append(face)
+                offsets.append((bx1, by1))
+                owners.append(j)
+
+    # Tra FAISS một lần cho mọi khuôn mặt của frame; Local -> Global coords
+    for entry in entries:
+        entry['faces'] = []
+    for j, match in zip(owners, _match_faces(faces, offsets)):
+        entries[j]['faces'].append(match)
+    return entries
+
+
+def _assign_faces(entries, face_boxes, face_entries):
+    """Gán mỗi khuôn mặt cho (các) box hành vi chứa nó bằng phép join containment vector hoá"""
+    if not face_entries:
+        return entries
+    # (F, B): tỉ lệ diện tích khuôn mặt nằm trong box hành vi
+    containment = box_containment(face_boxes, [e['box'] for e in entries])
+    inside = containment >= settings.FACE_BOX_MIN_CONTAINMENT
+    for j, entry in enumerate(entries):
+        entry['faces'] = [face_entries[i] for i in np.flatnonzero(inside[:, j])]
+    return entries
+
+
+def _identify_behaviors_full_frame(frame, entries, det_size=None):
+    """
+    Chế độ "frame": detect + embed khuôn mặt MỘT lần trên cả frame, rồi gán mỗi khuôn mặt
+    cho (các) box hành vi chứa nó.
+    Chi phí InsightFace không còn tỉ lệ với số box hành vi.
+    """
+    if not entries or not ai_engine.identity_model:
+        return entries
+
+    faces = ai_engine.analyze_faces(frame, det_size)
+    face_entries = _match_faces(faces)
+    return _assign_faces(entries, [f.bbox for f in faces], face_entries)
+
+
+def _identify_behaviors_tracked(frame, entries, trackers, det_size=None):
+    """
+    Chế độ tracking: detect khuôn mặt trên cả frame, gán track ID qua các frame, và chỉ
+    embed + tra FAISS cho track chưa đủ phiếu bầu hoặc tới hạn kiểm tra lại.
+    Danh tính của track = đa số phiếu của các embedding gần nhất.
+    Nhãn hành vi của mỗi box = nhãn chiếm đa số trong TRACK_LABEL_WINDOW frame gần nhất
+    của track đó (lọc nhãn nhảy qua lại giữa các frame, vd. reading <-> writing).
+    """
+    face_tracker, behavior_tracker = trackers
+    behavior_ids = behavior_tracker.update([e['box'] for e in entries])
+    for entry, track_id in zip(entries, behavior_ids):
+        entry['label'] = behavior_tracker.smooth(track_id, entry['label'])
+
+    faces = []
+    if entries and ai_engine.identity_model:
+        faces = ai_engine.detect_faces(frame, det_size)
+    face_boxes = [f.bbox for f in faces]
+    track_ids = face_tracker.update(face_boxes)
+
+    pending = [i for i, tid in enumerate(track_ids)
+               if face_tracker.needs_identity(tid)]
+    pending_faces = ai_engine.embed_faces(frame, [faces[i] for i in pending])
+    for i, match in zip(pending, _match_faces(pending_faces)):
+        face_tracker.add_vote(track_ids[i], match['vec_id'])
+
+    face_entries = []
+    for face, track_id in zip(faces, track_ids):
+        fx1, fy1, fx2, fy2 = face.bbox.astype(int)
+        face_entries.append({
+            'vec_id': face_tracker.identity(track_id),
+            'face_bbox': [fx1, fy1, fx2, fy2],
+            'track_id': track_id
+        })
+    return _assign_faces(entries, face_boxes, face_entries)
+
+
+def _identify_behaviors(frame, detected_behaviors, trackers=None, profile=None):
+    """
+    Với mỗi hành vi: chuẩn hoá bbox, tìm khuôn mặt bên trong và tra FAISS.
+    Trả về danh sách {label, box, faces: [{vec_id, face_bbox}]} - chưa đụng tới DB.
+    """
+    det_size = (profile or get_profile()).det_size
+    entries = _clip_behavior_boxes(frame, detected_behaviors)
+    if trackers is not None:
+        return _identify_behaviors_tracked(frame, entries, trackers, det_size)
+    if settings.FACE_PASS_MODE == "frame":
+        return _identify_behaviors_full_frame(frame, entries, det_size)
+    return _identify_behaviors_per_crop(frame, entries, det_size)
+
+
+def _new_trackers(state: dict | None = None):
+    """
+    Tạo cặp tracker (khuôn mặt, box hành vi) cho một lần xử lý video, hoặc None nếu tắt.
+    `state` (từ checkpoint) khôi phục track + phiếu bầu danh tính khi chạy tiếp.
+    """
+    if not settings.FACE_TRACKING_ENABLED:
+        return None
+    face_tracker = IoUTracker(
+        iou_threshold=settings.TRACK_IOU_THRESHOLD,
+        max_age=settings.TRACK_MAX_AGE,
+        votes=settings.TRACK_IDENTITY_VOTES,
+        reverify_interval=settings.TRACK_REVERIFY_INTERVAL)
+    behavior_tracker = IoUTracker(
+        iou_threshold=settings.TRACK_IOU_THRESHOLD,
+        max_age=settings.TRACK_MAX_AGE,
+        votes=settings.TRACK_LABEL_WINDOW)
+    if state:
+        face_tracker.load_state_dict(state.get('face') or {})
+        behavior_tracker.load_state_dict(state.get('behavior') or {})
+    return face_tracker, behavior_tracker
+
+
+def _detect_stage(items: list, profile=None):
+    """Stage 2 của pipeline: phát hiện hành vi cho một batch frame (YOLO_BATCH_SIZE)"""
+    # Luồng live: frame đã quá hạn 'deadline' thì bỏ qua để độ trễ không tích luỹ
+    now = time.monotonic()
+    fresh = []
+    for item in items:
+        if item.get('deadline') is not None and now > item['deadline']:
+            item['behaviors'] = []
+            item['dropped'] = True
+        else:
+            fresh.append(item)
+    if fresh:
+        behaviors = _detect_behaviors_batch(
+            [item['frame'] for item in fresh], profile)
+        for item, detected in zip(fresh, behaviors):
+            item['behaviors'] = detected
+    return items
+
+
+def _identify_stage(item, trackers=None, profile=None):
+    """Stage 3 của pipeline: nhận diện khuôn mặt cho từng hành vi"""
+    item['entries'] = _identify_behaviors(
+        item['frame'], item['behaviors'], trackers, profile)
+    if trackers is not None:
+        # Snapshot trạng thái tracker tại frame này để writer lưu checkpoint
+        face_tracker, behavior_tracker = trackers
+        item['tracker_state'] = {
+            'face': face_tracker.state_dict(),
+            'behavior': behavior_tracker.state_dict()
+        }
+    if _emotion_enabled():
+        item['face_crops'] = _collect_face_crops(item['frame'], item['entries'])
+    # Stage sau không cần cả frame nữa -> giải phóng bộ nhớ sớm
+    item['frame'] = None
+    return item
+
+
+def _emotion_stage(items: list):
+    """
+    Stage 4 của pipeline: phân loại cảm xúc cho MỌI khuôn mặt của cả batch frame trong một
+    lần forward (chia nhỏ theo EMOTION_MAX_BATCH), thay vì một lần cho mỗi khuôn mặt.
+    """
+    pairs = [pair for item in items for pair in item.pop('face_crops', None) or []]
+    if pairs:
+        labels = ai_engine.classify_emotions(
+            [crop for _, crop in pairs], max_batch=settings.EMOTION_MAX_BATCH)
+        for (face, _), label in zip(pairs, labels):
+            face['emotion'] = label
+    return items
+
+
+def _iter_batches(iterable, size: int):
+    """Gom các phần tử liên tiếp thành list có tối đa `size` phần tử"""
+    batch = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iter_processed_frames(frames, tracker_state: dict | None = None,
+                           batch_size: int | None = None, queue_size: int | None = None,
+                           profile=None):
+    """
+    Chạy decode -> detect -> identify (-> emotion). Khi bật PIPELINE_ENABLED, mỗi stage chạy trên
+    thread/process riêng, nối với nhau bằng hàng đợi giới hạn (backpressure giữ RAM ổn định).
+    batch_size/queue_size mặc định lấy từ settings (luồng live dùng giá trị nhỏ để giảm trễ).
+    profile: inference profile của job (None = INFERENCE_PROFILE).
+    """
+    batch_size = max(1, batch_size or settings.YOLO_BATCH_SIZE)
+    queue_size = queue_size or settings.PIPELINE_QUEUE_SIZE
+    trackers = _new_trackers(tracker_state)
+    profile = profile or get_profile()
+    detect = partial(_detect_stage, profile=profile)
+    identify = partial(_identify_stage, trackers=trackers, profile=profile)
+    emotion = _emotion_enabled()
+    if not settings.PIPELINE_ENABLED:
+        for batch in _iter_batches(frames, batch_size):
+            batch = [identify(item) for item in detect(batch)]
+            if emotion:
+                batch = _emotion_stage(batch)
+            yield from batch
+        return
+
+    mode = settings.PIPELINE_STAGE_MODE
+    # Tracker cần thấy các frame theo đúng thứ tự -> chỉ một worker nhận diện
+    identity_workers = 1 if trackers else settings.PIPELINE_IDENTITY_WORKERS
+    stages = [
+        Stage("detect", detect, workers=settings.PIPELINE_DETECT_WORKERS,
+              mode=mode, batch_size=batch_size),
+        Stage("identify", identify, workers=identity_workers, mode=mode),
+    ]
+    if emotion:
+        stages.append(Stage("emotion", _emotion_stage,
+                      mode=mode, batch_size=batch_size))
+    pipeline = Pipeline(frames, stages, queue_size=max(queue_size, batch_size))
+    yield from pipeline.run()
+
+
+def _sampling_interval(fps: float, profile=None) -> int:
+    """
+    Số frame giữa hai lần đọc: theo sample_rate của profile (balanced = 1 frame/giây),
+    hoặc nhịp dò (max rate) khi lấy mẫu thích ứng
+    """
+    fps = fps if fps > 0 else 30
+    if settings.ADAPTIVE_SAMPLING_ENABLED:
+        return max(1, round(fps / settings.ADAPTIVE_MAX_RATE))
+    return max(1, int(fps / (profile or get_profile()).sample_rate))
+
+
+def _new_frame_reader(cap, fps: float, start_frame: int = 0, end_frame: int | None = None,
+                      profile=None):
+    """Reader chỉ decode đầy đủ các frame được phân tích (grab/seek cho frame bị bỏ qua)"""
+    options = dict(strategy=settings.VIDEO_SAMPLING_STRATEGY,
+                   seek_min_interval=settings.VIDEO_SEEK_MIN_INTERVAL,
+                   start_frame=start_frame, end_frame=end_frame)
+    if settings.ADAPTIVE_SAMPLING_ENABLED:
+        # Lấy mẫu dày khi lớp có chuyển động, thưa khi khung hình tĩnh
+        return AdaptiveFrameReader(
+            cap, fps,
+            min_rate=settings.ADAPTIVE_MIN_RATE,
+            max_rate=settings.ADAPTIVE_MAX_RATE,
+            motion_threshold=settings.ADAPTIVE_MOTION_THRESHOLD,
+            hold_seconds=settings.ADAPTIVE_HOLD_SECONDS,
+            **options)
+    return SampledFrameReader(cap, fps, interval=_sampling_interval(fps, profile), **options)
+
+
+def _plan_segments(total_frames: int, fps: float, start_frame: int = 0, profile=None):
+    """
+    Chia [start_frame, total_frames) thành các đoạn liên tiếp cho VIDEO_SEGMENT_WORKERS process.
+    Biên mỗi đoạn là bội số của khoảng lấy mẫu nên timestamp giống hệt khi xử lý tuần tự.
+    """
+    interval = _sampling_interval(fps, profile)
+    workers = max(1, settings.VIDEO_SEGMENT_WORKERS)
+    min_frames = int(settings.VIDEO_SEGMENT_MIN_SECONDS * (fps if fps > 0 else 30))
+    start_frame = -(-start_frame // interval) * interval
+    remaining = total_frames - start_frame
+    if remaining <= 0:
+        return []
+    seg_frames = max(-(-remaining // workers), min_frames, 1)
+    seg_frames = -(-seg_frames // interval) * interval
+    return [(start, min(start + seg_frames, total_frames))
+            for start in range(start_frame, total_frames, seg_frames)]
+
+
+def _init_segment_worker(num_threads: int):
+    """Giới hạn số thread của torch/OpenCV trong mỗi process để không tranh CPU lẫn nhau"""
+    cv2.setNumThreads(num_threads)
     try:
-        # Ở đây bạn cần code tiền xử lý ảnh cho ResNet (Resize, ToTensor...)
-        # Để đơn giản, ta demo logic trả về kết quả
-        # Thực tế cần: img -> transform -> model -> prediction
-        return "neutral"
+        import torch
+        torch.set_num_threads(num_threads)
     except Exception:
-        return "unknown"
+        pass
 
 
-def process_video_ai(session_id: int, video_path: str):
+def _process_segment(video_path: str, fps: float, start_frame: int, end_frame: int,
+                     profile_name: str | None = None):
+    """
+    Chạy trong process con (model riêng của process): decode + detect + identify một đoạn video.
+    Trả về các frame đã xử lý (không kèm ảnh) để process chính ghi DB theo thứ tự.
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise Exception(f"Cannot open video: {video_path}")
+        profile = get_profile(profile_name)
+        reader = _new_frame_reader(cap, fps, start_frame, end_frame, profile)
+        return list(_iter_processed_frames(reader, profile=profile))
+    finally:
+        cap.release()
+
+
+def _iter_segment_results(video_path: str, fps: float, segments, profile_name: str | None = None):
+    """Xử lý song song các đoạn trên process pool, trả kết quả theo đúng thứ tự thời gian"""
+    workers = min(settings.VIDEO_SEGMENT_WORKERS, len(segments))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # "spawn": mỗi worker import lại ai_loader -> tự load model, không fork trạng thái torch
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                             initializer=_init_segment_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(_process_segment, video_path, fps, start, end, profile_name)
+                   for start, end in segments]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def get_video_file_path(session: models.ClassSession):
+    """Đường dẫn tuyệt đối của video đã upload (video_path lưu dạng 'uploads/videos/...')"""
+    if not session.video_path:
+        return None
+    return os.path.join(settings.UPLOAD_DIR, *session.video_path.split('/')[1:])
+
+
+def _get_checkpoint(db: Session, session_id: int):
+    return db.query(models.SessionCheckpoint).filter(
+        models.SessionCheckpoint.session_id == session_id).first()
+
+
+def _save_checkpoint(db: Session, session_id: int, video_path: str, item):
+    """Ghi checkpoint trong CÙNG transaction với log của frame -> không bao giờ lệch nhau"""
+    checkpoint = _get_checkpoint(db, session_id)
+    if checkpoint is None:
+        checkpoint = models.SessionCheckpoint(session_id=session_id)
+        db.add(checkpoint)
+    checkpoint.video_path = video_path
+    checkpoint.last_frame_index = int(item['frame_index'])
+    checkpoint.last_timestamp = float(item['timestamp'])
+    checkpoint.state = json.dumps(item.get('tracker_state'))
+    checkpoint.updated_at = datetime.utcnow()
+
+
+def _delete_logs_after(db: Session, session_id: int, timestamp: float | None = None):
+    """Xoá log của session có timestamp > `timestamp` (None = xoá toàn bộ)"""
+    query = db.query(models.SessionBehaviorLog.id).filter(
+        models.SessionBehaviorLog.session_id == session_id)
+    if timestamp is not None:
+        query = query.filter(models.SessionBehaviorLog.timestamp > timestamp)
+    log_ids = [bid for (bid,) in query.all()]
+    if log_ids:
+        db.query(models.SessionStudentLog)\
+            .filter(models.SessionStudentLog.behavior_log_id.in_(log_ids))\
+            .delete(synchronize_session=False)
+        db.query(models.SessionBehaviorLog)\
+            .filter(models.SessionBehaviorLog.id.in_(log_ids))\
+            .delete(synchronize_session=False)
+    return len(log_ids)
+
+
+def _prepare_resume(db: Session, session_id: int, video_path: str):
+    """
+    Xác định điểm bắt đầu xử lý: (start_frame, tracker_state).
+    - Có checkpoint cho đúng video: bỏ log sau checkpoint (đã ghi nhưng chưa checkpoint)
+      rồi chạy tiếp từ frame kế tiếp với trạng thái tracker đã lưu.
+    - Không có: chạy lại từ đầu, xoá log cũ của lần chạy dở trước đó.
+    Aggregates của session được làm mới tương ứng (reset, hoặc tính lại từ log còn giữ).
+    """
+    session = get_session(db, session_id)
+    checkpoint = _get_checkpoint(db, session_id)
+    if checkpoint is not None and checkpoint.video_path != video_path:
+        db.delete(checkpoint)
+        checkpoint = None
+    if checkpoint is None:
+        _delete_logs_after(db, session_id)
+        reset_session_aggregates(session)
+        db.commit()
+        return 0, None
+
+    _delete_logs_after(db, session_id, checkpoint.last_timestamp)
+    rebuild_session_aggregates(db, session)
+    db.commit()
+    state = json.loads(checkpoint.state) if checkpoint.state else None
+    print(f"Resuming session {session_id} after frame {checkpoint.last_frame_index} "
+          f"(t={checkpoint.last_timestamp}s)")
+    return checkpoint.last_frame_index + 1, state
+
+
+def clear_checkpoint(db: Session, session_id: int):
+    """Bỏ checkpoint (video mới được upload hoặc session bị xoá)"""
+    db.query(models.SessionCheckpoint).filter(
+        models.SessionCheckpoint.session_id == session_id).delete(synchronize_session=False)
+
+
+def is_job_stale(db: Session, session: models.ClassSession) -> bool:
+    """Job 'processing' không cập nhật checkpoint quá lâu = tiến trình đã chết (server restart...)"""
+    if session.status != "processing":
+        return True
+    checkpoint = _get_checkpoint(db, session.id)
+    last_update = checkpoint.updated_at if checkpoint else session.updated_at
+    if last_update is None:
+        return True
+    return (datetime.utcnow() - last_update).total_seconds() > settings.CHECKPOINT_STALE_SECONDS
+
+
+def _get_progress(db: Session, session_id: int):
+    return db.query(models.SessionProgress).filter(
+        models.SessionProgress.session_id == session_id).first()
+
+
+def _start_progress(db: Session, session_id: int, total_frames: int, start_frame: int):
+    """Tạo/reset bản ghi tiến độ khi job bắt đầu (hoặc chạy tiếp từ checkpoint)"""
+    progress = _get_progress(db, session_id)
+    if progress is None:
+        progress = models.SessionProgress(session_id=session_id)
+        db.add(progress)
+    progress.frames_processed = 0
+    progress.current_frame = start_frame
+    progress.total_frames = total_frames
+    progress.percent = round(100.0 * start_frame / total_frames, 1) if total_frames else 0
+    progress.eta_seconds = None
+    progress.started_at = datetime.utcnow()
+    progress.last_log_id = db.query(func.max(models.SessionBehaviorLog.id)).filter(
+        models.SessionBehaviorLog.session_id == session_id).scalar() or 0
+    db.commit()
+    return progress
+
+
+def _save_progress(db: Session, session_id: int, writer: SessionLogWriter,
+                   start_frame: int, item):
+    """Cập nhật tiến độ trong cùng transaction với lô log vừa ghi"""
+    progress = _get_progress(db, session_id)
+    if progress is None:
+        return
+    current = int(item['frame_index'])
+    total = progress.total_frames or 0
+    progress.frames_processed = writer.frames_written
+    progress.current_frame = current
+    progress.last_timestamp = float(item['timestamp'])
+    progress.last_log_id = writer.last_id
+    if total > 0:
+        progress.percent = round(min(100.0, 100.0 * (current + 1) / total), 1)
+        done = current + 1 - start_frame
+        elapsed = (datetime.utcnow() - progress.started_at).total_seconds()
+        if done > 0:
+            progress.eta_seconds = round(
+                elapsed / done * max(0, total - current - 1), 1)
+
+
+def delete_progress(db: Session, session_id: int):
+    db.query(models.SessionProgress).filter(
+        models.SessionProgress.session_id == session_id).delete(synchronize_session=False)
+
+
+def _stream_status(db: Session, session: models.ClassSession):
+    """
+    Trạng thái hiển thị cho luồng SSE và việc luồng đã kết thúc hay chưa.
+    Một lần thử lỗi chỉ là tạm thời khi job vẫn còn active (còn lượt retry: job_manager
+    xếp hàng lại) -> báo 'queued' và tiếp tục stream. Chỉ completed, hoặc failed khi
+    không còn job active (hết lượt retry / không dùng hàng đợi), mới là trạng thái cuối.
+    """
+    status = session.status
+    if status == "failed":
+        retrying = db.query(models.VideoJob.id).filter(
+            models.VideoJob.active_session_id == session.id).first() is not None
+        if retrying:
+            return "queued", False
+    return status, status in ("completed", "failed")
+
+
+def _progress_dict(status: str, terminal: bool, progress):
+    data = {"status": status, "terminal": terminal}
+    if progress is not None:
+        data.update({
+            "frames_processed": progress.frames_processed,
+            "current_frame": progress.current_frame,
+            "total_frames": progress.total_frames,
+            "percent": progress.percent,
+            "eta_seconds": progress.eta_seconds,
+            "last_timestamp": progress.last_timestamp,
+            "last_log_id": progress.last_log_id
+        })
+    return data
+
+
+def poll_session_events(session_id: int, after_id: int = 0):
+    """
+    Một lần poll cho luồng SSE: trạng thái + tiến độ (2 truy vấn theo khoá) và CHỈ các log
+    hành vi có id > after_id. Log chỉ được query khi tiến độ báo có lô mới.
+    Trả về (progress dict hoặc None nếu session không tồn tại, danh sách log mới).
+    """
+    db = SessionLocal()
+    try:
+        session = get_session(db, session_id)
+        if not session:
+            return None, []
+        progress = _get_progress(db, session_id)
+        logs = []
+        if progress is not None and (progress.last_log_id or 0) > after_id:
+            logs = db.query(models.SessionBehaviorLog)\
+                .options(joinedload(models.SessionBehaviorLog.students))\
+                .filter(models.SessionBehaviorLog.session_id == session_id,
+                        models.SessionBehaviorLog.id > after_id,
+                        models.SessionBehaviorLog.id <= progress.last_log_id)\
+                .order_by(models.SessionBehaviorLog.id)\
+                .all()
+        return _progress_dict(*_stream_status(db, session), progress), logs
+    finally:
+        db.close()
+
+
+class JobCancelled(Exception):
+    """Job bị huỷ giữa chừng (worker mất lease): không commit thêm gì"""
+
+
+def _check_cancel(cancel, session_id: int):
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled(f"Processing of session {session_id} was cancelled")
+
+
+def process_video_ai(session_id: int, video_path: str, cancel: threading.Event | None = None):
     """
     Hàm xử lý video chạy ngầm.
     Tự quản lý DB Session để tránh lỗi 'Session closed' khi API return.
+    Trả về True nếu xử lý xong, False nếu lỗi (worker dựa vào đó để retry).
+    cancel: khi được set (worker mất lease), job dừng ở frame/lô kế tiếp và rollback
+    phần chưa commit, không ghi trạng thái session (worker mới đang xử lý nó).
     """
     # [MỚI] Tự tạo session riêng
     db = SessionLocal()
@@ -78,7 +696,7 @@ def process_video_ai(session_id: int, video_path: str):
         session = get_session(db, session_id)
         if not session:
             print(f"Session {session_id} not found.")
-            return
+            return False
 
         # Cập nhật trạng thái: Đang xử lý
         session.status = "processing"
@@ -89,112 +707,74 @@ def process_video_ai(session_id: int, video_path: str):
             raise Exception(f"Cannot open video: {video_path}")
 
         fps = cap.get(cv2.CAP_PROP_FPS)
-        process_interval = int(fps) if fps > 0 else 30
-        frame_count = 0
-
-        print(f"Started AI processing for session {session_id}...")
-
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            if frame_count % process_interval == 0:
-                current_time = round(frame_count / (fps if fps > 0 else 30), 2)
-
-                # --- 1. YOLO Detect Behavior ---
-                detected_behaviors = []
-                if ai_engine.behavior_model:
-                    results = ai_engine.behavior_model(frame, verbose=False)
-                    for r in results:
-                        for box in r.boxes:
-                            x1, y1, x2, y2 = box.xyxy[0].cpu(
-                            ).numpy().astype(int)
-                            conf = float(box.conf[0])
-                            cls_id = int(box.cls[0])
-                            label = ai_engine.behavior_model.names[cls_id]
-                            detected_behaviors.append({
-                                'label': label,
-                                'box': [x1, y1, x2, y2],
-                                'conf': conf
-                            })
-
-                # --- 2. Xử lý từng hành vi ---
-                for b_item in detected_behaviors:
-                    bx1, by1, bx2, by2 = b_item['box']
-                    behavior_label = b_item['label']
-
-                    # Validate box coordinates
-                    h_img, w_img = frame.shape[:2]
-                    bx1, by1 = max(0, bx1), max(0, by1)
-                    bx2, by2 = min(w_img, bx2), min(h_img, by2)
-
-                    if bx2 <= bx1 or by2 <= by1:
-                        continue
-
-                    # Lưu SessionBehaviorLog (Parent)
-                    behavior_log = models.SessionBehaviorLog(
-                        session_id=session_id,
-                        timestamp=current_time,
-                        behavior_type=behavior_label,
-                        bbox=f"{bx1},{by1},{bx2},{by2}"
-                    )
-                    db.add(behavior_log)
-                    db.flush()  # Flush để lấy ID
-
-                    # Crop & Detect Face
-                    behavior_crop = frame[by1:by2, bx1:bx2]
-
-                    faces = []
-                    if ai_engine.identity_model and behavior_crop.size > 0:
-                        faces = ai_engine.identity_model.get(behavior_crop)
-
-                    for face in faces:
-                        fx1, fy1, fx2, fy2 = face.bbox.astype(int)
-
-                        # Convert Local -> Global coords
-                        g_fx1, g_fy1 = bx1 + fx1, by1 + fy1
-                        g_fx2, g_fy2 = bx1 + fx2, by1 + fy2
-
-                        # Identify
-                        student_id = 0
-                        student_name = "Unknown"
-                        if face.embedding is not None:
-                            emb_arr = np.array(
-                                [face.embedding], dtype='float32')
-                            vec_id, sim = vector_db_instance.search_embedding(
-                                emb_arr)
-                            if vec_id:
-                                stu = _get_student_from_vector_id(db, vec_id)
-                                if stu:
-                                    student_id = stu.id
-                                    student_name = stu.name
-
-                        # Emotion placeholder
-                        emotion_label = "neutral"
-
-                        # Lưu SessionStudentLog (Child)
-                        student_log = models.SessionStudentLog(
-                            behavior_log_id=behavior_log.id,
-                            student_id=student_id,
-                            student_name=student_name,
-                            emotion=emotion_label,
-                            face_bbox=f"{g_fx1},{g_fy1},{g_fx2},{g_fy2}"
-                        )
-                        db.add(student_log)
-
-                db.commit()
-
-            frame_count += 1
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        profile = get_profile(session.inference_profile)
+
+        # Chạy tiếp từ checkpoint (nếu có) thay vì làm lại từ frame 0
+        start_frame, tracker_state = _prepare_resume(
+            db, session_id, video_path)
+
+        _start_progress(db, session_id, total_frames, start_frame)
+
+        print(f"Started AI processing for session {session_id} (profile: {profile.name})...")
+
+        segments = []
+        if settings.VIDEO_SEGMENT_WORKERS > 1 and total_frames > 0:
+            segments = _plan_segments(total_frames, fps, start_frame, profile)
+        if len(segments) > 1:
+            # Video dài: mỗi đoạn thời gian chạy trên một process riêng
+            results = _iter_segment_results(
+                video_path, fps, segments, profile.name)
+        else:
+            # Decode -> Detect -> Identify chạy song song trong process hiện tại
+            results = _iter_processed_frames(
+                _new_frame_reader(cap, fps, start_frame, profile=profile),
+                tracker_state, profile=profile)
+
+        # DB writer chạy ở thread hiện tại (SQLAlchemy Session không thread-safe).
+        # Ghi theo lô; mỗi lần commit kèm checkpoint của frame cuối trong lô.
+        def on_flush(item):
+            # Chạy ngay trước commit của lô: mất lease thì lô này không được ghi
+            _check_cancel(cancel, session_id)
+            _save_checkpoint(db, session_id, video_path, item)
+            _save_progress(db, session_id, writer, start_frame, item)
+
+        writer = SessionLogWriter(
+            db, session_id,
+            resolve_student=partial(_get_student_from_vector_id, db),
+            batch_rows=settings.LOG_WRITE_BATCH_ROWS,
+            flush_seconds=settings.CHECKPOINT_INTERVAL_SECONDS,
+            flush_wall_seconds=settings.PROGRESS_INTERVAL_SECONDS,
+            on_flush=on_flush)
+        with closing(results) as frames:
+            for item in frames:
+                _check_cancel(cancel, session_id)
+                writer.add(item)
+        writer.flush()
 
         # Hoàn tất
+        clear_checkpoint(db, session_id)
+        progress = _get_progress(db, session_id)
+        if progress is not None:
+            progress.percent = 100.0
+            progress.eta_seconds = 0
+        # Chốt aggregates (đã cộng dồn ở mỗi lần flush) + thông tin video
+        writer.aggregates.store(session)
+        session.total_detections = writer.aggregates.total_detections
+        if fps and fps > 0:
+            session.fps = fps
+            if total_frames > 0:
+                session.duration = round(total_frames / fps, 2)
         session.status = "completed"
-        count = db.query(models.SessionBehaviorLog).filter(
-            models.SessionBehaviorLog.session_id == session_id).count()
-        session.total_detections = count
+        _check_cancel(cancel, session_id)
         db.commit()
         print(f"Session {session_id} processing completed.")
+        return True
 
+    except JobCancelled as e:
+        print(f"{e}.")
+        db.rollback()
+        return False
     except Exception as e:
         print(f"Error processing session {session_id}: {e}")
         # Cần rollback nếu lỗi để tránh treo transaction
@@ -207,8 +787,112 @@ def process_video_ai(session_id: int, video_path: str):
                 db.commit()
         except:
             pass
+        return False
     finally:
         if 'cap' in locals() and cap.isOpened():
             cap.release()
         # [QUAN TRỌNG] Đóng kết nối
         db.close()
+
+
+def _is_stop_requested(db: Session, session_id: int) -> bool:
+    status = db.query(models.ClassSession.status).filter(
+        models.ClassSession.id == session_id).scalar()
+    return status == "stopping"
+
+
+def request_live_stop(db: Session, session: models.ClassSession) -> bool:
+    """Yêu cầu dừng phiên live; vòng lặp live đọc cờ này và kết thúc sau lô hiện tại"""
+    if session.status != "live":
+        return False
+    session.status = "stopping"
+    db.commit()
+    return True
+
+
+def process_live_stream(session_id: int, source, realtime: bool = False,
+                        max_duration: float | None = None):
+    """
+    Phân tích trực tiếp một luồng camera (URL RTSP/HTTP hoặc chỉ số thiết bị), hoặc phát
+    lại file video với tốc độ thực (realtime=True) để thử nghiệm.
+
+    - Chỉ giữ frame mới nhất: khi xử lý không theo kịp, frame cũ bị bỏ thay vì xếp hàng.
+    - Pipeline chạy với batch 1 và hàng đợi LIVE_QUEUE_SIZE; frame chờ quá
+      LIVE_MAX_LAG_SECONDS bị bỏ qua ở stage detect -> độ trễ có giới hạn.
+    - Log được commit mỗi LIVE_FLUSH_SECONDS giây nên SSE thấy kết quả gần như tức thì.
+    - Dừng khi luồng kết thúc, hết max_duration, hoặc khi status chuyển sang "stopping".
+    Timestamp nối tiếp log cũ của buổi học (chạy live nhiều lần không bị chồng thời gian).
+    """
+    db = SessionLocal()
+    live = None
+    try:
+        session = get_session(db, session_id)
+        if not session:
+            print(f"Session {session_id} not found.")
+            return False
+
+        time_offset = db.query(func.max(models.SessionBehaviorLog.timestamp)).filter(
+            models.SessionBehaviorLog.session_id == session_id).scalar() or 0.0
+        live = LiveFrameSource(
+            source,
+            sample_rate=settings.LIVE_SAMPLE_RATE,
+            realtime=realtime,
+            max_lag=settings.LIVE_MAX_LAG_SECONDS,
+            max_duration=max_duration,
+            time_offset=float(time_offset) + (1.0 if time_offset else 0.0))
+
+        session.status = "live"
+        db.commit()
+        _start_progress(db, session_id, 0, 0)
+        print(f"Started live analysis for session {session_id} ({source})...")
+
+        writer = SessionLogWriter(
+            db, session_id,
+            resolve_student=partial(_get_student_from_vector_id, db),
+            batch_rows=settings.LOG_WRITE_BATCH_ROWS,
+            flush_seconds=settings.LIVE_FLUSH_SECONDS,
+            flush_wall_seconds=settings.LIVE_FLUSH_SECONDS,
+            on_flush=lambda item: _save_progress(db, session_id, writer, 0, item))
+        results = _iter_processed_frames(
+            live, batch_size=1, queue_size=settings.LIVE_QUEUE_SIZE,
+            profile=get_profile(session.inference_profile))
+
+        skipped = 0
+        last_check = time.monotonic()
+        with closing(results) as frames:
+            try:
+                for item in frames:
+                    skipped += bool(item.get('dropped'))
+                    writer.add(item)
+                    if time.monotonic() - last_check >= settings.LIVE_STOP_CHECK_SECONDS:
+                        last_check = time.monotonic()
+                        if _is_stop_requested(db, session_id):
+                            break
+            except KeyboardInterrupt:
+                # Ctrl+C khi chạy live.py: dừng như một yêu cầu stop bình thường
+                pass
+        writer.flush()
+
+        writer.aggregates.store(session)
+        session.total_detections = writer.aggregates.total_detections
+        session.status = "completed"
+        db.commit()
+        print(f"Live session {session_id} stopped: {writer.frames_written} frames analysed, "
+              f"{live.dropped} dropped at capture, {skipped} skipped as stale.")
+        return True
+
+    except Exception as e:
+        print(f"Error in live session {session_id}: {e}")
+        db.rollback()
+        try:
+            err_session = get_session(db, session_id)
+            if err_session:
+                err_session.status = "failed"
+                db.commit()
+        except:
+            pass
+        return False
+    finally:
+        if live is not None:
+            live.stop()
+        db.close()
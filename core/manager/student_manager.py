@@ -9,6 +9,8 @@ from sqlalchemy.orm import Session
 from core.config import settings
 from db.vector_db import vector_db_instance
 from core.ai_loader import ai_engine
+from core import micro_batcher
+from core.inference_profiles import get_profile
 import os
 import cv2
 
@@ -141,10 +143,11 @@ async def add_student_faces(db: Session, student_id: int, files: list[UploadFile
             with open(file_path, "wb") as f:
                 f.write(contents)
 
-            # Nhận diện khuôn mặt
+            # Nhận diện khuôn mặt qua micro-batcher: model chỉ chạy trên thread của batcher
+            # (không chặn event loop, không gọi InsightFace từ hai thread cùng lúc)
             faces = []
             try:
-                faces = ai_engine.identity_model.get(img)
+                faces = await micro_batcher.analyze_faces(img, get_profile())
             except Exception as fe:
                 errors.append(f"{file.filename}: Lỗi gọi model ({str(fe)})")
                 continue
@@ -254,7 +257,7 @@ def delete_all_embeddings(db: Session, student_id: int):
 def _extract_embedding_from_image(img):
     if ai_engine.identity_model is None:
         return None
-    faces = ai_engine.identity_model.get(img)
+    faces = ai_engine.analyze_faces(img)
     if not faces:
         return None
     # pick largest valid face
@@ -363,59 +366,71 @@ def delete_student_photo(db: Session, student_id: int, photo_id: int, rebuild: b
     return {"deleted": True, "faiss_removed": removed > 0, "rebuild": rebuild_result}
 
 
-def identify_student_from_image(db: Session, file: UploadFile):
-    """Return list of detected faces with matched student info (if any)."""
-    if ai_engine.identity_model is None:
-        return {"faces": [], "message": "Identity model not loaded"}
-    try:
-        contents = file.file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_UNCHANGED)
-        if img is None:
-            return {"faces": [], "message": "Invalid image"}
-        # Normalize channels
-        if len(img.shape) == 2:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        elif img.shape[2] == 4:
-            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-        raw_faces = ai_engine.identity_model.get(img) or []
-        results = []
-        h, w = img.shape[:2]
-        for f in raw_faces:
-            bbox = getattr(f, 'bbox', None)
-            emb = getattr(f, 'embedding', None)
-            if bbox is None or emb is None or len(bbox) < 4:
-                continue
-            # Prepare embedding
-            emb_arr = np.array(emb, dtype='float32')
-            if emb_arr.ndim == 1:
-                emb_arr = emb_arr.reshape(1, -1)
-            elif emb_arr.ndim == 2 and emb_arr.shape[0] != 1:
-                emb_arr = emb_arr[0:1]
-            if emb_arr.shape[1] != settings.EMBEDDING_DIM:
-                continue
-            matched_id, similarity = vector_db_instance.search_embedding(
-                emb_arr)
-            student_data = None
-            if matched_id:
-                s = get_student(db, matched_id)
-                if s:
-                    student_data = {
-                        "id": s.id,
-                        "name": s.name,
-                        "student_code": s.student_code,
-                        "email": s.email,
-                        "class_name": s.class_name,
-                        "major": s.major,
-                        "status": s.status
-                    }
-            x1, y1, x2, y2 = [int(v) for v in bbox[:4]]
-            results.append({
-                "bbox": [x1, y1, x2, y2],
-                "similarity": similarity,
-                "matched": student_data is not None,
-                "student": student_data
-            })
-        return {"faces": results, "message": "ok"}
-    except Exception as e:
-        return {"faces": [], "message": str(e)}
+def decode_image(contents: bytes):
+    """Decode uploaded bytes to a BGR image (grayscale/BGRA normalised), or None."""
+    nparr = np.frombuffer(contents, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    # Normalize channels
+    if len(img.shape) == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
+
+def search_faces(raw_faces) -> list[dict]:
+    """
+    Match analysed faces (bbox + embedding) against the gallery with one batched search.
+    Returns [{bbox, similarity, student_id}] - plain data, cacheable per gallery version.
+    """
+    boxes, embeddings = [], []
+    for f in raw_faces or []:
+        bbox = getattr(f, 'bbox', None)
+        emb = getattr(f, 'embedding', None)
+        if bbox is None or emb is None or len(bbox) < 4:
+            continue
+        # Prepare embedding (first row if several were returned)
+        emb_arr = np.array(emb, dtype='float32')
+        if emb_arr.ndim == 2:
+            emb_arr = emb_arr[0]
+        emb_arr = emb_arr.reshape(-1)
+        if emb_arr.shape[0] != settings.EMBEDDING_DIM:
+            continue
+        boxes.append([int(v) for v in bbox[:4]])
+        embeddings.append(emb_arr)
+    if not embeddings:
+        return []
+    student_ids, similarities = vector_db_instance.search_many(np.stack(embeddings))
+    return [{
+        "bbox": bbox,
+        "similarity": similarity,
+        "student_id": student_id
+    } for bbox, student_id, similarity in zip(boxes, student_ids, similarities)]
+
+
+def attach_students(db: Session, matches: list[dict]) -> dict:
+    """Recognition response for search_faces() output, with current student info."""
+    results = []
+    for match in matches:
+        student_data = None
+        if match["student_id"]:
+            s = get_student(db, match["student_id"])
+            if s:
+                student_data = {
+                    "id": s.id,
+                    "name": s.name,
+                    "student_code": s.student_code,
+                    "email": s.email,
+                    "class_name": s.class_name,
+                    "major": s.major,
+                    "status": s.status
+                }
+        results.append({
+            "bbox": match["bbox"],
+            "similarity": match["similarity"],
+            "matched": student_data is not None,
+            "student": student_data
+        })
+    return {"faces": results, "message": "ok"}
@@ -0,0 +1,127 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from core.config import settings
+from core.ai_loader import ai_engine
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching for the interactive endpoints.
+
+    Requests submitted from async handlers are queued; a collector task takes the first
+    one, waits at most `max_wait_ms` for more (up to `max_batch`), and runs
+    `fn(key, items) -> results` for each group of equal `key` (e.g. the same YOLO
+    settings) on a dedicated thread, so the event loop never blocks on a model and one
+    model is never called from two threads at once. Results (or the exception) are
+    handed back to each waiting request in order.
+    """
+
+    def __init__(self, name: str, fn, max_batch: int | None = None, max_wait_ms: float | None = None):
+        self.name = name
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch or settings.MICRO_BATCH_MAX_SIZE))
+        wait_ms = settings.MICRO_BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self.max_wait = max(0.0, float(wait_ms)) / 1000.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"batch-{name}")
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    def _ensure_collector(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            # First use, or a new event loop (test clients, server reload)
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._collect())
+
+    async def submit(self, item, key=None):
+        """Queue one item and wait for its result."""
+        self._ensure_collector()
+        future = self._loop.create_future()
+        await self._queue.put((key, item, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+            await self._run(loop, batch)
+
+    async def _run(self, loop, batch):
+        groups = {}
+        for key, item, future in batch:
+            # Client went away while waiting: nothing to compute for it
+            if not future.cancelled():
+                groups.setdefault(key, []).append((item, future))
+        for key, entries in groups.items():
+            items = [item for item, _ in entries]
+            try:
+                results = await loop.run_in_executor(self._executor, self.fn, key, items)
+            except Exception as e:
+                for _, future in entries:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(entries, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+def _detect_behaviors(key, images):
+    return ai_engine.detect_behaviors(images, **dict(key))
+
+
+def _faces(key, images):
+    det_size, with_embedding = key
+    if with_embedding:
+        return ai_engine.analyze_faces_batch(images, det_size)
+    return [ai_engine.detect_faces(img, det_size) for img in images]
+
+
+def _classify_emotions(key, crop_lists):
+    # One item = all face crops of one request; classify every crop of the batch at once
+    flat = [crop for crops in crop_lists for crop in crops]
+    labels = ai_engine.classify_emotions(flat, max_batch=settings.EMOTION_MAX_BATCH)
+    results, start = [], 0
+    for crops in crop_lists:
+        results.append(labels[start:start + len(crops)])
+        start += len(crops)
+    return results
+
+
+behavior_batcher = MicroBatcher("behavior", _detect_behaviors)
+face_batcher = MicroBatcher("faces", _faces)
+emotion_batcher = MicroBatcher("emotion", _classify_emotions)
+
+
+async def detect_behaviors(img, profile):
+    """YOLO detections ({label, box, conf} dicts) for one image."""
+    return await behavior_batcher.submit(img, key=tuple(sorted(profile.yolo_kwargs().items())))
+
+
+async def detect_faces(img, profile):
+    """Face boxes only (no embedding) at the profile's detector size."""
+    return await face_batcher.submit(img, key=(profile.det_size, False))
+
+
+async def analyze_faces(img, profile):
+    """Face boxes + embeddings at the profile's detector size."""
+    return await face_batcher.submit(img, key=(profile.det_size, True))
+
+
+async def classify_emotions(crops):
+    """One emotion label per BGR face crop (None when the model is not loaded)."""
+    if not crops:
+        return []
+    return await emotion_batcher.submit(list(crops))
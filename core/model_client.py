@@ -0,0 +1,183 @@
+import os
+import secrets
+import threading
+import time
+from multiprocessing.connection import Client
+from core.config import settings
+
+
+def authkey_path(address: str) -> str:
+    return settings.MODEL_SERVER_AUTHKEY_FILE or f"{address}.key"
+
+
+def create_authkey(address: str) -> bytes:
+    """
+    Server side: MODEL_SERVER_AUTHKEY, or a new random key written to the key file
+    (owner read/write only). Raises if the file cannot be written.
+    """
+    if settings.MODEL_SERVER_AUTHKEY:
+        return settings.MODEL_SERVER_AUTHKEY.encode()
+    key = secrets.token_hex(32).encode()
+    path = authkey_path(address)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.fchmod(fd, 0o600)
+        os.write(fd, key)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+    return key
+
+
+def load_authkey(address: str) -> bytes:
+    """Client side: MODEL_SERVER_AUTHKEY, or the key file written by the running server."""
+    if settings.MODEL_SERVER_AUTHKEY:
+        return settings.MODEL_SERVER_AUTHKEY.encode()
+    path = authkey_path(address)
+    try:
+        with open(path, 'rb') as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        key = b""
+    if not key:
+        raise RuntimeError(f"No model server key: set MODEL_SERVER_AUTHKEY or start "
+                           f"model_server.py, which writes {path}")
+    return key
+
+
+class RemoteFace:
+    """Plain stand-in for an insightface Face (bbox, kps, det_score, embedding)."""
+
+    def __init__(self, bbox, kps=None, det_score=None, embedding=None):
+        self.bbox = bbox
+        self.kps = kps
+        self.det_score = det_score
+        self.embedding = embedding
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data['bbox'], data.get('kps'), data.get('det_score'), data.get('embedding'))
+
+    def to_dict(self) -> dict:
+        return {'bbox': self.bbox, 'kps': self.kps, 'det_score': self.det_score}
+
+
+class RemoteAIEngine:
+    """
+    Client of the shared model server (core/model_server.py) with the same inference
+    methods as AIEngine. Requests are pickled over a Unix socket; every thread keeps its
+    own connection and reconnects once if the server was restarted.
+
+    behavior_model / identity_model / emotion_model are only availability markers
+    (True or None, as reported by the server) so existing `if not ai_engine.x_model`
+    checks keep working - the models themselves live in the server process.
+    """
+
+    INFO_RETRY_SECONDS = 5.0
+
+    def __init__(self, address: str, authkey: str | None = None, timeout: float | None = None):
+        self.address = address
+        self.authkey = authkey.encode() if authkey else None
+        self.timeout = timeout or settings.MODEL_SERVER_TIMEOUT_SECONDS
+        self._local = threading.local()
+        self._info = None
+        self._info_checked_at = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Read on every (re)connect: the server writes a new key when it restarts
+            authkey = self.authkey or load_authkey(self.address)
+            conn = Client(self.address, family='AF_UNIX', authkey=authkey)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _call(self, method: str, *args):
+        for attempt in (0, 1):
+            try:
+                conn = self._connection()
+                conn.send((method, args))
+                ready = conn.poll(self.timeout)
+                if ready:
+                    status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                # Server restarted: reconnect once
+                self._drop_connection()
+                if attempt:
+                    raise
+        if not ready:
+            # The late answer would be read by the next request -> discard the connection
+            self._drop_connection()
+            raise TimeoutError(f"Model server did not answer '{method}' within {self.timeout}s")
+        if status != "ok":
+            raise RuntimeError(f"Model server error in '{method}': {result}")
+        return result
+
+    @property
+    def info(self) -> dict:
+        """Loaded models as reported by the server; {} while it is unreachable."""
+        if self._info is None and time.monotonic() - self._info_checked_at >= self.INFO_RETRY_SECONDS:
+            self._info_checked_at = time.monotonic()
+            try:
+                self._info = self._call("info")
+            except Exception as e:
+                print(f"[WARN] Model server unavailable at {self.address}: {e}")
+        return self._info or {}
+
+    @property
+    def behavior_model(self):
+        return True if self.info.get('behavior') else None
+
+    @property
+    def identity_model(self):
+        return True if self.info.get('identity') else None
+
+    @property
+    def emotion_model(self):
+        return True if self.info.get('emotion') else None
+
+    @property
+    def emotion_classes(self):
+        return self.info.get('emotion_classes', [])
+
+    @property
+    def model_versions(self):
+        return self.info.get('model_versions', {})
+
+    def detect_behaviors(self, frames, **yolo_kwargs):
+        return self._call("detect_behaviors", list(frames), yolo_kwargs)
+
+    def detect_faces(self, img, det_size: int | None = None):
+        return [RemoteFace.from_dict(d) for d in self._call("detect_faces", img, det_size)]
+
+    def embed_faces(self, img, faces):
+        if not faces:
+            return faces
+        embeddings = self._call("embed_faces", img, [f.to_dict() for f in faces])
+        for face, embedding in zip(faces, embeddings):
+            face.embedding = embedding
+        return faces
+
+    def analyze_faces(self, img, det_size: int | None = None):
+        return [RemoteFace.from_dict(d) for d in self._call("analyze_faces", img, det_size)]
+
+    def analyze_faces_batch(self, images, det_size: int | None = None):
+        return [[RemoteFace.from_dict(d) for d in faces]
+                for faces in self._call("analyze_faces_batch", list(images), det_size)]
+
+    def classify_emotions(self, crops, max_batch: int = 64):
+        if not crops:
+            return []
+        return self._call("classify_emotions", list(crops), max_batch)
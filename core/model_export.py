@@ -0,0 +1,164 @@
+import hashlib
+import os
+import numpy as np
+import cv2
+from core.emotion_model import load_emotion_checkpoint, preprocess_emotion_batch
+from core.geometry import box_iou
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parity_marker(onnx_path: str) -> str:
+    return onnx_path + ".verified"
+
+
+def mark_verified(onnx_path: str):
+    """Record that this exact artifact passed the parity check (marker holds its sha256)."""
+    with open(parity_marker(onnx_path), 'w', encoding='utf-8') as f:
+        f.write(_file_sha256(onnx_path))
+
+
+def is_verified(onnx_path: str) -> bool:
+    """True only if the artifact has a parity marker matching its current content."""
+    try:
+        with open(parity_marker(onnx_path), 'r', encoding='utf-8') as f:
+            expected = f.read().strip()
+    except FileNotFoundError:
+        return False
+    return expected == _file_sha256(onnx_path)
+
+
+def discard(onnx_path: str):
+    """Delete an artifact that failed verification (and any stale marker)."""
+    for path in (onnx_path, parity_marker(onnx_path)):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _int8_path(onnx_path: str) -> str:
+    return onnx_path[:-len(".onnx")] + ".int8.onnx"
+
+
+def quantize_int8(onnx_path: str) -> str:
+    """
+    Dynamic int8 quantization (weights int8, activations quantized at run time).
+    Model metadata (Ultralytics stores class names/stride there) is copied over.
+    """
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out_path = _int8_path(onnx_path)
+    quantize_dynamic(onnx_path, out_path, weight_type=QuantType.QInt8)
+    source, quantized = onnx.load(onnx_path), onnx.load(out_path)
+    existing = {p.key for p in quantized.metadata_props}
+    for prop in source.metadata_props:
+        if prop.key not in existing:
+            quantized.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(quantized, out_path)
+    return out_path
+
+
+def export_yolo(pt_path: str, imgsz: int = 640, int8: bool = False) -> list[str]:
+    """yolov8_best.pt -> yolov8_best.onnx (dynamic batch and image size) [+ .int8.onnx]"""
+    from ultralytics import YOLO
+    onnx_path = YOLO(pt_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    outputs = [str(onnx_path)]
+    if int8:
+        outputs.append(quantize_int8(str(onnx_path)))
+    return outputs
+
+
+def export_emotion(ckpt_path: str, onnx_path: str, int8: bool = False, opset: int = 17) -> list[str]:
+    """best_resnet18_sgd.ckpt -> best_resnet18_sgd.onnx (dynamic batch) [+ .int8.onnx]"""
+    import torch
+    model = load_emotion_checkpoint(ckpt_path, torch.device("cpu"))
+    dummy = torch.zeros(1, 3, 224, 224)
+    torch.onnx.export(model, dummy, onnx_path,
+                      input_names=["images"], output_names=["logits"],
+                      dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+                      opset_version=opset)
+    outputs = [onnx_path]
+    if int8:
+        outputs.append(quantize_int8(onnx_path))
+    return outputs
+
+
+def sample_frames(video_path: str, count: int = 8) -> list:
+    """Evenly spaced frames of a video, used as parity-check inputs."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        frames = []
+        for index in np.linspace(0, max(total - 1, 0), count).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        return frames
+    finally:
+        cap.release()
+
+
+def verify_yolo(pt_path: str, onnx_path: str, frames: list, imgsz: int = 640,
+                min_iou: float = 0.9) -> bool:
+    """
+    Compare PyTorch and ONNX detections frame by frame: every box must have a
+    same-label partner with IoU >= min_iou in the other output.
+    """
+    from ultralytics import YOLO
+    reference, candidate = YOLO(pt_path), YOLO(onnx_path, task="detect")
+    ok = True
+    for i, frame in enumerate(frames):
+        ref = reference(frame, imgsz=imgsz, verbose=False)[0].boxes
+        cand = candidate(frame, imgsz=imgsz, verbose=False)[0].boxes
+        ref_cls, cand_cls = ref.cls.cpu().numpy(), cand.cls.cpu().numpy()
+        matched = 0
+        if len(ref_cls) and len(cand_cls):
+            iou = box_iou(ref.xyxy.cpu().numpy(), cand.xyxy.cpu().numpy())
+            iou[ref_cls[:, None] != cand_cls[None, :]] = 0
+            matched = int((iou.max(axis=1) >= min_iou).sum())
+        if matched != len(ref_cls) or len(ref_cls) != len(cand_cls):
+            ok = False
+            print(f"  frame {i}: torch {len(ref_cls)} boxes, onnx {len(cand_cls)} boxes, "
+                  f"{matched} matched")
+    print(f"YOLO parity ({onnx_path}): {'OK' if ok else 'MISMATCH'}")
+    return ok
+
+
+def verify_emotion(ckpt_path: str, onnx_path: str, frames: list, crops_per_frame: int = 8) -> bool:
+    """Compare predicted labels (and report the logit gap) on crops taken from the frames."""
+    import torch
+    import onnxruntime as ort
+
+    crops = []
+    for frame in frames:
+        h, w = frame.shape[:2]
+        size = max(16, min(h, w) // 4)
+        for k in range(crops_per_frame):
+            y = (k * size // 2) % max(1, h - size)
+            x = (k * size) % max(1, w - size)
+            crops.append(frame[y:y + size, x:x + size])
+    if not crops:
+        print("Emotion parity: no input frames, skipped")
+        return True
+
+    inputs = preprocess_emotion_batch(crops)
+    model = load_emotion_checkpoint(ckpt_path, torch.device("cpu"))
+    with torch.no_grad():
+        ref = model(torch.from_numpy(inputs)).numpy()
+    session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    cand = session.run(None, {session.get_inputs()[0].name: inputs})[0]
+
+    agree = float((ref.argmax(axis=1) == cand.argmax(axis=1)).mean())
+    gap = float(np.abs(ref - cand).max())
+    # fp32 export should agree exactly; int8 is allowed a small amount of label drift
+    ok = agree == 1.0 if ".int8." not in onnx_path else agree >= 0.95
+    print(f"Emotion parity ({onnx_path}): {agree:.1%} labels agree, max |logit diff| {gap:.4f} "
+          f"-> {'OK' if ok else 'MISMATCH'}")
+    return ok
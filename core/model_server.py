@@ -0,0 +1,123 @@
+import os
+import threading
+import traceback
+from multiprocessing.connection import Listener
+from core import ai_loader
+from core.ai_loader import AIEngine
+from core.model_client import create_authkey
+
+
+def _face_to_dict(face) -> dict:
+    return {
+        'bbox': face.bbox,
+        'kps': face.kps,
+        'det_score': float(face.det_score) if face.det_score is not None else None,
+        'embedding': face.embedding
+    }
+
+
+class ModelServer:
+    """
+    Owns the only copy of the models and answers RemoteAIEngine requests on a Unix socket.
+
+    Each client connection is served by its own thread; calls into one model are
+    serialised with a per-model lock (YOLO/InsightFace predictors are not thread-safe),
+    while different models can run concurrently.
+    """
+
+    def __init__(self, address: str, authkey: str | None = None):
+        self.address = address
+        self.authkey = authkey.encode() if authkey else None
+        # Reuse ai_loader's engine unless it is itself a remote client
+        engine = ai_loader.ai_engine.get()
+        self.engine = engine if isinstance(engine, AIEngine) else AIEngine()
+        self._locks = {name: threading.Lock()
+                       for name in ("behavior", "identity", "emotion")}
+        self._handlers = {
+            "info": self.info,
+            "detect_behaviors": self.detect_behaviors,
+            "detect_faces": self.detect_faces,
+            "embed_faces": self.embed_faces,
+            "analyze_faces": self.analyze_faces,
+            "analyze_faces_batch": self.analyze_faces_batch,
+            "classify_emotions": self.classify_emotions,
+        }
+
+    def info(self):
+        return {
+            'behavior': self.engine.behavior_model is not None,
+            'identity': self.engine.identity_model is not None,
+            'emotion': self.engine.emotion_model is not None,
+            'emotion_classes': self.engine.emotion_classes,
+            'model_versions': self.engine.model_versions,
+            'device': str(self.engine.device)
+        }
+
+    def detect_behaviors(self, frames, yolo_kwargs):
+        with self._locks["behavior"]:
+            return self.engine.detect_behaviors(frames, **yolo_kwargs)
+
+    def detect_faces(self, img, det_size):
+        with self._locks["identity"]:
+            faces = self.engine.detect_faces(img, det_size)
+        return [_face_to_dict(f) for f in faces]
+
+    def embed_faces(self, img, faces):
+        from insightface.app.common import Face
+        faces = [Face(bbox=f['bbox'], kps=f['kps'], det_score=f['det_score']) for f in faces]
+        with self._locks["identity"]:
+            self.engine.embed_faces(img, faces)
+        return [f.embedding for f in faces]
+
+    def analyze_faces(self, img, det_size):
+        with self._locks["identity"]:
+            faces = self.engine.analyze_faces(img, det_size)
+        return [_face_to_dict(f) for f in faces]
+
+    def analyze_faces_batch(self, images, det_size):
+        with self._locks["identity"]:
+            faces_per_image = self.engine.analyze_faces_batch(images, det_size)
+        return [[_face_to_dict(f) for f in faces] for faces in faces_per_image]
+
+    def classify_emotions(self, crops, max_batch):
+        with self._locks["emotion"]:
+            return self.engine.classify_emotions(crops, max_batch=max_batch)
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                handler = self._handlers.get(method)
+                try:
+                    if handler is None:
+                        raise ValueError(f"Unknown method: {method}")
+                    reply = ("ok", handler(*args))
+                except Exception as e:
+                    traceback.print_exc()
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self):
+        # Stale socket file from a previous run
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        os.makedirs(os.path.dirname(os.path.abspath(self.address)), exist_ok=True)
+        # Never listen without a secret: requests are unpickled by this process
+        authkey = self.authkey or create_authkey(self.address)
+        with Listener(self.address, family='AF_UNIX', authkey=authkey) as listener:
+            print(f"Model server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Failed handshake (wrong authkey) etc. - keep serving others
+                    print(f"[WARN] Model server rejected a connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,),
+                                 daemon=True).start()
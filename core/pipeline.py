@@ -0,0 +1,236 @@
+import queue
+import threading
+import traceback
+import multiprocessing as mp
+
+
+# End-of-stream marker: every producer (source feeder, stage worker) sends exactly one
+# after its last item, so a queue is exhausted once one marker per producer arrived
+_EOS = "__pipeline_eos__"
+# Put back on a stage's input queue once it is exhausted, to release sibling workers
+_DRAINED = "__pipeline_drained__"
+
+
+class StageFailure:
+    """Envelope carrying an exception raised inside a stage down to the consumer."""
+
+    def __init__(self, stage_name: str, error: BaseException):
+        self.stage_name = stage_name
+        self.message = f"{type(error).__name__}: {error}"
+        self.trace = traceback.format_exc()
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+    - fn: callable(payload) -> payload. Must be a module-level function when mode="process".
+    - workers: number of parallel workers pulling from the same input queue.
+    - mode: "thread" or "process".
+    - batch_size: when set, fn receives a list of up to batch_size payloads and must
+      return a list of results in the same order.
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1, mode: str = "thread", batch_size: int | None = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown stage mode: {mode}")
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.mode = mode
+        self.batch_size = max(1, int(batch_size)) if batch_size else None
+
+
+def _put(q, item, stop_event, timeout: float = 0.2) -> bool:
+    """Blocking put that gives up once the pipeline is stopping. Returns True when enqueued."""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop_event, timeout: float = 0.2):
+    """Blocking get that returns _EOS once the pipeline is stopping."""
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=timeout)
+        except queue.Empty:
+            continue
+    return _EOS
+
+
+def _apply(name, fn, batched, batch):
+    """Run fn over a batch of (seq, payload) envelopes; failures flow through untouched."""
+    payloads = [payload for _, payload in batch]
+    live = [i for i, p in enumerate(payloads) if not isinstance(p, StageFailure)]
+    try:
+        if batched:
+            results = fn([payloads[i] for i in live])
+            if len(results) != len(live):
+                raise ValueError(
+                    f"batched stage returned {len(results)} results for {len(live)} inputs")
+        else:
+            results = [fn(payloads[i]) for i in live]
+        for i, result in zip(live, results):
+            payloads[i] = result
+    except Exception as e:
+        failure = StageFailure(name, e)
+        for i in live:
+            payloads[i] = failure
+    return [(seq, payload) for (seq, _), payload in zip(batch, payloads)]
+
+
+def _stage_worker(name, fn, batch_size, in_q, out_q, stop_event, producers, eos_seen, lock):
+    """
+    Worker loop shared by thread and process stages.
+
+    A queue only guarantees FIFO per producer (each mp.Queue writer has its own feeder
+    thread), so one upstream worker's _EOS can overtake a sibling's last results. The
+    stage therefore counts one _EOS per upstream producer in eos_seen before it treats
+    its input as exhausted, and every worker sends its own _EOS after its own results.
+    """
+    try:
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < (batch_size or 1):
+                envelope = _get(in_q, stop_event)
+                if stop_event.is_set():
+                    return
+                if envelope == _DRAINED:
+                    # Let the next sibling worker of this stage see it as well
+                    _put(in_q, _DRAINED, stop_event)
+                    done = True
+                    break
+                if envelope == _EOS:
+                    with lock:
+                        eos_seen.value += 1
+                        exhausted = eos_seen.value == producers
+                    if exhausted:
+                        _put(in_q, _DRAINED, stop_event)
+                        done = True
+                        break
+                    continue
+                batch.append(envelope)
+            if not batch:
+                continue
+            for envelope in _apply(name, fn, batch_size is not None, batch):
+                if not _put(out_q, envelope, stop_event):
+                    return
+    finally:
+        _put(out_q, _EOS, stop_event)
+
+
+class _Counter:
+    """Thread-side stand-in for multiprocessing.Value."""
+
+    def __init__(self, value: int):
+        self.value = value
+
+
+class Pipeline:
+    """
+    Staged pipeline: source -> stage 1 -> ... -> stage N -> consumer.
+
+    Every hop is a bounded queue (queue_size), so a slow stage blocks its producers
+    instead of letting frames pile up in memory (backpressure). The source iterable is
+    drained on a feeder thread and results are yielded by run() in the original source
+    order, even when a stage runs several workers.
+    """
+
+    def __init__(self, source, stages: list, queue_size: int = 8):
+        self.source = source
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self._use_mp = any(s.mode == "process" for s in stages)
+        self._stop = mp.Event() if self._use_mp else threading.Event()
+        self._threads = []
+        self._processes = []
+
+    def _make_queue(self):
+        if self._use_mp:
+            return mp.Queue(maxsize=self.queue_size)
+        return queue.Queue(maxsize=self.queue_size)
+
+    def _feed(self, out_q):
+        seq = 0
+        try:
+            for payload in self.source:
+                if not _put(out_q, (seq, payload), self._stop):
+                    return
+                seq += 1
+        except Exception as e:
+            _put(out_q, (seq, StageFailure("source", e)), self._stop)
+        finally:
+            _put(out_q, _EOS, self._stop)
+
+    def _start(self):
+        queues = [self._make_queue() for _ in range(len(self.stages) + 1)]
+        feeder = threading.Thread(
+            target=self._feed, args=(queues[0],), name="pipeline-source", daemon=True)
+        feeder.start()
+        self._threads.append(feeder)
+
+        producers = 1
+        for i, stage in enumerate(self.stages):
+            if stage.mode == "process":
+                eos_seen, lock = mp.Value('i', 0), mp.Lock()
+            else:
+                eos_seen, lock = _Counter(0), threading.Lock()
+            args = (stage.name, stage.fn, stage.batch_size, queues[i],
+                    queues[i + 1], self._stop, producers, eos_seen, lock)
+            producers = stage.workers
+            for w in range(stage.workers):
+                worker_name = f"pipeline-{stage.name}-{w}"
+                if stage.mode == "process":
+                    p = mp.Process(target=_stage_worker, args=args,
+                                   name=worker_name, daemon=True)
+                    p.start()
+                    self._processes.append(p)
+                else:
+                    t = threading.Thread(
+                        target=_stage_worker, args=args, name=worker_name, daemon=True)
+                    t.start()
+                    self._threads.append(t)
+        return queues[-1]
+
+    def _shutdown(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=5)
+        for p in self._processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+
+    def run(self):
+        """Generator yielding the output of the last stage, in source order."""
+        out_q = self._start()
+        producers = self.stages[-1].workers if self.stages else 1
+        pending = {}
+        next_seq = 0
+        try:
+            while producers:
+                envelope = _get(out_q, self._stop)
+                if envelope == _EOS:
+                    producers -= 1
+                    continue
+                seq, payload = envelope
+                if isinstance(payload, StageFailure):
+                    raise PipelineError(
+                        f"Stage '{payload.stage_name}' failed: {payload.message}\n{payload.trace}")
+                pending[seq] = payload
+                while next_seq in pending:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+            if pending:
+                raise PipelineError(
+                    f"Pipeline lost item {next_seq} ({len(pending)} later items were delivered)")
+        finally:
+            self._shutdown()
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from core.config import settings
+
+
+class ResultCache:
+    """
+    LRU cache of inference results for the interactive endpoints, keyed by a tuple that
+    callers build from the image content hash, the loaded model versions and the request
+    parameters. Anything that changes the answer must be part of the key (e.g. the
+    VectorDB generation for recognition), so stale entries are simply never hit again.
+
+    With disk_dir set, entries are also pickled there (shared by all web workers and
+    kept across restarts); the oldest files are pruned beyond disk_max_entries.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_entries: int | None = None, disk_dir: str | None = None,
+                 disk_max_entries: int | None = None):
+        self.max_entries = settings.RESULT_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.disk_dir = settings.RESULT_CACHE_DIR if disk_dir is None else disk_dir
+        self.disk_max_entries = (settings.RESULT_CACHE_DISK_MAX_ENTRIES
+                                 if disk_max_entries is None else disk_max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def _digest(key) -> str:
+        return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.RESULT_CACHE_ENABLED and self.max_entries > 0
+
+    def _disk_path(self, digest: str) -> str:
+        return os.path.join(self.disk_dir, f"{digest}.pkl")
+
+    def get(self, key):
+        """Cached value for key, or None."""
+        if not self.enabled:
+            return None
+        digest = self._digest(key)
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return self._entries[digest]
+        value = self._read_disk(digest)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(digest, value)
+        return value
+
+    def put(self, key, value):
+        if not self.enabled or value is None:
+            return
+        digest = self._digest(key)
+        with self._lock:
+            self._remember(digest, value)
+        self._write_disk(digest, value)
+
+    def _remember(self, digest: str, value):
+        self._entries[digest] = value
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, digest: str):
+        if not self.disk_dir:
+            return None
+        try:
+            path = self._disk_path(digest)
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            # Pruning drops the least recently used files
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[WARN] Unreadable result cache entry {digest}: {e}")
+            return None
+
+    def _write_disk(self, digest: str, value):
+        if not self.disk_dir:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._disk_path(digest)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Readers in other workers never see a half-written file
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"[WARN] Failed to write result cache entry: {e}")
+            return
+        self._disk_writes += 1
+        if self._disk_writes % self.PRUNE_EVERY == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        try:
+            files = [e for e in os.scandir(self.disk_dir) if e.name.endswith('.pkl')]
+            excess = len(files) - self.disk_max_entries
+            if excess <= 0:
+                return
+            files.sort(key=lambda e: e.stat().st_mtime)
+            for entry in files[:excess]:
+                os.unlink(entry.path)
+        except OSError as e:
+            print(f"[WARN] Failed to prune result cache: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+result_cache = ResultCache()
@@ -0,0 +1,143 @@
+from collections import Counter, deque
+
+import numpy as np
+
+from core.geometry import as_boxes, box_iou
+
+
+class Track:
+    def __init__(self, track_id: int, box, frame_no: int, vote_window: int):
+        self.track_id = track_id
+        self.box = box
+        self.last_seen = frame_no
+        self.hits = 1
+        # Recent identity votes (FAISS match or None for unknown)
+        self.votes = deque(maxlen=vote_window)
+        self.last_verified = None
+
+    @property
+    def identity(self):
+        """Majority identity over the recorded votes (None = unknown)."""
+        if not self.votes:
+            return None
+        return Counter(self.votes).most_common(1)[0][0]
+
+    def to_dict(self) -> dict:
+        return {
+            'track_id': self.track_id,
+            'box': [float(v) for v in self.box],
+            'last_seen': self.last_seen,
+            'hits': self.hits,
+            'votes': list(self.votes),
+            'last_verified': self.last_verified
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, vote_window: int):
+        track = cls(int(data['track_id']), np.asarray(data['box'], dtype=np.float32),
+                    int(data['last_seen']), vote_window)
+        track.hits = int(data.get('hits', 1))
+        track.votes.extend(data.get('votes') or [])
+        track.last_verified = data.get('last_verified')
+        return track
+
+
+class IoUTracker:
+    """
+    Lightweight greedy IoU tracker across sampled frames.
+
+    Each detection is matched to the live track it overlaps most (IoU >= iou_threshold);
+    unmatched detections open new tracks and tracks unseen for more than max_age updates
+    are dropped. Tracks also carry an identity cache: the first `votes` embeddings of a
+    track are searched and majority-voted, after which the track is only re-verified every
+    `reverify_interval` updates. A lost track that reappears gets a fresh id and is
+    resolved again. The same vote window smooths per-frame values such as behavior
+    labels (smooth()).
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_age: int = 5,
+                 votes: int = 3, reverify_interval: int = 30):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.votes = max(1, int(votes))
+        self.reverify_interval = max(1, int(reverify_interval))
+        self.tracks: dict[int, Track] = {}
+        self.frame_no = 0
+        self._next_id = 1
+
+    def update(self, boxes) -> list[int]:
+        """Advance one frame and return a track id for every box, in input order."""
+        self.frame_no += 1
+        boxes = as_boxes(boxes)
+        assigned = [None] * len(boxes)
+
+        live = list(self.tracks.values())
+        if live and len(boxes):
+            iou = box_iou(boxes, [t.box for t in live])
+            # Greedy: repeatedly take the best remaining (detection, track) pair
+            while True:
+                d, t = np.unravel_index(np.argmax(iou), iou.shape)
+                if iou[d, t] < self.iou_threshold:
+                    break
+                track = live[t]
+                track.box = boxes[d]
+                track.last_seen = self.frame_no
+                track.hits += 1
+                assigned[d] = track.track_id
+                iou[d, :] = -1
+                iou[:, t] = -1
+
+        for d, track_id in enumerate(assigned):
+            if track_id is None:
+                track = Track(self._next_id, boxes[d],
+                              self.frame_no, self.votes)
+                self.tracks[track.track_id] = track
+                assigned[d] = track.track_id
+                self._next_id += 1
+
+        for track_id in [tid for tid, t in self.tracks.items()
+                         if self.frame_no - t.last_seen > self.max_age]:
+            del self.tracks[track_id]
+        return assigned
+
+    def needs_identity(self, track_id: int) -> bool:
+        """True while the track has too few votes or is due for periodic re-verification."""
+        track = self.tracks[track_id]
+        if len(track.votes) < self.votes:
+            return True
+        return self.frame_no - track.last_verified >= self.reverify_interval
+
+    def add_vote(self, track_id: int, identity):
+        track = self.tracks[track_id]
+        track.votes.append(identity)
+        track.last_verified = self.frame_no
+
+    def identity(self, track_id: int):
+        return self.tracks[track_id].identity
+
+    def smooth(self, track_id: int, value):
+        """
+        Record this frame's value (e.g. a behavior label) for the track and return the
+        majority over its last `votes` values; ties go to the most recent one.
+        """
+        track = self.tracks[track_id]
+        track.votes.append(value)
+        counts = Counter(track.votes)
+        best = max(counts.values())
+        return next(v for v in reversed(track.votes) if counts[v] == best)
+
+    def state_dict(self) -> dict:
+        """JSON-serialisable snapshot (tracks + identity votes) used for job checkpoints."""
+        return {
+            'frame_no': self.frame_no,
+            'next_id': self._next_id,
+            'tracks': [t.to_dict() for t in self.tracks.values()]
+        }
+
+    def load_state_dict(self, state: dict):
+        self.frame_no = int(state.get('frame_no', 0))
+        self._next_id = int(state.get('next_id', 1))
+        self.tracks = {}
+        for data in state.get('tracks') or []:
+            track = Track.from_dict(data, self.votes)
+            self.tracks[track.track_id] = track
@@ -0,0 +1,244 @@
+import threading
+import time
+import cv2
+
+
+DEFAULT_FPS = 30
+
+
+class SampledFrameReader:
+    """
+    Iterate a cv2.VideoCapture and yield only the frames that will be analysed,
+    as {'timestamp', 'frame_index', 'frame'} dicts.
+
+    Skipped frames are never converted to BGR:
+    - "grab": cap.grab() for skipped frames, cap.retrieve() only for sampled ones.
+      grab() still demuxes/decodes the packet but skips colour conversion and the copy.
+    - "seek": jump straight to the next sampled frame with CAP_PROP_POS_FRAMES. FFmpeg
+      seeks to the previous keyframe and decodes forward, so this only pays off when
+      the sampling interval is long compared to the GOP.
+    - "auto": "seek" when interval >= VIDEO_SEEK_MIN_INTERVAL, otherwise "grab".
+      Falls back to "grab" if the backend refuses to seek.
+
+    start_frame/end_frame restrict reading to [start_frame, end_frame); frame indexes and
+    timestamps stay relative to the whole video, so a segment yields exactly the samples a
+    full read would yield for that range when start_frame is a multiple of the interval.
+    """
+
+    def __init__(self, cap, fps: float, interval: int | None = None,
+                 strategy: str = "auto", seek_min_interval: int = 90,
+                 start_frame: int = 0, end_frame: int | None = None):
+        self.cap = cap
+        self.fps = fps if fps and fps > 0 else DEFAULT_FPS
+        self.interval = max(1, int(interval if interval else self.fps))
+        if strategy == "auto":
+            strategy = "seek" if self.interval >= seek_min_interval else "grab"
+        if strategy not in ("grab", "seek"):
+            raise ValueError(f"Unknown sampling strategy: {strategy}")
+        self.strategy = strategy
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        self.total_frames = total if total > 0 else None
+        self.start_frame = max(0, int(start_frame))
+        self.end_frame = end_frame if end_frame is not None else self.total_frames
+
+    def _sample(self, frame_index: int, frame):
+        return {
+            'timestamp': round(frame_index / self.fps, 2),
+            'frame_index': frame_index,
+            'frame': frame
+        }
+
+    def _in_range(self, frame_index: int) -> bool:
+        return self.end_frame is None or frame_index < self.end_frame
+
+    def _iter_grab(self, frame_index: int):
+        while self._in_range(frame_index):
+            if frame_index % self.interval == 0 and frame_index >= self.start_frame:
+                ret, frame = self.cap.read()
+                if not ret:
+                    return
+                yield self._sample(frame_index, frame)
+            elif not self.cap.grab():
+                return
+            frame_index += 1
+
+    def _iter_seek(self):
+        # First sample at or after start_frame
+        frame_index = -(-self.start_frame // self.interval) * self.interval
+        position = 0
+        while self._in_range(frame_index):
+            if frame_index != position and not self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index):
+                # Backend cannot seek: continue sequentially from the current position
+                yield from self._iter_grab(position)
+                return
+            ret, frame = self.cap.read()
+            if not ret:
+                return
+            yield self._sample(frame_index, frame)
+            position = frame_index + 1
+            frame_index += self.interval
+
+    def __iter__(self):
+        if self.strategy == "seek":
+            return self._iter_seek()
+        if self.start_frame > 0 and self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame):
+            return self._iter_grab(self.start_frame)
+        # From the beginning (or the backend cannot seek: grab up to start_frame)
+        return self._iter_grab(0)
+
+
+class AdaptiveFrameReader(SampledFrameReader):
+    """
+    Motion-driven sampler between min_rate and max_rate analysed frames per second.
+
+    Probe frames are read every fps / max_rate frames and compared with the previous probe
+    on a small grayscale thumbnail (mean absolute difference in [0, 1]). A probe is emitted
+    when motion exceeds motion_threshold, while still inside hold_seconds after the last
+    burst, or when nothing was emitted for 1 / min_rate seconds. Static stretches therefore
+    fall back to min_rate while short events (hand-raising, standing up) are sampled at
+    max_rate. Emitted samples carry their 'motion' score.
+    """
+
+    THUMB_WIDTH = 64
+
+    def __init__(self, cap, fps: float, min_rate: float = 0.2, max_rate: float = 2.0,
+                 motion_threshold: float = 0.02, hold_seconds: float = 3.0, **kwargs):
+        fps = fps if fps and fps > 0 else DEFAULT_FPS
+        max_rate = max(max_rate, 1e-3)
+        super().__init__(cap, fps, interval=max(1, round(fps / max_rate)), **kwargs)
+        self.max_gap = 1.0 / max(min(min_rate, max_rate), 1e-3)
+        self.motion_threshold = motion_threshold
+        self.hold_seconds = hold_seconds
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        size = (self.THUMB_WIDTH, max(1, round(h * self.THUMB_WIDTH / w)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def __iter__(self):
+        prev_thumb = None
+        last_emit = None
+        active_until = float('-inf')
+        # Tolerance so that rounding of timestamps does not skip a min-rate sample
+        eps = 0.5 * self.interval / self.fps
+        for sample in super().__iter__():
+            thumb = self._thumbnail(sample['frame'])
+            if prev_thumb is None:
+                motion = 0.0
+            else:
+                motion = float(cv2.absdiff(thumb, prev_thumb).mean()) / 255.0
+            prev_thumb = thumb
+
+            ts = sample['timestamp']
+            if motion >= self.motion_threshold:
+                active_until = ts + self.hold_seconds
+            if last_emit is None or ts <= active_until or ts - last_emit >= self.max_gap - eps:
+                sample['motion'] = motion
+                last_emit = ts
+                yield sample
+
+
+class LiveFrameSource:
+    """
+    Frame source for live streams (RTSP/HTTP URL or camera index), or a local file
+    replayed at real-time speed (realtime=True) for testing.
+
+    A capture thread reads continuously and keeps only the newest frame, so when
+    analysis cannot keep up, older frames are dropped instead of queued. Iterating
+    yields at most sample_rate frames per second as {'timestamp', 'frame_index',
+    'frame', 'deadline'}; 'deadline' (time.monotonic) = capture time + max_lag, after
+    which downstream stages should skip the frame to keep latency bounded.
+    Timestamps are seconds since the stream started, plus time_offset.
+    """
+
+    def __init__(self, source, sample_rate: float = 1.0, realtime: bool = False,
+                 max_lag: float = 3.0, max_duration: float | None = None,
+                 time_offset: float = 0.0):
+        src = int(source) if str(source).isdigit() else source
+        self.cap = cv2.VideoCapture(src)
+        if not self.cap.isOpened():
+            raise Exception(f"Cannot open stream: {source}")
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else DEFAULT_FPS
+        self.interval = 1.0 / max(sample_rate, 1e-3)
+        self.realtime = realtime
+        self.max_lag = max_lag
+        self.max_duration = max_duration
+        self.time_offset = time_offset
+
+        self.captured = 0
+        self.yielded = 0
+        self._latest = None
+        self._seq = 0
+        self._ended = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._capture_loop, name="live-capture", daemon=True)
+
+    @property
+    def dropped(self) -> int:
+        return self.captured - self.yielded
+
+    def _capture_loop(self):
+        start = time.monotonic()
+        frame_index = 0
+        try:
+            while not self._stop.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                if self.realtime:
+                    # Replay a file no faster than its native frame rate
+                    delay = start + frame_index / self.fps - time.monotonic()
+                    if delay > 0:
+                        self._stop.wait(delay)
+                with self._cond:
+                    self._latest = (time.monotonic(), frame_index, frame)
+                    self._seq += 1
+                    self.captured += 1
+                    self._cond.notify_all()
+                frame_index += 1
+        finally:
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+
+    def __iter__(self):
+        self._thread.start()
+        started = time.monotonic()
+        next_due = started
+        last_seq = 0
+        try:
+            while not self._stop.is_set():
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+                with self._cond:
+                    while self._seq == last_seq and not self._ended and not self._stop.is_set():
+                        self._cond.wait(0.5)
+                    if self._seq == last_seq:
+                        return
+                    last_seq = self._seq
+                    captured_at, frame_index, frame = self._latest
+                elapsed = captured_at - started
+                if self.max_duration is not None and elapsed > self.max_duration:
+                    return
+                self.yielded += 1
+                yield {
+                    'timestamp': round(self.time_offset + elapsed, 2),
+                    'frame_index': frame_index,
+                    'frame': frame,
+                    'deadline': captured_at + self.max_lag
+                }
+                # A slow consumer takes the newest frame right away on its next request
+                next_due = max(next_due + self.interval, time.monotonic())
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self.cap.release()
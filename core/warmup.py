@@ -0,0 +1,127 @@
+import threading
+import time
+import numpy as np
+from sqlalchemy import text
+from core.config import settings
+
+
+class Warmup:
+    """
+    Background start-up of the web app: create tables, load the models (with one dummy
+    inference per model so the first real request does not pay for lazy CUDA/ORT
+    initialisation) and read the FAISS index.
+
+    The app starts serving immediately; /readyz reports 503 until every component is
+    ready, so a load balancer only sends traffic to warmed workers. Failed components
+    are retried every WARMUP_RETRY_SECONDS (e.g. DB or model server not up yet).
+    """
+
+    COMPONENTS = ("database", "models", "index")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.status = {name: "pending" for name in self.COMPONENTS}
+        self.errors = {}
+        self.details = {}
+        self.started_at = None
+        self.ready_at = None
+
+    def _warm_database(self):
+        from core.database import engine, Base
+        Base.metadata.create_all(bind=engine)
+
+    def _warm_models(self):
+        if not settings.WARMUP_MODELS_ON_STARTUP:
+            self.details['models'] = 'lazy'
+            return
+        from core.ai_loader import ai_engine
+        from core.inference_profiles import get_profile
+        if settings.MODEL_SERVER_SOCKET and not ai_engine.info:
+            raise RuntimeError(f"Model server not reachable at {settings.MODEL_SERVER_SOCKET}")
+
+        size = settings.WARMUP_IMAGE_SIZE
+        image = np.zeros((size, size, 3), dtype=np.uint8)
+        if ai_engine.behavior_model is not None:
+            ai_engine.detect_behaviors([image], **get_profile().yolo_kwargs())
+        if ai_engine.identity_model is not None:
+            ai_engine.analyze_faces(image)
+        if ai_engine.emotion_model is not None:
+            ai_engine.classify_emotions([image[:112, :112]])
+        # A missing weights file is not retried: it will not appear by waiting
+        self.details['models'] = {
+            'behavior': ai_engine.behavior_model is not None,
+            'identity': ai_engine.identity_model is not None,
+            'emotion': ai_engine.emotion_model is not None,
+        }
+
+    def _warm_index(self):
+        from db.vector_db import vector_db_instance
+        from db.index_factory import index_kind
+        gallery = vector_db_instance.get()
+        self.details['index'] = {'vectors': gallery.size, 'kind': index_kind(gallery.index)}
+
+    def _run(self):
+        steps = {
+            "database": self._warm_database,
+            "models": self._warm_models,
+            "index": self._warm_index,
+        }
+        while not self._stopping:
+            pending = [name for name in self.COMPONENTS if self.status[name] != "ready"]
+            if not pending:
+                self.ready_at = time.time()
+                print(f"Warm-up finished in {self.ready_at - self.started_at:.1f}s")
+                return
+            for name in pending:
+                self.status[name] = "loading"
+                try:
+                    steps[name]()
+                    self.status[name] = "ready"
+                    self.errors.pop(name, None)
+                except Exception as e:
+                    self.status[name] = "failed"
+                    self.errors[name] = f"{type(e).__name__}: {e}"
+                    print(f"[WARN] Warm-up of {name} failed: {e}")
+            if any(self.status[name] != "ready" for name in self.COMPONENTS):
+                time.sleep(settings.WARMUP_RETRY_SECONDS)
+
+    def start(self):
+        """Start the warm-up thread once per process."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Shutdown: report not-ready so the load balancer drains this worker first."""
+        self._stopping = True
+
+    def check_database(self) -> bool:
+        from core.database import engine
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            self.errors['database_ping'] = f"{type(e).__name__}: {e}"
+            return False
+
+    def readiness(self) -> tuple[bool, dict]:
+        ready = (not self._stopping
+                 and all(self.status[name] == "ready" for name in self.COMPONENTS))
+        if ready:
+            self.errors.pop('database_ping', None)
+            ready = self.check_database()
+        return ready, {
+            'stopping': self._stopping,
+            'components': dict(self.status),
+            'details': dict(self.details),
+            'errors': dict(self.errors),
+        }
+
+
+warmup = Warmup()
@@ -0,0 +1,164 @@
+import math
+import faiss
+import numpy as np
+from core.config import settings
+
+INDEX_KINDS = ("flat", "hnsw", "ivf")
+
+
+def choose_kind(n_vectors: int, current: str | None = None) -> str:
+    """
+    Index kind for a gallery of n_vectors according to FAISS_INDEX_TYPE.
+    In "auto" mode an approximate index only falls back to flat below half the
+    threshold, so a gallery hovering around it is not rebuilt back and forth.
+    """
+    kind = settings.FAISS_INDEX_TYPE
+    if kind == "auto":
+        threshold = settings.FAISS_APPROX_THRESHOLD
+        if current not in (None, "flat") and n_vectors >= threshold // 2:
+            return current
+        return settings.FAISS_APPROX_KIND if n_vectors >= threshold else "flat"
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE '{kind}' (expected auto, {', '.join(INDEX_KINDS)})")
+    return kind
+
+
+def index_kind(index) -> str:
+    """'flat', 'hnsw' or 'ivf' for an index built by build_index (or the legacy flat one)."""
+    inner = faiss.downcast_index(index.index) if hasattr(index, 'id_map') else faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def supports_remove(index) -> bool:
+    """HNSW graphs cannot drop vectors: removals stay tombstones until the next rebuild."""
+    return index_kind(index) != "hnsw"
+
+
+def tune(index):
+    """Apply the recall/speed knobs from settings (not stored in the index file)."""
+    kind = index_kind(index)
+    if kind == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+    elif kind == "ivf":
+        faiss.downcast_index(index).nprobe = settings.FAISS_IVF_NPROBE
+    return index
+
+
+def exclude_selector(exclude_ids):
+    """
+    IDSelector hiding exclude_ids, or None. FAISS only reads it while searching, so one
+    selector can be shared by concurrent searches (unlike SearchParameters).
+    """
+    if not exclude_ids:
+        return None
+    batch = faiss.IDSelectorBatch(np.array(sorted(exclude_ids), dtype=np.int64))
+    selector = faiss.IDSelectorNot(batch)
+    # IDSelectorNot does not own the batch: keep it alive with the selector
+    selector.referenced_batch = batch
+    return selector
+
+
+def search_params(index, selector=None):
+    """
+    New SearchParameters of the right class for the index kind (efSearch / nprobe) with an
+    optional selector from exclude_selector(), or None. Build one per search call:
+    IndexIDMap swaps params.sel while it searches, so a params object must never be used
+    by two threads at once. The caller keeps `selector` referenced during the search.
+    """
+    if selector is None:
+        return None
+    kind = index_kind(index)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=settings.FAISS_HNSW_EF_SEARCH)
+    if kind == "ivf":
+        return faiss.SearchParametersIVF(sel=selector, nprobe=settings.FAISS_IVF_NPROBE)
+    return faiss.SearchParameters(sel=selector)
+
+
+def read_index(path: str, mmap: bool = False):
+    """
+    Load an index file. mmap=True maps the vectors (flat/HNSW storage, IVF lists) read-only
+    instead of copying them, so every process opening the same snapshot shares the pages;
+    such an index must never be modified.
+    """
+    if mmap:
+        try:
+            return tune(faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY))
+        except RuntimeError as e:
+            print(f"[WARN] Cannot memory-map {path} ({e}), loading it in memory")
+    return tune(faiss.read_index(path))
+
+
+def _ivf_nlist(n_vectors: int) -> int:
+    if settings.FAISS_IVF_NLIST > 0:
+        nlist = settings.FAISS_IVF_NLIST
+    else:
+        nlist = int(4 * math.sqrt(max(n_vectors, 1)))
+    # k-means wants ~39 training points per centroid
+    return max(1, min(nlist, n_vectors // 39))
+
+
+def build_index(kind: str, dim: int, vectors: np.ndarray | None = None, ids: np.ndarray | None = None):
+    """
+    New inner-product index of the given kind holding (vectors, ids); vectors must be
+    L2-normalised. Every kind keeps caller-chosen int64 ids:
+    - flat: IndexIDMap(IndexFlatIP), exact
+    - hnsw: IndexIDMap2(IndexHNSWFlat), approximate, FAISS_HNSW_* knobs
+    - ivf:  IndexIVFFlat with native ids, trained on `vectors`, FAISS_IVF_* knobs
+    """
+    if vectors is None:
+        vectors = np.zeros((0, dim), dtype='float32')
+        ids = np.zeros(0, dtype=np.int64)
+    if kind == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, settings.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+        index = faiss.IndexIDMap2(hnsw)
+    elif kind == "ivf":
+        if len(vectors) == 0:
+            raise ValueError("An IVF index needs vectors to train on")
+        nlist = _ivf_nlist(len(vectors))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        sample = vectors
+        max_train = 256 * nlist
+        if len(sample) > max_train:
+            sample = sample[np.random.default_rng(0).choice(len(sample), max_train, replace=False)]
+        index.train(sample)
+    elif kind == "flat":
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+    else:
+        raise ValueError(f"Unknown index kind '{kind}'")
+    if len(vectors):
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'),
+                           np.ascontiguousarray(ids, dtype=np.int64))
+    return tune(index)
+
+
+def export_vectors(index):
+    """All (vectors (N, d), ids (N,)) stored in an index built by build_index."""
+    if index_kind(index) == "ivf":
+        from faiss.contrib.inspect_tools import get_invlist
+        ivf = faiss.downcast_index(index)
+        all_ids, all_vecs = [], []
+        for list_no in range(ivf.nlist):
+            list_ids, codes = get_invlist(ivf.invlists, list_no)
+            if len(list_ids):
+                all_ids.append(list_ids)
+                all_vecs.append(codes.view('float32').reshape(len(list_ids), ivf.d))
+        if not all_ids:
+            return np.zeros((0, ivf.d), dtype='float32'), np.zeros(0, dtype=np.int64)
+        return np.concatenate(all_vecs), np.concatenate(all_ids).astype(np.int64)
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    vectors = index.index.reconstruct_n(0, index.ntotal) if index.ntotal else \
+        np.zeros((0, index.d), dtype='float32')
+    return vectors, ids
+
+
+def index_ids(index) -> set:
+    """Set of ids stored in the index (including HNSW tombstones)."""
+    if index_kind(index) == "ivf":
+        return set(export_vectors(index)[1].tolist())
+    return set(faiss.vector_to_array(index.id_map).tolist())
@@ -57,6 +57,8 @@ class ClassSession(Base):
     status = Column(String(50), default="pending")
     duration = Column(Float)
     fps = Column(Float)
+    # fast, balanced, accurate (NULL = settings.INFERENCE_PROFILE)
+    inference_profile = Column(String(20))
     # Aggregated results and details (JSON stored as text)
     behavior_counts = Column(Text)
     emotion_counts = Column(Text)
@@ -113,3 +115,73 @@ class SessionStudentLog(Base):
     # Relationship
     behavior_log = relationship(
         "SessionBehaviorLog", back_populates="students")
+
+
+class SessionCheckpoint(Base):
+    """Progress of an in-flight video job, committed together with the logs it covers."""
+    __tablename__ = "session_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey(
+        "class_sessions.id"), unique=True, index=True)
+    # Checkpoint only applies to the video it was taken on
+    video_path = Column(String(1024))
+
+    # Last sampled frame whose logs are committed
+    last_frame_index = Column(Integer, default=-1)
+    last_timestamp = Column(Float, default=0)
+
+    # Tracker + identity state after last_frame_index (JSON stored as text)
+    state = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+
+
+class VideoJob(Base):
+    """Persistent video-processing job consumed by worker.py (leased, retried on failure)."""
+    __tablename__ = "video_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("class_sessions.id"), index=True)
+    # = session_id while queued/running, NULL once finished:
+    # the unique index guarantees at most one active job per session
+    active_session_id = Column(Integer, unique=True, nullable=True)
+    video_path = Column(String(1024))
+
+    # queued, running, done, failed
+    status = Column(String(20), default="queued", index=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    # Not picked up before this time (retry backoff)
+    available_at = Column(DateTime, default=datetime.utcnow)
+
+    # Worker currently holding the job and until when (renewed by heartbeat)
+    lease_owner = Column(String(255))
+    lease_expires_at = Column(DateTime)
+    last_error = Column(Text)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+
+
+class SessionProgress(Base):
+    """Live progress of a video job, updated with every committed log batch (read by the SSE stream)."""
+    __tablename__ = "session_progress"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey(
+        "class_sessions.id"), unique=True, index=True)
+
+    frames_processed = Column(Integer, default=0)  # Sampled frames written
+    current_frame = Column(Integer, default=0)
+    total_frames = Column(Integer, default=0)
+    percent = Column(Float, default=0)
+    eta_seconds = Column(Float)
+    last_timestamp = Column(Float, default=0)   # Video time reached (seconds)
+    # Highest committed SessionBehaviorLog.id -> clients fetch only id > what they have
+    last_log_id = Column(Integer, default=0)
+
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
@@ -1,70 +1,497 @@
 import os
 import json
+import time
+import base64
+import threading
+from contextlib import contextmanager
 import faiss
 import numpy as np
 from core.config import settings
+from core.lazy import LazyInstance
+from db.index_factory import (build_index, choose_kind, exclude_selector, export_vectors, index_ids,
+                              index_kind, read_index, search_params, supports_remove)
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
 
 
 class VectorDB:
+    """
+    FAISS gallery of face embeddings (one vector per student photo), shared by every
+    process (web workers, video workers) that opens the same files.
+
+    Persistence: a snapshot (index file + metadata JSON, both replaced atomically) plus an
+    append-only write-ahead log of the changes made since. Every add/remove appends one
+    JSON line instead of rewriting the whole index; the log is folded into a new snapshot
+    once it holds FAISS_WAL_COMPACT_RECORDS records (or on shutdown). A torn last line
+    (crash in the middle of an append) is cut off when the log is read; loading never
+    compacts by itself.
+
+    Serving: the snapshot index is opened memory-mapped and read-only (FAISS_MMAP_ENABLED),
+    so all processes share its pages through the page cache instead of each holding a
+    copy; it is never modified in place. Vectors added since the snapshot live in a small
+    in-memory flat "delta" index searched alongside it, removed snapshot vectors are hidden
+    with an IDSelector. Before searching, a process compares the metadata file and the log
+    size with what it has seen (two stat calls) and replays the records other processes
+    appended, or reopens the snapshot when another process wrote a new one. Writers
+    serialise through a lock file (`<index file>.lock`), so ids and generations are
+    allocated once across processes. A replaced snapshot stays valid for the processes
+    still mapping the old file until they reload.
+
+    Index kind: exact flat search for small galleries, HNSW or IVF-Flat above
+    FAISS_APPROX_THRESHOLD (see db/index_factory.py). Migrations run in a background
+    thread (in one process at a time) on a copy of the vectors while searches keep using
+    the current index; changes made meanwhile are journaled and applied to the new index
+    before it is written as the next snapshot. HNSW cannot remove vectors, so its
+    removals stay tombstones in the snapshot until the next rebuild.
+    """
+
     def __init__(self):
         self.dim = settings.EMBEDDING_DIM
         self.index_file = settings.FAISS_INDEX_FILE
         self.metadata_file = settings.METADATA_FILE
+        self.wal_file = settings.FAISS_WAL_FILE
+        self.lock_file = f"{self.index_file}.lock"
+        self._wal_records = 0
+        # Bytes of the log already applied, and (inode, mtime, size) of the metadata file
+        # of the snapshot in use: compared with the files to detect other writers
+        self._wal_offset = 0
+        self._snapshot_sig = None
+        self._last_sync = 0.0
+        self._lock = threading.RLock()
+        self._lock_fd = None
+        self._lock_depth = 0
+        # faiss ids removed from the snapshot index but still stored in it
+        self._tombstones = set()
+        self._exclude = None
+        self._rebuild_thread = None
+        self._rebuild_journal = None
+        self._rebuild_stale = False
 
-        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(self.dim))
+        # Snapshot index (read-only) + vectors added since the snapshot
+        self.index = self._empty_index()
+        self._delta = build_index("flat", self.dim)
+        self._delta_ids = set()
         # metadata structure (v2):
         # {
         #   "counts": {"<student_id>": int, ...},
         #   "by_student": {"<student_id>": [<faiss_id>, ...]},
-        #   "last_id": <int>
+        #   "last_id": <int>,
+        #   "generation": <int>,  # incremented on every change (WAL records carry it too)
+        #   "tombstones": [<faiss_id>, ...],  # removed but still in the index file
+        #   "ntotal": <int>  # vectors in the index file
         # }
         self.metadata = {}
+        # In-memory reverse map faiss_id -> student_id (derived from by_student)
+        self._owner = {}
+
+        self._ensure_parent_dirs()
+        with self._locked():
+            if os.path.exists(self.index_file) and os.path.exists(self.metadata_file):
+                print("Loading existing FAISS index...")
+                self._load()
+            else:
+                print("Creating new FAISS index...")
+                # initialize fresh metadata v2 structure
+                self.metadata = {'counts': {}, 'by_student': {},
+                                 'last_id': int(__import__('time').time() * 1000)}
+                self._build_owner_map()
+                self._commit_snapshot(self._empty_index(), set())
+        self._maybe_rebuild()
+
+    def _empty_index(self):
+        # IVF needs training data: an empty gallery starts flat and migrates later
+        kind = choose_kind(0)
+        return build_index("flat" if kind == "ivf" else kind, self.dim)
+
+    @property
+    def size(self) -> int:
+        """Searchable vectors (tombstoned entries excluded)."""
+        return int(self.index.ntotal) - len(self._tombstones) + int(self._delta.ntotal)
+
+    # ------------------------------------------------------------------ cross-process sync
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the in-process lock and the exclusive lock file shared with other processes.
+        Re-entrant within this process; a no-op across processes where flock is missing.
+        """
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                if self._lock_fd is None:
+                    self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _file_sig(path: str):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _wal_size(self) -> int:
+        try:
+            return os.path.getsize(self.wal_file)
+        except FileNotFoundError:
+            return 0
+
+    def _refresh(self):
+        """
+        Pick up changes made by other processes. Cheap when nothing changed (two stat
+        calls, at most every FAISS_SYNC_CHECK_SECONDS); takes the lock file otherwise.
+        """
+        now = time.monotonic()
+        if now - self._last_sync < settings.FAISS_SYNC_CHECK_SECONDS:
+            return
+        self._last_sync = now
+        if (self._file_sig(self.metadata_file) == self._snapshot_sig
+                and self._wal_size() == self._wal_offset):
+            return
+        with self._locked():
+            self._sync()
 
-        if os.path.exists(self.index_file) and os.path.exists(self.metadata_file):
-            print("Loading existing FAISS index...")
-            self.index = faiss.read_index(self.index_file)
-            with open(self.metadata_file, 'r', encoding='utf-8') as f:
+    def _sync(self):
+        """Bring this process up to date with the files (lock held)."""
+        if (self._file_sig(self.metadata_file) != self._snapshot_sig
+                or self._wal_size() < self._wal_offset):
+            # Another process wrote a new snapshot (and truncated the log)
+            if self._rebuild_journal is not None:
+                self._rebuild_stale = True
+            self._load()
+        else:
+            self._tail_wal()
+
+    def _load(self):
+        """(Re)open the snapshot and replay the log on top of it (lock held)."""
+        with open(self.metadata_file, 'r', encoding='utf-8') as f:
+            try:
+                metadata = json.load(f)
+            except Exception:
+                metadata = {}
+        # Migrate legacy metadata (v1 -> v2)
+        if not isinstance(metadata, dict):
+            metadata = {}
+        if 'counts' not in metadata or 'by_student' not in metadata:
+            counts = {}
+            for k, v in metadata.items():
                 try:
-                    self.metadata = json.load(f)
+                    # keep only student-id integer keys
+                    int(k)
+                    counts[k] = int(v)
                 except Exception:
-                    self.metadata = {}
-            # Migrate legacy metadata (v1 -> v2)
-            if not isinstance(self.metadata, dict):
-                self.metadata = {}
-            if 'counts' not in self.metadata or 'by_student' not in self.metadata:
-                legacy = self.metadata if isinstance(
-                    self.metadata, dict) else {}
-                counts = {}
-                for k, v in legacy.items():
-                    try:
-                        # keep only student-id integer keys
-                        int(k)
-                        counts[k] = int(v)
-                    except Exception:
-                        continue
-                self.metadata = {
-                    'counts': counts,
-                    'by_student': {},
-                    'last_id': int(__import__('time').time() * 1000)
-                }
-                self._save()
-        else:
-            print("Creating new FAISS index...")
-            self._ensure_parent_dirs()
-            # initialize fresh metadata v2 structure
-            self.metadata = {'counts': {}, 'by_student': {},
-                             'last_id': int(__import__('time').time() * 1000)}
-            self._save()
+                    continue
+            self.metadata = {
+                'counts': counts,
+                'by_student': {},
+                'last_id': int(__import__('time').time() * 1000)
+            }
+            self._build_owner_map()
+            self._commit_snapshot(read_index(self.index_file), set())
+            return
+        self.metadata = metadata
+        self._build_owner_map()
+        self._open_snapshot(None, self.metadata.get('tombstones') or [])
+        # A crash between the index and metadata renames leaves a newer index file than
+        # the metadata describes: skip logged adds it already holds
+        present = None
+        if self.metadata.get('ntotal') != self.index.ntotal:
+            present = index_ids(self.index)
+        replayed = self._tail_wal(present)
+        if replayed:
+            print(f"Replayed {replayed} FAISS log records.")
+
+    def _open_snapshot(self, index, tombstones):
+        """
+        Serve the snapshot just written or read: the index file memory-mapped (or `index`
+        itself when mapping is disabled), an empty delta and the log from its start.
+        """
+        if index is None or settings.FAISS_MMAP_ENABLED:
+            index = read_index(self.index_file, mmap=settings.FAISS_MMAP_ENABLED)
+        self.index = index
+        self._delta = build_index("flat", self.dim)
+        self._delta_ids = set()
+        self._set_tombstones(tombstones)
+        self._snapshot_sig = self._file_sig(self.metadata_file)
+        self._wal_offset = 0
+        self._wal_records = 0
+
+    def _tail_wal(self, present=None) -> int:
+        """
+        Apply the log records appended after _wal_offset (lock held). Records already
+        applied (generation not newer than ours) are skipped, so replay is idempotent.
+        """
+        if not os.path.exists(self.wal_file):
+            return 0
+        with open(self.wal_file, 'rb') as f:
+            f.seek(self._wal_offset)
+            data = f.read()
+        replayed = 0
+        offset = self._wal_offset
+        for line in data.split(b"\n")[:-1]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            offset += len(line) + 1
+            self._wal_records += 1
+            if int(record.get('gen', 0)) <= self._applied_generation():
+                continue
+            self._apply_record(record, present)
+            replayed += 1
+        if offset < self._wal_offset + len(data):
+            # Writers append under the lock we hold: this is the tail of a crashed append.
+            # Everything before it is intact; never append after a torn line.
+            print("[WARN] Dropping a torn FAISS log record.")
+            os.truncate(self.wal_file, offset)
+        self._wal_offset = offset
+        return replayed
+
+    def _apply_record(self, record: dict, present=None):
+        op = record.get('op')
+        if op == 'add':
+            fid = int(record['id'])
+            vec = np.frombuffer(base64.b64decode(record['vec']), dtype='float32')
+            self._apply_add(fid, int(record['student']), vec.reshape(1, -1),
+                            in_index=present is not None and fid in present)
+        elif op == 'remove':
+            self._apply_remove(int(record['id']), record.get('student'))
+        elif op == 'delete_student':
+            self._apply_delete_student(int(record['student']), record.get('ids') or [])
+        self.metadata['generation'] = int(record['gen'])
+
+    # ------------------------------------------------------------------ index maintenance
+
+    def _set_tombstones(self, ids):
+        self._tombstones = set(int(i) for i in ids)
+        # Replaced, never modified: a search keeps using the selector it picked up
+        self._exclude = exclude_selector(self._tombstones)
+
+    def _in_snapshot(self, faiss_id: int) -> bool:
+        if faiss_id in self._owner:
+            return True
+        # legacy vectors (id == student_id) are not in the reverse map
+        return faiss_id in index_ids(self.index)
+
+    def _remove_ids(self, ids) -> int:
+        """Remove ids from the delta, or hide them in the snapshot index. Returns removed count."""
+        removed, hidden = [], []
+        for i in (int(i) for i in ids):
+            if i in self._delta_ids:
+                self._delta.remove_ids(np.array([i], dtype=np.int64))
+                self._delta_ids.discard(i)
+                removed.append(i)
+            elif i not in self._tombstones and self._in_snapshot(i):
+                removed.append(i)
+                hidden.append(i)
+        if hidden:
+            self._set_tombstones(self._tombstones | set(hidden))
+        if removed and self._rebuild_journal is not None:
+            self._rebuild_journal.append(('remove', removed))
+        return len(removed)
+
+    def _maybe_rebuild(self):
+        """Start a background migration when the gallery outgrew (or shrank below) its index kind."""
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        current = index_kind(self.index)
+        target = choose_kind(self.size, current)
+        if target == "ivf" and self.size == 0:
+            target = current
+        tombstone_ratio = len(self._tombstones) / max(1, self.index.ntotal)
+        if target != current or (not supports_remove(self.index) and
+                                 tombstone_ratio >= settings.FAISS_TOMBSTONE_REBUILD_RATIO):
+            self.rebuild_index(target)
+
+    def _live_vectors(self):
+        """(vectors, ids) of every searchable vector: snapshot minus tombstones, plus delta."""
+        vectors, ids = export_vectors(self.index)
+        if self._tombstones:
+            keep = ~np.isin(ids, np.array(sorted(self._tombstones), dtype=np.int64))
+            vectors, ids = vectors[keep], ids[keep]
+        delta_vectors, delta_ids = export_vectors(self._delta)
+        return np.concatenate([vectors, delta_vectors]), np.concatenate([ids, delta_ids])
+
+    def rebuild_index(self, kind: str | None = None, background: bool = True) -> bool:
+        """
+        Rebuild the index as `kind` (None = choose_kind for the current size) from the live
+        vectors, dropping tombstones. Returns False if a rebuild is already running here or
+        in another process.
+        """
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return False
+            rebuild_fd = self._try_rebuild_lock()
+            if rebuild_fd is None:
+                return False
+            vectors, ids = self._live_vectors()
+            kind = kind or choose_kind(len(ids))
+            if kind == "ivf" and len(ids) == 0:
+                kind = "flat"
+            self._rebuild_journal = []
+            self._rebuild_stale = False
+            self._rebuild_thread = threading.Thread(
+                target=self._rebuild, args=(kind, vectors, ids, rebuild_fd),
+                name="faiss-rebuild", daemon=True)
+            self._rebuild_thread.start()
+        if not background:
+            self._rebuild_thread.join()
+        return True
+
+    def _try_rebuild_lock(self):
+        """Open and lock `<index file>.rebuild.lock` without waiting; None if another process holds it."""
+        fd = os.open(f"{self.index_file}.rebuild.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return None
+        return fd
+
+    def _rebuild(self, kind: str, vectors: np.ndarray, ids: np.ndarray, rebuild_fd: int):
+        try:
+            print(f"Building {kind} FAISS index for {len(ids)} vectors...")
+            # The slow part runs without the lock: searches and enrollments continue
+            new_index = build_index(kind, self.dim, vectors, ids)
+            with self._locked():
+                self._sync()
+                if self._rebuild_stale:
+                    # Another process wrote a snapshot meanwhile: the copy is outdated
+                    print(f"FAISS index rebuild ({kind}) superseded by another process.")
+                    return
+                tombstones = set()
+                for op, payload in self._rebuild_journal:
+                    if op == 'add':
+                        vec, fid = payload
+                        new_index.add_with_ids(vec, np.array([fid], dtype=np.int64))
+                    elif supports_remove(new_index):
+                        new_index.remove_ids(np.array(payload, dtype=np.int64))
+                    else:
+                        tombstones.update(payload)
+                # Persist the new index so the next start does not rebuild it again
+                self._commit_snapshot(new_index, tombstones)
+            print(f"FAISS index is now {kind} ({new_index.ntotal} vectors).")
+        except Exception as e:
+            print(f"[WARN] FAISS index rebuild ({kind}) failed: {e}")
+        finally:
+            with self._lock:
+                self._rebuild_journal = None
+            os.close(rebuild_fd)
+
+    def _build_owner_map(self):
+        owner = {}
+        for sid, id_list in (self.metadata.get('by_student') or {}).items():
+            if not isinstance(id_list, list):
+                continue
+            try:
+                student_id = int(sid)
+            except (TypeError, ValueError):
+                continue
+            for fid in id_list:
+                owner[int(fid)] = student_id
+        self._owner = owner
+
+    def student_for_faiss_id(self, faiss_id: int) -> int | None:
+        """Owning student of a per-photo FAISS id (O(1)), None if unknown."""
+        return self._owner.get(int(faiss_id))
 
     def _ensure_parent_dirs(self):
         os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
         os.makedirs(os.path.dirname(self.metadata_file), exist_ok=True)
 
-    def _save(self):
+    def _applied_generation(self) -> int:
+        return int(self.metadata.get('generation', 0) or 0)
+
+    @property
+    def generation(self) -> int:
+        """
+        Bumped (and persisted) on every change of the gallery, by any process; used to
+        invalidate caches, so it includes the changes other processes logged.
+        """
+        self._refresh()
+        return self._applied_generation()
+
+    def _commit_snapshot(self, index, tombstones):
+        """
+        Write `index` (fully loaded, it already includes every change) + metadata as the new
+        snapshot, truncate the log and serve the new files (lock held).
+        Temp files are renamed into place (atomic per file).
+        """
         self._ensure_parent_dirs()
-        faiss.write_index(self.index, self.index_file)
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
+        self.metadata['tombstones'] = sorted(tombstones)
+        self.metadata['ntotal'] = int(index.ntotal)
+        tmp_index = f"{self.index_file}.{os.getpid()}.tmp"
+        faiss.write_index(index, tmp_index)
+        with open(tmp_index, 'rb') as f:
+            os.fsync(f.fileno())
+        tmp_meta = f"{self.metadata_file}.{os.getpid()}.tmp"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
             json.dump(self.metadata, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # A crash between the two renames leaves a newer index with older metadata:
+        # WAL replay skips what the index already holds, so the next load still converges.
+        # Processes mapping the old index file keep a valid (unlinked) mapping until they
+        # notice the new metadata file and reload.
+        os.replace(tmp_index, self.index_file)
+        os.replace(tmp_meta, self.metadata_file)
+        with open(self.wal_file, 'w', encoding='utf-8'):
+            pass
+        self._open_snapshot(index, tombstones)
+
+    def compact(self, force: bool = False):
+        """Fold the write-ahead log into a fresh snapshot and truncate it."""
+        with self._locked():
+            self._sync()
+            if not force and self._wal_records == 0 and os.path.exists(self.index_file):
+                return
+            folded = self._wal_records
+            # Writable copy of the snapshot; the served one is read-only
+            index = read_index(self.index_file)
+            tombstones = set(self._tombstones)
+            if tombstones and supports_remove(index):
+                index.remove_ids(np.array(sorted(tombstones), dtype=np.int64))
+                tombstones = set()
+            elif tombstones:
+                # ids the file does not hold (after a crash during a snapshot) are no tombstones
+                tombstones &= index_ids(index)
+            vectors, ids = export_vectors(self._delta)
+            if len(ids):
+                index.add_with_ids(vectors, ids)
+            self._commit_snapshot(index, tombstones)
+            print(f"FAISS snapshot written ({index.ntotal} vectors, "
+                  f"{folded} log records folded).")
+
+    def _log(self, record: dict):
+        """Append one change to the write-ahead log (O(change), not O(index)); lock held."""
+        self.metadata['generation'] = self._applied_generation() + 1
+        record['gen'] = self._applied_generation()
+        line = (json.dumps(record) + "\n").encode('utf-8')
+        # One write() on an O_APPEND descriptor: readers never see a partial record
+        # from a live writer, only from a crashed one
+        fd = os.open(self.wal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            if settings.FAISS_WAL_FSYNC:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._wal_offset += len(line)
+        self._wal_records += 1
+        if self._wal_records >= settings.FAISS_WAL_COMPACT_RECORDS:
+            self.compact()
+        self._maybe_rebuild()
 
     def _next_faiss_id(self) -> int:
         # monotonically increasing unique int64 id
@@ -73,13 +500,15 @@ class VectorDB:
         self.metadata['last_id'] = new_id
         return int(new_id)
 
-    def add_embedding(self, student_id: int, vector: np.ndarray) -> int:
-        """Add embedding and return the FAISS vector id used."""
-        vec = vector.astype('float32')
-        faiss.normalize_L2(vec)
-        faiss_id_int = self._next_faiss_id()
-        faiss_id = np.array([faiss_id_int], dtype=np.int64)
-        self.index.add_with_ids(vec, faiss_id)
+    def _apply_add(self, faiss_id: int, student_id: int, vec: np.ndarray, in_index: bool = False):
+        if not in_index:
+            self._delta.add_with_ids(vec, np.array([faiss_id], dtype=np.int64))
+            self._delta_ids.add(faiss_id)
+            if self._rebuild_journal is not None:
+                self._rebuild_journal.append(('add', (vec, faiss_id)))
+        self.metadata['last_id'] = max(int(self.metadata.get('last_id', 0) or 0), faiss_id)
+        if faiss_id in self._owner:
+            return
         sid = str(student_id)
         # update counts
         counts = self.metadata.setdefault('counts', {})
@@ -87,80 +516,130 @@ class VectorDB:
         # map faiss ids per student
         by_stu = self.metadata.setdefault('by_student', {})
         ids_list = by_stu.get(sid, [])
-        ids_list.append(faiss_id_int)
+        ids_list.append(faiss_id)
         by_stu[sid] = ids_list
-        self._save()
+        self._owner[faiss_id] = int(student_id)
+
+    def add_embedding(self, student_id: int, vector: np.ndarray) -> int:
+        """Add embedding and return the FAISS vector id used."""
+        vec = np.array(vector, dtype='float32', copy=True).reshape(1, -1)
+        faiss.normalize_L2(vec)
+        with self._locked():
+            # Other processes may have allocated ids since our last look at the log
+            self._sync()
+            faiss_id_int = self._next_faiss_id()
+            self._apply_add(faiss_id_int, student_id, vec)
+            self._log({'op': 'add', 'id': faiss_id_int, 'student': int(student_id),
+                       'vec': base64.b64encode(vec.tobytes()).decode('ascii')})
         print(
-            f"Added embedding for student {student_id} (faiss_id={faiss_id_int}). Total vectors: {self.index.ntotal}")
+            f"Added embedding for student {student_id} (faiss_id={faiss_id_int}). Total vectors: {self.size}")
         return faiss_id_int
 
+    def search_many(self, matrix: np.ndarray, k: int = 1):
+        """
+        Search many embeddings with one FAISS call.
+        matrix: (N, dim) float array (a single (dim,) vector is accepted too); it is not modified.
+        Returns (student_ids, similarities), one entry per row. With k == 1 each entry is a
+        scalar, with k > 1 a best-first list of k. A student id is None where the similarity
+        is below FAISS_THRESHOLD_COSINE or there is no neighbour.
+        """
+        vecs = np.array(matrix, dtype='float32', copy=True).reshape(-1, self.dim)
+        n = vecs.shape[0]
+        self._refresh()
+        if self.size == 0 or n == 0:
+            student_ids = [[None] * k for _ in range(n)]
+            sims = [[0.0] * k for _ in range(n)]
+        else:
+            faiss.normalize_L2(vecs)
+            with self._lock:
+                # The snapshot index is never modified (only replaced): search it unlocked
+                index, selector = self.index, self._exclude
+                if self._delta.ntotal:
+                    delta_result = self._delta.search(vecs, k)
+                else:
+                    delta_result = None
+            # Fresh params per call: FAISS writes to them during the search
+            distances, faiss_ids = index.search(vecs, k, params=search_params(index, selector))
+            if delta_result is not None:
+                distances, faiss_ids = self._merge_results(
+                    (distances, faiss_ids), delta_result, k)
+            found = faiss_ids >= 0
+            accepted = found & (distances >= settings.FAISS_THRESHOLD_COSINE)
+            # -1 (fewer than k vectors) reports similarity 0 like an empty index
+            sims = np.where(found, distances, 0.0).astype(float).tolist()
+            # v2 ids (per-photo id) resolve to the student through the reverse map;
+            # legacy vectors were added with id == student_id
+            owner = self._owner
+            student_ids = [[owner.get(fid, fid) if ok else None
+                            for fid, ok in zip(row_ids, row_ok)]
+                           for row_ids, row_ok in zip(faiss_ids.tolist(), accepted.tolist())]
+        if k == 1:
+            return [row[0] for row in student_ids], [row[0] for row in sims]
+        return student_ids, sims
+
+    @staticmethod
+    def _merge_results(first, second, k: int):
+        """Best k of two (distances, ids) search results, per row."""
+        distances = np.concatenate([first[0], second[0]], axis=1)
+        faiss_ids = np.concatenate([first[1], second[1]], axis=1)
+        distances = np.where(faiss_ids >= 0, distances, -np.inf)
+        order = np.argsort(-distances, axis=1, kind='stable')[:, :k]
+        return (np.take_along_axis(distances, order, axis=1),
+                np.take_along_axis(faiss_ids, order, axis=1))
+
     def search_embedding(self, vector: np.ndarray, k: int = 1):
-        if self.index.ntotal == 0:
-            return None, 0.0
-        vec = vector.astype('float32')
-        faiss.normalize_L2(vec)
-        distances, faiss_ids = self.index.search(vec, k)
-        if faiss_ids.size == 0:
-            return None, 0.0
-        student_id = int(faiss_ids[0][0])
-        similarity = float(distances[0][0])
-        if similarity < settings.FAISS_THRESHOLD_COSINE:
-            return None, similarity
-        # If we are on v2 ids (per-photo id), need to resolve to student via metadata
-        by_stu = self.metadata.get('by_student') or {}
-        if by_stu:
-            # reverse lookup: find student whose list contains the faiss id
-            fid = int(faiss_ids[0][0])
-            for sid, id_list in by_stu.items():
-                if isinstance(id_list, list) and fid in id_list:
-                    try:
-                        return int(sid), similarity
-                    except Exception:
-                        break
-            # fallback to treat id as student_id if not found
-        return student_id, similarity
+        """Best match of one embedding: (student_id or None, similarity)."""
+        student_ids, similarities = self.search_many(vector, k=1)
+        return student_ids[0], similarities[0]
 
     def get_embedding_count(self, student_id: int) -> int:
+        self._refresh()
         sid = str(student_id)
         counts = self.metadata.get('counts', {})
         return int(counts.get(sid, 0) or 0)
 
-    def delete_embeddings_for_student(self, student_id: int) -> int:
+    def _apply_delete_student(self, student_id: int, ids: list) -> int:
         sid = str(student_id)
-        removed_total = 0
-        by_stu = self.metadata.get('by_student', {})
-        ids = by_stu.get(sid, [])
         try:
             if ids:
-                arr = np.array(ids, dtype=np.int64)
-                removed_total = int(self.index.remove_ids(arr))
+                removed_total = self._remove_ids(ids)
             else:
                 # legacy fallback: vectors were added with id == student_id
-                removed_total = int(self.index.remove_ids(
-                    np.array([student_id], dtype=np.int64)))
+                removed_total = self._remove_ids([student_id])
         except Exception:
             removed_total = 0
 
         # reset metadata for student
+        for fid in ids:
+            self._owner.pop(int(fid), None)
+        by_stu = self.metadata.get('by_student', {})
         counts = self.metadata.setdefault('counts', {})
         counts[sid] = 0
         if sid in by_stu:
             by_stu[sid] = []
-        self._save()
         return removed_total
 
-    def remove_by_faiss_id(self, faiss_id: int, student_id: int | None = None) -> int:
-        """Remove a single vector by its FAISS id. Optionally update metadata with student_id.
-        Returns number of removed vectors (0 or 1)."""
+    def delete_embeddings_for_student(self, student_id: int) -> int:
+        with self._locked():
+            self._sync()
+            ids = list(self.metadata.get('by_student', {}).get(str(student_id), []))
+            removed_total = self._apply_delete_student(student_id, ids)
+            self._log({'op': 'delete_student', 'student': int(student_id), 'ids': ids})
+        return removed_total
+
+    def _apply_remove(self, faiss_id: int, student_id: int | None = None) -> int:
         try:
-            removed = int(self.index.remove_ids(
-                np.array([int(faiss_id)], dtype=np.int64)))
+            removed = self._remove_ids([faiss_id])
         except Exception:
             removed = 0
-        if removed > 0:
+        owner = self._owner.pop(int(faiss_id), None)
+        # Replay may find the vector already gone from a newer index file: still fix metadata
+        if removed > 0 or owner is not None:
             # update metadata bookkeeping
             by_stu = self.metadata.setdefault('by_student', {})
             counts = self.metadata.setdefault('counts', {})
+            if student_id is None:
+                student_id = owner
             if student_id is not None:
                 sid = str(student_id)
                 if sid in by_stu and isinstance(by_stu[sid], list):
@@ -169,18 +648,19 @@ class VectorDB:
                     except ValueError:
                         pass
                 counts[sid] = max(0, int(counts.get(sid, 0) or 0) - 1)
-            else:
-                # best-effort reverse lookup
-                for sid, id_list in by_stu.items():
-                    if isinstance(id_list, list) and int(faiss_id) in id_list:
-                        try:
-                            id_list.remove(int(faiss_id))
-                        except ValueError:
-                            pass
-                        counts[sid] = max(0, int(counts.get(sid, 0) or 0) - 1)
-                        break
-            self._save()
         return removed
 
+    def remove_by_faiss_id(self, faiss_id: int, student_id: int | None = None) -> int:
+        """Remove a single vector by its FAISS id. Optionally update metadata with student_id.
+        Returns number of removed vectors (0 or 1)."""
+        with self._locked():
+            self._sync()
+            owner = self._owner.get(int(faiss_id))
+            removed = self._apply_remove(faiss_id, student_id)
+            if removed > 0 or owner is not None:
+                self._log({'op': 'remove', 'id': int(faiss_id),
+                           'student': int(student_id) if student_id is not None else owner})
+        return removed
 
-vector_db_instance = VectorDB()
+# The index is read from disk on first use (or by the startup warm-up), not at import
+vector_db_instance = LazyInstance(VectorDB, "FAISS index")
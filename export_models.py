@@ -0,0 +1,53 @@
+import argparse
+from pathlib import Path
+from core import model_export
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export YOLO and emotion models to ONNX (used by AIEngine on CPU)")
+    parser.add_argument("--models-dir", default=str(Path(__file__).resolve().parent / "models"))
+    parser.add_argument("--only", choices=["yolo", "emotion"], default=None)
+    parser.add_argument("--imgsz", type=int, default=640, help="YOLO export image size")
+    parser.add_argument("--int8", action="store_true",
+                        help="Also write int8 dynamically quantized *.int8.onnx files")
+    parser.add_argument("--video", default="assets/input_test.mp4",
+                        help="Video whose frames are used for the parity check")
+    parser.add_argument("--skip-verify", action="store_true",
+                        help="Export only; AIEngine ignores artifacts without a passing parity check")
+    args = parser.parse_args()
+
+    models_dir = Path(args.models_dir)
+    frames = [] if args.skip_verify else model_export.sample_frames(args.video)
+    if not args.skip_verify and not frames:
+        raise SystemExit(f"No frames read from {args.video}: cannot verify the exported models")
+    ok = True
+
+    def check(path: str, passed: bool | None) -> bool:
+        if passed is None:
+            print(f"  {path} not verified: AIEngine will not load it")
+            return True
+        if passed:
+            model_export.mark_verified(path)
+        else:
+            # Never leave a mismatching artifact where AIEngine would pick it up
+            model_export.discard(path)
+            print(f"  Deleted {path}")
+        return passed
+
+    if args.only in (None, "yolo"):
+        pt_path = str(models_dir / "yolov8_best.pt")
+        for path in model_export.export_yolo(pt_path, imgsz=args.imgsz, int8=args.int8):
+            print(f"Wrote {path}")
+            passed = model_export.verify_yolo(pt_path, path, frames, imgsz=args.imgsz) if frames else None
+            ok &= check(path, passed)
+
+    if args.only in (None, "emotion"):
+        ckpt_path = str(models_dir / "best_resnet18_sgd.ckpt")
+        onnx_path = str(models_dir / "best_resnet18_sgd.onnx")
+        for path in model_export.export_emotion(ckpt_path, onnx_path, int8=args.int8):
+            print(f"Wrote {path}")
+            passed = model_export.verify_emotion(ckpt_path, path, frames) if frames else None
+            ok &= check(path, passed)
+
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,25 @@
+import argparse
+from core.database import engine, Base
+from db import models  # noqa: F401 - đăng ký các bảng cho create_all
+from core.manager import session_manager
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live camera analysis for a class session")
+    parser.add_argument("--session-id", type=int, required=True)
+    parser.add_argument("--source", required=True,
+                        help="Stream URL (rtsp://, http://), camera index (0) or a video file")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Replay a local video file at its native speed")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Stop after N seconds")
+    args = parser.parse_args()
+
+    try:
+        Base.metadata.create_all(bind=engine)
+    except Exception as e:
+        print(f"Error creating database tables: {e}")
+
+    ok = session_manager.process_live_stream(
+        args.session_id, args.source, realtime=args.realtime, max_duration=args.duration)
+    raise SystemExit(0 if ok else 1)
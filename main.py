@@ -1,7 +1,6 @@
 from fastapi import FastAPI
 import os
 from pathlib import Path
-from core.database import engine, Base
 from core.config import settings
 from fastapi.staticfiles import StaticFiles
 from core.middleware import apply_middlewares
@@ -16,16 +15,27 @@ from app.test_view import test_view_router
 from app.report_api import router as report_api_router
 from app.report_view import report_view_router
 from app.dashboard_api import router as dashboard_api_router
-try:
-    Base.metadata.create_all(bind=engine)
-    print("Database tables created successfully (if not exist).")
-except Exception as e:
-    print(f"Error creating database tables: {e}")
-    print("Please ensure MySQL server is running and database is created.")
+from app.health_api import router as health_router
+from core.warmup import warmup
+from db.vector_db import vector_db_instance
 
 app = FastAPI(title="Student Behavior AI Web",
               docs_url="/docs", redoc_url="/redoc")
 
+
+# Tables, models and the FAISS index are prepared in the background (see /readyz)
+@app.on_event("startup")
+def start_warmup():
+    warmup.start()
+
+
+@app.on_event("shutdown")
+def stop_warmup():
+    warmup.stop()
+    # Fold the FAISS change log into a snapshot so the next start has nothing to replay
+    if vector_db_instance.loaded:
+        vector_db_instance.compact()
+
 # Middlewares (CORS, Request ID)
 apply_middlewares(app, settings)
 
@@ -56,6 +66,7 @@ app.include_router(report_api_router, prefix="/api/reports", tags=["Reports"])
 app.include_router(report_view_router)
 app.include_router(dashboard_api_router,
                    prefix="/api/dashboard", tags=["Dashboard"])
+app.include_router(health_router, tags=["Health"])
 
 # add / redirect to /dashboard
 
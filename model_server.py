@@ -0,0 +1,13 @@
+import argparse
+from core.config import settings
+from core.model_server import ModelServer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Shared inference server: loads the models once for all web workers")
+    parser.add_argument("--socket", default=settings.MODEL_SERVER_SOCKET or "/tmp/behavior_models.sock",
+                        help="Unix socket path (clients use MODEL_SERVER_SOCKET)")
+    args = parser.parse_args()
+
+    ModelServer(args.socket).serve_forever()
@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+# Tests run against a throw-away SQLite file, never the configured MySQL database
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def _tables():
+    from core.database import Base, engine
+    from db import models  # noqa: F401 - register the tables
+
+    Base.metadata.create_all(bind=engine)
+    return Base.metadata
+
+
+@pytest.fixture
+def db(_tables):
+    from core.database import SessionLocal, engine
+
+    with engine.begin() as conn:
+        for table in reversed(_tables.sorted_tables):
+            conn.execute(table.delete())
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
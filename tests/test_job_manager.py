@@ -0,0 +1,97 @@
+import threading
+from datetime import datetime, timedelta
+from core.config import settings
+from core.manager import job_manager, session_manager
+from db import models
+
+
+def _queued_job(db, session_id=1):
+    db.add(models.ClassSession(id=session_id, status="queued"))
+    job = job_manager.enqueue_video_job(db, session_id, "video.mp4")
+    db.commit()
+    return job
+
+
+def _expire_lease(db, job):
+    job.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+
+
+def test_a_job_is_claimed_by_one_worker_only(db):
+    job = _queued_job(db)
+    claimed = job_manager.claim_next_job(db, "w1")
+    assert claimed.id == job.id and claimed.lease_owner == "w1" and claimed.attempts == 1
+    assert job_manager.claim_next_job(db, "w2") is None
+
+
+def test_expired_lease_is_taken_over_and_the_old_owner_cannot_finish(db):
+    job = _queued_job(db)
+    job_manager.claim_next_job(db, "w1")
+    _expire_lease(db, job)
+    assert job_manager.claim_next_job(db, "w2").lease_owner == "w2"
+
+    assert not job_manager.renew_lease(db, job.id, "w1")
+    assert not job_manager.finish_job(db, job, "w1", True)
+    db.refresh(job)
+    assert job.status == "running" and job.lease_owner == "w2"
+
+    assert job_manager.finish_job(db, job, "w2", True)
+    db.refresh(job)
+    assert job.status == "done" and job.lease_owner is None and job.active_session_id is None
+
+
+def test_failed_attempts_are_retried_then_marked_failed(db, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(settings, "JOB_RETRY_BACKOFF_SECONDS", 0)
+    job = _queued_job(db)
+
+    job_manager.claim_next_job(db, "w1")
+    assert job_manager.finish_job(db, job, "w1", False, "boom")
+    assert job.status == "queued" and job.last_error == "boom"
+    assert db.get(models.ClassSession, 1).status == "queued"
+
+    job_manager.claim_next_job(db, "w1")
+    assert job_manager.finish_job(db, job, "w1", False, "boom again")
+    assert job.status == "failed" and job.active_session_id is None
+    assert db.get(models.ClassSession, 1).status == "failed"
+    assert job_manager.claim_next_job(db, "w1") is None
+
+
+def test_worker_losing_its_lease_cancels_the_job_and_leaves_it_alone(db, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_LEASE_SECONDS", 1)
+    job = _queued_job(db)
+    job_manager.claim_next_job(db, "w1")
+    cancelled = threading.Event()
+
+    def process_video_ai(session_id, video_path, cancel=None):
+        # Another worker takes the job over while this one is still processing
+        other = job_manager.SessionLocal()
+        other.query(models.VideoJob).update({models.VideoJob.lease_owner: "w2"})
+        other.commit()
+        other.close()
+        if cancel.wait(10):
+            cancelled.set()
+        return False
+
+    monkeypatch.setattr(session_manager, "process_video_ai", process_video_ai)
+    job_manager.run_job(db, job, "w1")
+    assert cancelled.is_set()
+    db.refresh(job)
+    assert job.status == "running" and job.lease_owner == "w2" and job.attempts == 1
+
+
+def test_event_stream_only_ends_on_a_failure_without_retries(db, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(settings, "JOB_RETRY_BACKOFF_SECONDS", 0)
+    job = _queued_job(db)
+    for attempt in (1, 2):
+        job = job_manager.claim_next_job(db, "w1")
+        # process_video_ai marks the session failed before the worker finishes the job
+        db.get(models.ClassSession, job.session_id).status = "failed"
+        db.commit()
+        progress, _ = session_manager.poll_session_events(job.session_id)
+        assert progress["status"] == "queued" and not progress["terminal"]
+        job_manager.finish_job(db, job, "w1", False, "boom")
+
+    progress, _ = session_manager.poll_session_events(job.session_id)
+    assert progress["status"] == "failed" and progress["terminal"]
@@ -0,0 +1,24 @@
+from core.ai_loader import onnx_artifact
+from core import model_export
+
+
+def test_only_artifacts_with_a_passing_parity_check_are_loaded(tmp_path):
+    path = tmp_path / "yolov8_best.onnx"
+    path.write_bytes(b"exported model")
+    assert onnx_artifact(tmp_path, "yolov8_best") is None
+
+    model_export.mark_verified(str(path))
+    assert onnx_artifact(tmp_path, "yolov8_best") == str(path)
+
+    # Re-exported without a new check: the old marker no longer matches
+    path.write_bytes(b"re-exported model")
+    assert onnx_artifact(tmp_path, "yolov8_best") is None
+
+
+def test_discard_removes_the_artifact_and_its_marker(tmp_path):
+    path = tmp_path / "best_resnet18_sgd.int8.onnx"
+    path.write_bytes(b"quantized model")
+    model_export.mark_verified(str(path))
+    model_export.discard(str(path))
+    assert not path.exists()
+    assert not (tmp_path / "best_resnet18_sgd.int8.onnx.verified").exists()
@@ -0,0 +1,64 @@
+import time
+import pytest
+from core.pipeline import Pipeline, PipelineError, Stage
+
+
+def _double(x):
+    return x * 2
+
+
+def _double_batch(items):
+    # Uneven work so sibling workers finish out of order
+    time.sleep(0.001 * (items[0] % 3))
+    return [x * 2 for x in items]
+
+
+def _with_large_payload(items):
+    # Large results keep the mp.Queue feeder thread busy, so a sibling's end-of-stream
+    # marker can overtake them
+    return [(x, b"x" * 200_000) for x in items]
+
+
+def _plus_one(x):
+    return x + 1
+
+
+def _fail_on_seven(x):
+    if x == 7:
+        raise ValueError("bad frame")
+    return x
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_multi_worker_stage_keeps_every_item_in_order(mode):
+    for _ in range(10):
+        stages = [Stage("double", _double_batch, workers=2, mode=mode, batch_size=8)]
+        assert list(Pipeline(range(20), stages, queue_size=8).run()) == [x * 2 for x in range(20)]
+
+
+def test_end_of_stream_does_not_overtake_sibling_results():
+    for _ in range(10):
+        stages = [Stage("large", _with_large_payload, workers=2, mode="process", batch_size=8)]
+        result = [x for x, _ in Pipeline(range(20), stages, queue_size=8).run()]
+        assert result == list(range(20))
+
+
+def test_chained_multi_worker_stages():
+    stages = [
+        Stage("double", _double, workers=3, mode="process"),
+        Stage("plus", _plus_one, workers=2, mode="thread"),
+        Stage("batch", _double_batch, workers=2, mode="process", batch_size=4),
+    ]
+    result = list(Pipeline(range(50), stages, queue_size=4).run())
+    assert result == [(x * 2 + 1) * 2 for x in range(50)]
+
+
+def test_empty_source():
+    stages = [Stage("double", _double, workers=2, mode="process")]
+    assert list(Pipeline([], stages).run()) == []
+
+
+def test_stage_failure_is_raised_to_the_consumer():
+    stages = [Stage("check", _fail_on_seven, workers=2)]
+    with pytest.raises(PipelineError, match="check"):
+        list(Pipeline(range(20), stages).run())
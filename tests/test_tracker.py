@@ -0,0 +1,46 @@
+from core.tracker import IoUTracker
+
+
+def test_track_ids_follow_moving_boxes():
+    tracker = IoUTracker(iou_threshold=0.3, max_age=1)
+    first = tracker.update([[0, 0, 10, 10], [50, 50, 60, 60]])
+    second = tracker.update([[51, 51, 61, 61], [1, 1, 11, 11]])
+    assert second == [first[1], first[0]]
+
+    # Unseen for more than max_age updates -> dropped, reappearing box gets a new id
+    tracker.update([])
+    tracker.update([])
+    assert tracker.update([[0, 0, 10, 10]]) != [first[0]]
+
+
+def test_identity_is_majority_vote():
+    tracker = IoUTracker(votes=3)
+    [track_id] = tracker.update([[0, 0, 10, 10]])
+    for identity in ('A', None, 'A'):
+        assert tracker.needs_identity(track_id)
+        tracker.add_vote(track_id, identity)
+    assert not tracker.needs_identity(track_id)
+    assert tracker.identity(track_id) == 'A'
+
+
+def test_smooth_filters_label_flicker():
+    tracker = IoUTracker(votes=3)
+    labels = ['reading', 'writing', 'reading', 'reading', 'hand-raising', 'hand-raising']
+    smoothed = []
+    for label in labels:
+        [track_id] = tracker.update([[0, 0, 10, 10]])
+        smoothed.append(tracker.smooth(track_id, label))
+    # Ties go to the newest label; a single-frame flip is absorbed
+    assert smoothed == ['reading', 'writing', 'reading', 'reading', 'reading', 'hand-raising']
+
+
+def test_smooth_survives_state_round_trip():
+    tracker = IoUTracker(votes=3)
+    [track_id] = tracker.update([[0, 0, 10, 10]])
+    tracker.smooth(track_id, 'reading')
+    tracker.smooth(track_id, 'reading')
+
+    restored = IoUTracker(votes=3)
+    restored.load_state_dict(tracker.state_dict())
+    assert restored.update([[0, 0, 10, 10]]) == [track_id]
+    assert restored.smooth(track_id, 'writing') == 'reading'
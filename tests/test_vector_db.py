@@ -0,0 +1,144 @@
+import os
+import threading
+import numpy as np
+import pytest
+from core.config import settings
+from db.index_factory import index_kind
+from db.vector_db import VectorDB
+
+DIM = 16
+
+
+@pytest.fixture
+def gallery(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_DIM", DIM)
+    monkeypatch.setattr(settings, "FAISS_INDEX_FILE", str(tmp_path / "faiss_index.bin"))
+    monkeypatch.setattr(settings, "METADATA_FILE", str(tmp_path / "metadata.json"))
+    monkeypatch.setattr(settings, "FAISS_WAL_FILE", str(tmp_path / "faiss_index.wal"))
+    monkeypatch.setattr(settings, "FAISS_WAL_FSYNC", False)
+    monkeypatch.setattr(settings, "FAISS_SYNC_CHECK_SECONDS", 0.0)
+    # No background migrations while a test runs
+    monkeypatch.setattr(settings, "FAISS_TOMBSTONE_REBUILD_RATIO", 2.0)
+    return VectorDB
+
+
+def _vectors(n):
+    # Orthogonal unit vectors: each one only matches itself
+    return np.eye(DIM, dtype=np.float32)[:n]
+
+
+def test_wal_is_replayed_on_load(gallery):
+    db = gallery()
+    vecs = _vectors(3)
+    ids = [db.add_embedding(student_id, vec) for student_id, vec in zip((1, 2, 2), vecs)]
+    db.remove_by_faiss_id(ids[1])
+    with open(settings.FAISS_WAL_FILE, 'rb') as f:
+        assert len(f.read().splitlines()) == 4
+
+    reloaded = gallery()
+    assert reloaded.size == 2
+    assert reloaded.generation == db.generation
+    assert reloaded.get_embedding_count(2) == 1
+    assert reloaded.search_many(vecs)[0] == [1, None, 2]
+
+
+def test_torn_wal_tail_is_truncated_at_load(gallery):
+    db = gallery()
+    db.add_embedding(1, _vectors(1)[0])
+    intact = os.path.getsize(settings.FAISS_WAL_FILE)
+    with open(settings.FAISS_WAL_FILE, 'ab') as f:
+        f.write(b'{"op": "add", "id": 99, "stu')
+
+    reloaded = gallery()
+    assert reloaded.size == 1
+    assert os.path.getsize(settings.FAISS_WAL_FILE) == intact
+    # New records land after the intact prefix and survive the next load
+    reloaded.add_embedding(2, _vectors(2)[1])
+    assert gallery().search_many(_vectors(2))[0] == [1, 2]
+
+
+def test_compaction_folds_the_wal_into_the_snapshot(gallery, monkeypatch):
+    monkeypatch.setattr(settings, "FAISS_WAL_COMPACT_RECORDS", 3)
+    db = gallery()
+    vecs = _vectors(4)
+    for student_id, vec in enumerate(vecs[:3], start=1):
+        db.add_embedding(student_id, vec)
+    assert os.path.getsize(settings.FAISS_WAL_FILE) == 0
+    assert db.index.ntotal == 3 and db.metadata['ntotal'] == 3
+
+    db.add_embedding(4, vecs[3])
+    reloaded = gallery()
+    assert reloaded.index.ntotal == 3 and reloaded.size == 4
+    assert reloaded.search_many(vecs)[0] == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw"])
+def test_search_many_skips_tombstoned_vectors(gallery, monkeypatch, kind):
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", kind)
+    db = gallery()
+    vecs = _vectors(4)
+    ids = [db.add_embedding(student_id, vec) for student_id, vec in enumerate(vecs[:3], start=1)]
+    db.compact()
+    assert index_kind(db.index) == kind
+    db.add_embedding(4, vecs[3])
+
+    # One vector hidden in the read-only snapshot, one dropped from the delta
+    db.remove_by_faiss_id(ids[1])
+    db.delete_embeddings_for_student(4)
+    assert db._tombstones == {ids[1]}
+    assert db.size == 2
+
+    student_ids, sims = db.search_many(vecs, k=2)
+    assert [row[0] for row in student_ids] == [1, None, 3, None]
+    assert all(ids[1] not in row for row in student_ids)
+    assert sims[0][0] == pytest.approx(1.0)
+
+    reloaded = gallery()
+    assert reloaded.search_many(vecs)[0] == [1, None, 3, None]
+    reloaded.compact(force=True)
+    assert reloaded.search_many(vecs)[0] == [1, None, 3, None]
+
+
+def test_changes_are_visible_to_other_instances(gallery):
+    writer, reader = gallery(), gallery()
+    vecs = _vectors(2)
+    fid = writer.add_embedding(1, vecs[0])
+    assert reader.search_many(vecs)[0] == [1, None]
+    assert reader.generation == writer.generation
+
+    writer.add_embedding(2, vecs[1])
+    writer.compact()
+    assert reader.search_many(vecs)[0] == [1, 2]
+
+    writer.remove_by_faiss_id(fid)
+    assert reader.search_many(vecs)[0] == [None, 2]
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw"])
+def test_concurrent_searches_with_tombstones(gallery, monkeypatch, kind):
+    # Bigger vectors than the other tests: a long search widens the window for races
+    dim = 128
+    monkeypatch.setattr(settings, "EMBEDDING_DIM", dim)
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", kind)
+    db = gallery()
+    vecs = np.eye(dim, dtype=np.float32)
+    ids = [db.add_embedding(student_id, vec) for student_id, vec in enumerate(vecs, start=1)]
+    db.compact()
+    db.remove_by_faiss_id(ids[3])
+
+    errors = []
+
+    def search():
+        try:
+            for _ in range(300):
+                student_ids, _ = db.search_many(vecs)
+                assert student_ids[3] is None and student_ids[4] == 5
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
@@ -19,6 +19,8 @@ try:
         description="Verify DB and run minor migrations")
     parser.add_argument("--migrate-faiss-id", action="store_true",
                         help="Ensure student_photos.faiss_vector_id is BIGINT")
+    parser.add_argument("--migrate-inference-profile", action="store_true",
+                        help="Add class_sessions.inference_profile if missing")
     args = parser.parse_args()
 
     engine = create_engine(settings.DATABASE_URL)
@@ -52,6 +54,24 @@ try:
                 print("Altered faiss_vector_id to BIGINT.")
             else:
                 print("faiss_vector_id already BIGINT. No change.")
+
+        if args.migrate_inference_profile:
+            print("Checking column class_sessions.inference_profile ...")
+            q = text(
+                """
+                SELECT COUNT(*)
+                FROM INFORMATION_SCHEMA.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                  AND TABLE_NAME = 'class_sessions'
+                  AND COLUMN_NAME = 'inference_profile'
+                """
+            )
+            if connection.execute(q).scalar():
+                print("inference_profile already exists. No change.")
+            else:
+                connection.execute(
+                    text("ALTER TABLE class_sessions ADD COLUMN inference_profile VARCHAR(20) NULL"))
+                print("Added inference_profile.")
 except Exception as e:
     print(f"Connection failed: {e}")
     sys.exit(1)
@@ -0,0 +1,34 @@
+import argparse
+import multiprocessing as mp
+from core.config import settings
+from core.database import engine, Base
+from db import models  # noqa: F401 - đăng ký các bảng cho create_all
+
+
+def _run_slot(slot: int):
+    # Mỗi slot là một process riêng (model riêng, không chia sẻ predictor giữa các job)
+    from core.manager import job_manager
+    job_manager.run_worker(job_manager.default_worker_id(slot))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Video processing worker")
+    parser.add_argument("--concurrency", type=int, default=settings.WORKER_CONCURRENCY,
+                        help="Number of videos processed in parallel")
+    args = parser.parse_args()
+
+    try:
+        Base.metadata.create_all(bind=engine)
+    except Exception as e:
+        print(f"Error creating database tables: {e}")
+
+    if args.concurrency <= 1:
+        _run_slot(0)
+    else:
+        ctx = mp.get_context("spawn")
+        procs = [ctx.Process(target=_run_slot, args=(slot,), name=f"video-worker-{slot}")
+                 for slot in range(args.concurrency)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()